@@ -369,6 +369,43 @@ def lesson_4_dna_translation():
         print(f"{name}: {seq}")
         print(f"  翻译结果: {result}")
     
+    # 优化版本（选读）：处理很长的序列时，逐个密码子查字典的循环是瓶颈。
+    # 给每个密码子一个编号（A/C/G/T记为0-3，编号 = 第一位×25 + 第二位×5 + 第三位），
+    # 预先做一张"编号 → 氨基酸"的表，就能用几次整段的字节运算代替Python循环。
+    base_codes = bytearray([4]) * 256  # 非ACGT字符记为4，对应的密码子翻译成 'X'
+    for code, base in enumerate('ACGT'):
+        base_codes[ord(base)] = code
+    base_codes = bytes(base_codes)
+    
+    codon_lookup = bytearray(b'X') * 256
+    for codon, amino_acid in codon_table.items():
+        a, b, c = (base_codes[ord(base)] for base in codon)
+        codon_lookup[25 * a + 5 * b + c] = ord(amino_acid)
+    codon_lookup = bytes(codon_lookup)
+    
+    def translate_dna_fast(dna, codon_lookup=codon_lookup):
+        """translate_dna 的优化版本：结果相同，长序列快得多"""
+        start_pos = dna.find('ATG')
+        if start_pos == -1:
+            return "No start codon found"
+        
+        codes = dna.encode('ascii').translate(base_codes)
+        n_codons = (len(codes) - start_pos) // 3
+        end = start_pos + 3 * n_codons
+        # 把每个密码子的第1、2、3位各看成一个大整数（每个字节一位），按编号公式相加。
+        # 为什么可行：每个字节最大 4×25 + 4×5 + 4 = 124 < 256，不会向相邻字节进位，
+        # 所以结果的每个字节正好是对应密码子的编号
+        first = int.from_bytes(codes[start_pos:end:3], 'big')
+        second = int.from_bytes(codes[start_pos + 1:end:3], 'big')
+        third = int.from_bytes(codes[start_pos + 2:end:3], 'big')
+        indices = (25 * first + 5 * second + third).to_bytes(n_codons, 'big')
+        protein = indices.translate(codon_lookup).decode('ascii')
+        return protein.split('*', 1)[0]  # 在终止密码子处截断
+    
+    same = all(translate_dna_fast(seq) == translate_dna(seq, codon_table)
+               for seq in list(test_sequences.values()) + [dna_sequence])
+    print(f"\n优化版本与字典版本结果一致: {'✓' if same else '✗'}")
+    
     # ========== 4.3 统计分析 ==========
     print("\n📊 4.3 氨基酸组成分析")
     print("-" * 40)
@@ -162,7 +162,7 @@ def solution_3_orf_finder():
     """
     练习3参考答案：ORF预测器 ⭐⭐⭐
     
-    展示嵌套循环和break控制
+    展示单次循环 + 状态变量（orf_start）的写法
     """
     print("\n" + "=" * 60)
     print("练习3：ORF预测器 ⭐⭐⭐ - 参考答案")
@@ -186,50 +186,43 @@ def solution_3_orf_finder():
         print(f"\n阅读框 {frame}:")
         frame_orfs = []
         
-        # 搜索ATG起始密码子
-        i = frame
-        while i <= len(dna) - 3:
+        # 每个阅读框只从头到尾走一遍：
+        # 遇到ATG就记下起点，遇到终止密码子就结束当前ORF。
+        # 不需要为每个ATG再向后循环查找，运行时间与序列长度成正比。
+        orf_start = None
+        
+        for i in range(frame, len(dna) - 2, 3):
             codon = dna[i:i+3]
             
-            if codon == "ATG":
-                # 从ATG开始找终止密码子
-                j = i + 3
-                while j <= len(dna) - 3:
-                    stop_codon = dna[j:j+3]
-                    
-                    if stop_codon in stop_codons:
-                        # 找到完整的ORF
-                        orf_start = i
-                        orf_end = j + 3
-                        orf_length = orf_end - orf_start
-                        orf_seq = dna[orf_start:orf_end]
-                        aa_length = orf_length // 3 - 1  # 减去终止密码子
-                        
-                        orf_info = {
-                            'frame': frame,
-                            'start': orf_start,
-                            'end': orf_end,
-                            'length': orf_length,
-                            'sequence': orf_seq,
-                            'amino_acids': aa_length
-                        }
-                        
-                        frame_orfs.append(orf_info)
-                        all_orfs.append(orf_info)
-                        
-                        print(f"  ORF: {orf_start}-{orf_end} ({orf_length}bp, {aa_length}aa)")
-                        print(f"       {orf_seq}")
-                        
-                        # 跳到ORF结束位置
-                        i = j + 3
-                        break
-                    
-                    j += 3
-                else:
-                    # 没找到终止密码子
-                    i += 3
-            else:
-                i += 3
+            if orf_start is None:
+                if codon == "ATG":
+                    orf_start = i  # 记录起始位置
+                continue
+            
+            if codon in stop_codons:
+                # 找到完整的ORF
+                orf_end = i + 3
+                orf_length = orf_end - orf_start
+                orf_seq = dna[orf_start:orf_end]
+                aa_length = orf_length // 3 - 1  # 减去终止密码子
+                
+                orf_info = {
+                    'frame': frame,
+                    'start': orf_start,
+                    'end': orf_end,
+                    'length': orf_length,
+                    'sequence': orf_seq,
+                    'amino_acids': aa_length
+                }
+                
+                frame_orfs.append(orf_info)
+                all_orfs.append(orf_info)
+                
+                print(f"  ORF: {orf_start}-{orf_end} ({orf_length}bp, {aa_length}aa)")
+                print(f"       {orf_seq}")
+                
+                # ORF内部的ATG不再单独计算，从终止密码子之后重新开始
+                orf_start = None
         
         if not frame_orfs:
             print("  未找到完整的ORF")
@@ -265,25 +258,27 @@ def solution_4_gc_sliding_window():
     print(f"窗口大小: {window_size} bp")
     print("-" * 40)
     
-    # 存储窗口结果
+    # 存储窗口结果（只存位置和GC含量，需要显示时再切片）
     windows = []
     
-    # 滑动窗口分析
+    # 滑动窗口分析：窗口右移一位时，只需加上新进入的碱基、减去移出的碱基，
+    # 不必每次重新数整个窗口
     print("\n滑动窗口分析:")
+    gc_bases = {'G', 'C'}
+    gc_count = sum(1 for base in dna[:window_size] if base in gc_bases)
     for i in range(len(dna) - window_size + 1):
-        window = dna[i:i+window_size]
-        gc_count = window.count('G') + window.count('C')
+        if i > 0:
+            gc_count += (dna[i + window_size - 1] in gc_bases) - (dna[i - 1] in gc_bases)
         gc_percent = (gc_count / window_size) * 100
         
         windows.append({
             'position': i,
-            'sequence': window,
             'gc_percent': gc_percent
         })
         
         # 显示前10个窗口
         if i < 10:
-            print(f"  位置 {i:2d}: {window} GC={gc_percent:5.1f}%")
+            print(f"  位置 {i:2d}: {dna[i:i+window_size]} GC={gc_percent:5.1f}%")
     
     # 统计分析
     gc_values = [w['gc_percent'] for w in windows]
@@ -301,8 +296,9 @@ def solution_4_gc_sliding_window():
     min_window = min(windows, key=lambda x: x['gc_percent'])
     
     print(f"\n🔍 极值窗口:")
-    print(f"  GC最高: 位置{max_window['position']} {max_window['sequence']} ({max_window['gc_percent']:.1f}%)")
-    print(f"  GC最低: 位置{min_window['position']} {min_window['sequence']} ({min_window['gc_percent']:.1f}%)")
+    for label, w in (("GC最高", max_window), ("GC最低", min_window)):
+        position = w['position']
+        print(f"  {label}: 位置{position} {dna[position:position+window_size]} ({w['gc_percent']:.1f}%)")
     
     # 识别CpG岛候选
     cpg_islands = [w for w in windows if w['gc_percent'] > 60]
@@ -310,7 +306,8 @@ def solution_4_gc_sliding_window():
     if cpg_islands:
         print(f"\n🏝️ CpG岛候选 (GC>60%): {len(cpg_islands)} 个窗口")
         for island in cpg_islands[:3]:  # 只显示前3个
-            print(f"  位置{island['position']:2d}: {island['sequence']} ({island['gc_percent']:.1f}%)")
+            position = island['position']
+            print(f"  位置{position:2d}: {dna[position:position+window_size]} ({island['gc_percent']:.1f}%)")
 
 
 def solution_5_codon_usage():
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chapter 04 工具模块：只用标准库的查表翻译
+
+按密码子切片、查字典、拼接字符串，每个密码子都要经过好几次Python对象操作。
+这里把翻译拆成几步整段处理的操作（都在C层面完成，没有逐密码子的Python循环）：
+
+1. bytes.translate 把每个碱基编码成 0-4（T/U=0, C=1, A=2, G=3，其他字符=4）
+2. 按步长3切出每个密码子的第1、2、3位
+3. 密码子编号 = 第一位×25 + 第二位×5 + 第三位（0-124，正好放进一个字节）。
+   把三段字节串当作大整数相加：每个字节最大 4×25 + 4×5 + 4 = 124，
+   不会向相邻字节进位，所以一次大整数运算就算出了所有密码子的编号
+4. 再用一次 bytes.translate 按编号查表，得到的字节就是蛋白质序列
+
+查表用的是预先算好的 5×5×5 = 125 项表（存成 bytes.translate 用的256字节）：
+64个标准密码子按遗传密码表翻译，
+含非ACGT字符的密码子一律为 'X'。也可以从自定义的密码子字典生成。
+（Chapter 09 的 translation.py 是同样思路的NumPy版本，支持IUPAC简并碱基）
+"""
+
+import random
+import time
+from itertools import product
+
+
+# NCBI遗传密码表，按 TCAG × TCAG × TCAG 的顺序排列64个密码子
+NCBI_CODES = {
+    1: 'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',  # 标准密码表
+    2: 'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSS**VVVVAAAADDEEGGGG',  # 脊椎动物线粒体
+    11: 'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG',  # 细菌和质体
+}
+
+BASES = 'TCAG'
+_OTHER = len(BASES)
+
+# 碱基 → 0-4 的编码表（大小写、RNA的U都可以）
+_BASE_CODES = bytearray([_OTHER]) * 256
+for _code, _base in enumerate(BASES):
+    _BASE_CODES[ord(_base)] = _BASE_CODES[ord(_base.lower())] = _code
+_BASE_CODES[ord('U')] = _BASE_CODES[ord('u')] = BASES.index('T')
+_BASE_CODES = bytes(_BASE_CODES)
+
+_COMPLEMENT = str.maketrans('ACGTUacgtu', 'TGCAAtgcaa')
+
+
+def build_lookup(codon_table):
+    """
+    密码子字典（如 {'ATG': 'M', ...}）或NCBI表编号 → 256字节的查表
+
+    第 25a + 5b + c 项是密码子 (a, b, c) 翻译成的氨基酸，
+    字典中没有的密码子和含非ACGT字符的密码子为 'X'
+    """
+    if isinstance(codon_table, int):
+        codon_table = {''.join(codon): amino_acid for codon, amino_acid
+                       in zip(product(BASES, repeat=3), NCBI_CODES[codon_table])}
+    lookup = bytearray(b'X') * 256
+    for a, b, c in product(range(_OTHER), repeat=3):
+        codon = BASES[a] + BASES[b] + BASES[c]
+        lookup[25 * a + 5 * b + c] = ord(codon_table.get(codon, 'X'))
+    return bytes(lookup)
+
+
+STANDARD_LOOKUP = build_lookup(1)
+
+
+def translate(sequence, lookup=STANDARD_LOOKUP, frame=0, to_stop=False):
+    """
+    整段翻译，末尾不足一个密码子的碱基忽略
+
+    参数：
+        lookup: build_lookup() 生成的查表，默认为标准密码表
+        frame: 从第几个碱基开始（0、1、2）
+        to_stop: 为True时在第一个终止密码子处截断（不含 '*'）
+    """
+    codes = sequence.encode('ascii').translate(_BASE_CODES)
+    n_codons = (len(codes) - frame) // 3
+    if n_codons <= 0:
+        return ''
+    end = frame + 3 * n_codons
+    first = int.from_bytes(codes[frame:end:3], 'big')
+    second = int.from_bytes(codes[frame + 1:end:3], 'big')
+    third = int.from_bytes(codes[frame + 2:end:3], 'big')
+    indices = (25 * first + 5 * second + third).to_bytes(n_codons, 'big')
+    protein = indices.translate(lookup).decode('ascii')
+    if to_stop:
+        stop = protein.find('*')
+        if stop >= 0:
+            protein = protein[:stop]
+    return protein
+
+
+def translate_codon(codon, lookup=STANDARD_LOOKUP):
+    """翻译单个密码子；长度不是3时为 'X'"""
+    if len(codon) != 3:
+        return 'X'
+    return translate(codon, lookup)
+
+
+def reverse_complement(sequence):
+    return sequence.translate(_COMPLEMENT)[::-1]
+
+
+def six_frames(sequence, lookup=STANDARD_LOOKUP, to_stop=False):
+    """六框翻译：返回 {'+1': ..., '+2': ..., '+3': ..., '-1': ..., '-2': ..., '-3': ...}"""
+    reverse = reverse_complement(sequence)
+    frames = {}
+    for frame in range(3):
+        frames[f"+{frame + 1}"] = translate(sequence, lookup, frame, to_stop)
+        frames[f"-{frame + 1}"] = translate(reverse, lookup, frame, to_stop)
+    return frames
+
+
+def translate_many(sequences, lookup=STANDARD_LOOKUP, to_stop=False):
+    """
+    批量翻译许多ORF：每条截到整数个密码子后拼接，整体只翻译一次，再按长度切开
+    """
+    trimmed = [sequence[:len(sequence) // 3 * 3] for sequence in sequences]
+    protein = translate(''.join(trimmed), lookup)
+    proteins = []
+    start = 0
+    for sequence in trimmed:
+        end = start + len(sequence) // 3
+        piece = protein[start:end]
+        if to_stop:
+            stop = piece.find('*')
+            piece = piece if stop < 0 else piece[:stop]
+        proteins.append(piece)
+        start = end
+    return proteins
+
+
+def translate_dict_loop(dna, codon_table, to_stop=False):
+    """对照组：逐密码子切片查字典"""
+    protein = []
+    for i in range(0, len(dna) - 2, 3):
+        amino_acid = codon_table.get(dna[i:i+3], 'X')
+        if to_stop and amino_acid == '*':
+            break
+        protein.append(amino_acid)
+    return ''.join(protein)
+
+
+def benchmark_translation(sequence_length=10_000_000, seed=21):
+    """性能对比：10 Mb 随机序列上的字典循环与查表翻译"""
+    rng = random.Random(seed)
+    dna = ''.join(rng.choices('ACGT', k=sequence_length))
+    codon_table = {''.join(codon): amino_acid for codon, amino_acid
+                   in zip(product(BASES, repeat=3), NCBI_CODES[1])}
+
+    print(f"\n⏱️ 翻译性能对比（随机序列 {sequence_length / 1e6:.0f} Mb）")
+    start_time = time.perf_counter()
+    loop_protein = translate_dict_loop(dna, codon_table)
+    loop_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    protein = translate(dna)
+    lookup_time = time.perf_counter() - start_time
+
+    print(f"   结果一致性检查: {'✓' if protein == loop_protein else '✗'}")
+    print(f"   字典循环: {loop_time:.3f}秒")
+    print(f"   查表翻译: {lookup_time:.3f}秒（字典循环的 {loop_time / lookup_time:.0f} 倍）")
+    return {'dict_loop': loop_time, 'lookup': lookup_time}
+
+
+if __name__ == "__main__":
+    benchmark_translation()
@@ -10,6 +10,8 @@ Chapter 04: 函数 - 实验室的标准操作流程(SOP)
 4. 函数组合与工具库构建
 """
 
+import codon_translation
+
 
 def demo_why_functions():
     """
@@ -407,6 +409,13 @@ def demo_scope_concepts():
     print(f"DNA: {test_dna}")
     print(f"蛋白质: {result}")
     
+    # 优化版本（选读）：codon_translation.py 先把密码子表换成"密码子编号 → 氨基酸"的查表，
+    # 再用几次整段的字节运算翻译整条序列，不再逐个密码子调用函数、查字典，
+    # 长序列快得多（原理见该模块开头的说明）
+    fast_result = codon_translation.translate(
+        test_dna, codon_translation.build_lookup(CODON_TABLE), to_stop=True)
+    print(f"优化版本: {fast_result} {'✓' if fast_result == result else '✗'}")
+    
     print("\n作用域要点:")
     print("• 全局变量: 整个程序可见")
     print("• 局部变量: 只在函数内可见")
@@ -14,10 +14,25 @@ Chapter 05: 文件IO与FASTA处理 - 你的数字实验记录本
 本章重点：从简单到复杂，逐步构建专业的FASTA解析器
 """
 
+import mmap
 import os
 import time
 
 
+# v4解析器使用的查找表（模块加载时只构建一次）
+# IUPAC核苷酸代码，与v3的 valid_chars 保持一致
+VALID_SEQ_CHARS = b'ATCGURNKMYSWHBVD'
+# 256项翻译表：小写字母 → 大写字母，其余字节保持不变
+_UPPER_TABLE = bytes.maketrans(bytes(range(97, 123)), bytes(range(65, 91)))
+# 需要删除的字节：所有不是有效核苷酸（不区分大小写）的字节，包括 \r 和 \n
+_DELETE_BYTES = bytes(
+    b for b in range(256)
+    if b not in VALID_SEQ_CHARS and b not in VALID_SEQ_CHARS.lower()
+)
+# 为空ID的标题计算行号时，每次最多复制这么多字节来数换行符
+_LINE_COUNT_WINDOW = 1 << 24
+
+
 def demonstrate_file_as_notebook():
     """
     演示1：文件操作就像使用实验记录本
@@ -193,6 +208,159 @@ def parse_fasta_v3_professional(filename):
         print(f"❌ 未知错误：{e}")
 
 
+def parse_fasta_v4_mmap(filename, as_bytes=False):
+    """
+    FASTA解析器 v4：内存映射版本（GB级基因组）
+
+    与v3输出完全相同的字典结构，可以直接替换v3使用。
+
+    原理：
+    - mmap把文件"映射"到内存，由操作系统按需读取，不会一次性占满内存
+    - 用 find(b'\\n>') 直接定位记录边界，而不是逐行处理
+    - 每条记录只调用一次 bytes.translate()：同时完成去换行、
+      字符验证（预先构建的256项查找表）和转大写
+
+    参数：
+        filename: FASTA文件路径
+        as_bytes: 为True时 'sequence' 返回bytes，省去解码开销
+    """
+    print("\n🔬 版本4：内存映射解析器（GB级基因组）")
+
+    try:
+        with open(filename, 'rb') as f:
+            # 空文件无法映射，直接结束
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                size = len(mm)
+
+                # 找到第一条记录（标题行之前的内容会被忽略，与v3一致）
+                if mm[:1] == b'>':
+                    start = 0
+                else:
+                    first = mm.find(b'\n>')
+                    if first == -1:
+                        return
+                    start = first + 1
+
+                # 行号只在遇到空ID的标题时才需要：从上次数到的位置接着数，
+                # 每个字节最多数一次，且每次只复制一个窗口
+                counted_to = 0
+                lines_before = 0  # mm[:counted_to] 中的换行符数
+
+                while start < size:
+                    # 标题行结束位置 & 下一条记录的起点
+                    header_end = mm.find(b'\n', start)
+                    if header_end == -1:
+                        header_end = size
+                    next_header = mm.find(b'\n>', header_end)
+                    record_end = size if next_header == -1 else next_header + 1
+
+                    # 解析标题行
+                    header_parts = mm[start + 1:header_end].decode('utf-8').split(None, 1)
+                    if header_parts:
+                        seq_id = header_parts[0]
+                    else:
+                        # 与v3相同：没有ID时使用行号命名
+                        while counted_to < start:
+                            window_end = min(start, counted_to + _LINE_COUNT_WINDOW)
+                            lines_before += mm[counted_to:window_end].count(b'\n')
+                            counted_to = window_end
+                        seq_id = f"seq_{lines_before + 1}"
+                    description = header_parts[1].strip() if len(header_parts) > 1 else ""
+
+                    body = mm[header_end:record_end]
+
+                    # 罕见情况：序列中夹有注释行，先逐行去掉
+                    if b'#' in body:
+                        body = b'\n'.join(
+                            line for line in body.split(b'\n')
+                            if not line.lstrip().startswith(b'#')
+                        )
+
+                    # 一次translate：删除换行和无效字符，同时转为大写
+                    sequence = body.translate(_UPPER_TABLE, _DELETE_BYTES)
+
+                    yield {
+                        'id': seq_id,
+                        'description': description,
+                        'sequence': sequence if as_bytes else sequence.decode('ascii'),
+                        'length': len(sequence)
+                    }
+
+                    start = record_end
+
+    except FileNotFoundError:
+        print(f"❌ 错误：找不到文件 '{filename}'")
+        print("   提示：请检查文件路径是否正确")
+    except PermissionError:
+        print(f"❌ 错误：没有权限读取文件 '{filename}'")
+    except UnicodeDecodeError:
+        print(f"❌ 错误：文件编码问题，尝试用其他编码打开")
+    except Exception as e:
+        print(f"❌ 未知错误：{e}")
+
+
+def write_synthetic_genome(filename, size_mb=8, n_records=20, line_width=60):
+    """
+    生成用于基准测试的模拟基因组FASTA文件
+
+    用 os.urandom + translate 批量生成随机碱基，比 random.choices 快得多，
+    可以在几十秒内写出1 GB的文件。
+    """
+    # 把0-255的随机字节映射成ACGT
+    base_table = bytes(b'ACGT'[i % 4] for i in range(256))
+    record_length = size_mb * 1_000_000 // n_records
+
+    with open(filename, 'wb') as f:
+        for i in range(1, n_records + 1):
+            f.write(f">chr{i} synthetic chromosome {i}\n".encode())
+            sequence = os.urandom(record_length).translate(base_table)
+            f.write(b'\n'.join(
+                sequence[j:j + line_width]
+                for j in range(0, record_length, line_width)
+            ))
+            f.write(b'\n')
+
+
+def benchmark_fasta_parsers(size_mb=8, filename="benchmark_genome.fasta"):
+    """
+    对比v1/v2/v3/v4四个解析器的速度
+
+    参数：
+        size_mb: 模拟文件大小（MB），真实评测可以设为1024（1 GB）
+
+    注意：v1和v2会把所有序列放进列表，大文件时请确认内存充足
+    """
+    print(f"\n⏱️ 解析器基准测试（模拟文件 {size_mb} MB）")
+    write_synthetic_genome(filename, size_mb=size_mb)
+    file_mb = os.path.getsize(filename) / 1_000_000
+
+    parsers = [
+        ("v1 简单分割", lambda: parse_fasta_v1_simple(filename)),
+        ("v2 逐行读取", lambda: parse_fasta_v2_improved(filename)),
+        ("v3 生成器", lambda: list(parse_fasta_v3_professional(filename))),
+        ("v4 内存映射", lambda: list(parse_fasta_v4_mmap(filename))),
+    ]
+
+    results = {}
+    try:
+        for name, run in parsers:
+            start_time = time.perf_counter()
+            records = run()
+            elapsed = time.perf_counter() - start_time
+            results[name] = elapsed
+            print(f"   {name}: {elapsed:.3f}秒 "
+                  f"({file_mb / elapsed:.1f} MB/s, {len(records)} 条序列)")
+    finally:
+        os.remove(filename)
+
+    speedup = results["v3 生成器"] / results["v4 内存映射"]
+    print(f"\n   v4 相比 v3 提速 {speedup:.1f} 倍")
+    return results
+
+
 def demonstrate_fasta_parsing_evolution():
     """
     演示2：FASTA解析器的渐进式改进
@@ -242,7 +410,13 @@ NVTWFHAIHVSGTNGTKRFDNPVLPFNDGVYFASTEKSNIIRGWIFGTTLDSKTQSLLIV"""
         print(f"   - ID: {seq_record['id'][:20]}...")
         print(f"     长度: {seq_record['length']} bp")
         print(f"     描述: {seq_record['description'][:40]}...")
-    
+
+    # 版本4：内存映射（结果应与v3完全一致）
+    v3_records = list(parse_fasta_v3_professional("test_sequences.fasta"))
+    v4_records = list(parse_fasta_v4_mmap("test_sequences.fasta"))
+    print(f"   解析结果：找到 {len(v4_records)} 条序列，"
+          f"与v3一致：{'✓' if v3_records == v4_records else '✗'}")
+
     # 清理测试文件
     os.remove("test_sequences.fasta")
     print("\n   [测试文件已清理]")
@@ -418,6 +592,7 @@ def main():
     demonstrate_fasta_parsing_evolution()
     demonstrate_large_file_handling()
     demonstrate_error_handling()
+    benchmark_fasta_parsers(size_mb=8)
     
     # 学习总结
     print("\n\n" + "=" * 60)
@@ -431,6 +606,7 @@ def main():
     print("   • v1: 简单分割（学习概念）")
     print("   • v2: 逐行处理（实际应用）")
     print("   • v3: 生成器+错误处理（生产级别）")
+    print("   • v4: mmap+translate（GB级基因组）")
     print()
     print("3. 大文件处理技巧：")
     print("   • 避免read()一次性读取")
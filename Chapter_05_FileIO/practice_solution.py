@@ -6,8 +6,317 @@ Chapter 05: 文件IO与FASTA处理 - 练习题参考答案
 完整的参考实现，包含详细注释和最佳实践
 """
 
-import os
+import argparse
 import glob
+import os
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+
+# 批量处理时每次读取的字节数（固定大小，内存占用与文件大小无关）
+BATCH_CHUNK_SIZE = 1 << 20  # 1 MB
+# 统计序列长度时需要去掉的空白字节
+_WHITESPACE_BYTES = b' \t\r\n'
+
+
+# 质量控制时把小写碱基转成大写的翻译表
+_QC_UPPER_TABLE = bytes.maketrans(b'acgtn', b'ACGTN')
+# 输出FASTA时每行的碱基数
+FASTA_LINE_WIDTH = 60
+
+
+def iter_fasta_records(filepath):
+    """
+    逐条读取FASTA记录：每次只在内存中保留一条序列
+
+    产出 (标题行, 序列bytes)，标题行不含'>'
+    """
+    header = None
+    lines = []
+    with open(filepath, 'rb') as f:
+        for line in f:
+            if line.startswith(b'>'):
+                if header is not None:
+                    yield header, b''.join(lines).translate(None, _WHITESPACE_BYTES)
+                header = line[1:].strip().decode('utf-8')
+                lines = []
+            elif header is not None:
+                lines.append(line)
+    if header is not None:
+        yield header, b''.join(lines).translate(None, _WHITESPACE_BYTES)
+
+
+def base_composition(sequence):
+    """
+    计算一条序列的组成直方图（每条记录只算一次，所有规则共用）
+
+    返回 {'A': n, 'C': n, 'G': n, 'T': n, 'N': n, 'length': n}
+    """
+    upper = sequence.translate(_QC_UPPER_TABLE)
+    composition = {base: upper.count(base.encode()) for base in 'ACGTN'}
+    composition['length'] = len(sequence)
+    return composition
+
+
+# ---- 质量控制规则 ----
+# 每条规则是 (规则名, 判断函数)；判断函数接收组成直方图，
+# 不通过时返回原因字符串，通过时返回None。规则可以自由组合。
+
+def min_length_rule(min_length=50):
+    """序列长度下限"""
+    def check(composition):
+        if composition['length'] < min_length:
+            return f"太短 ({composition['length']} < {min_length})"
+        return None
+    return ('length', check)
+
+
+def max_n_rule(max_n_percent=5):
+    """N碱基比例上限"""
+    def check(composition):
+        length = composition['length']
+        if composition['N'] > length * max_n_percent / 100:
+            return f"N含量过高 ({composition['N'] / length * 100:.1f}%)"
+        return None
+    return ('n_content', check)
+
+
+def low_complexity_rule(max_base_fraction=0.8):
+    """单一碱基占比上限（低复杂度序列）"""
+    def check(composition):
+        for base in 'ATCG':
+            if composition[base] > composition['length'] * max_base_fraction:
+                return f"低复杂度 ({base}占比>{max_base_fraction:.0%})"
+        return None
+    return ('low_complexity', check)
+
+
+def format_fasta_record(header, sequence, line_width=FASTA_LINE_WIDTH):
+    """把一条记录拼成完整的FASTA文本块（bytes），一次write即可写出"""
+    lines = [sequence[i:i + line_width] for i in range(0, len(sequence), line_width)]
+    return b'>' + header.encode('utf-8') + b'\n' + b''.join(line + b'\n' for line in lines)
+
+
+def count_fasta_file(filepath, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    按固定大小的字节块流式统计一个FASTA文件（在工作进程中运行）
+
+    只返回一个很小的计数字典，而不是序列本身，方便在进程之间传递和合并：
+        {'count': 序列数, 'total_length': 总碱基数, 'gc_count': G+C数}
+    标题行可能被切在两个块之间，所以用 in_header 记录跨块的状态。
+    第一个'>'之前的内容不属于任何记录，不计入（与按记录解析的版本一致）。
+    """
+    counts = {'count': 0, 'total_length': 0, 'gc_count': 0}
+    in_header = False
+    seen_header = False
+    record_length = 0  # 当前序列的长度（只统计非空序列，与串行版本一致）
+
+    with open(filepath, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+
+            pos = 0
+            while pos < len(chunk):
+                if in_header:
+                    # 跳过标题行剩余部分
+                    line_end = chunk.find(b'\n', pos)
+                    if line_end == -1:
+                        break
+                    pos = line_end + 1
+                    in_header = False
+                    continue
+
+                # 序列区域一直延伸到下一个'>'或块末尾
+                header_start = chunk.find(b'>', pos)
+                region_end = len(chunk) if header_start == -1 else header_start
+                if seen_header:
+                    region = chunk[pos:region_end].translate(None, _WHITESPACE_BYTES)
+                    record_length += len(region)
+                    counts['total_length'] += len(region)
+                    counts['gc_count'] += (region.count(b'G') + region.count(b'C') +
+                                           region.count(b'g') + region.count(b'c'))
+
+                if header_start == -1:
+                    break
+
+                # 遇到新标题：结束上一条序列
+                if record_length > 0:
+                    counts['count'] += 1
+                record_length = 0
+                in_header = seen_header = True
+                pos = header_start + 1
+
+    if record_length > 0:
+        counts['count'] += 1
+
+    return counts
+
+
+def merge_counts(counts_list):
+    """合并多个计数字典（例如同一样本被拆成多个文件时）"""
+    merged = {'count': 0, 'total_length': 0, 'gc_count': 0}
+    for counts in counts_list:
+        for key in merged:
+            merged[key] += counts[key]
+    return merged
+
+
+def run_batch_counts(files, workers=1, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    统计一批文件，返回与 files 顺序一致的计数列表
+
+    workers > 1 时使用进程池并行；executor.map 保证结果顺序与输入一致，
+    因此无论哪个进程先完成，输出都是确定的。
+    """
+    if workers <= 1:
+        return [count_fasta_file(path, chunk_size) for path in files]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(count_fasta_file, files,
+                                 [chunk_size] * len(files)))
+
+
+def measure_peak_memory(func, *args, **kwargs):
+    """
+    用tracemalloc测量一次函数调用的Python内存峰值（字节）
+
+    如果函数返回生成器，会把它完整迭代一遍再统计
+    """
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        if hasattr(result, '__next__'):
+            for _ in result:
+                pass
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def process_large_genome(filename, chunk_size=1000000):
+    """
+    大基因组处理器 - 按固定大小的字节块滚动读取
+    
+    每次只读取chunk_size字节，边读边累加当前染色体的长度、GC数和N数，
+    从不拼接整条染色体，因此内存峰值是O(chunk_size)，与染色体长度无关。
+    'position' 是该染色体序列在文件中的起始字节偏移。
+    """
+    current_chr = None
+    header_parts = []  # 标题行可能跨越两个块
+    in_header = False
+    position = 0
+    file_offset = 0  # 当前块在文件中的起始偏移
+    length = gc = n_count = 0
+    
+    def header_name(offset):
+        fields = b''.join(header_parts).decode('utf-8').split()
+        return fields[0] if fields else f"chr_at_{offset}"
+    
+    def make_record():
+        return {
+            'chromosome': current_chr,
+            'length': length,
+            'gc_content': (gc / length * 100) if length > 0 else 0,
+            'n_count': n_count,
+            'position': position
+        }
+    
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            
+            pos = 0
+            while pos < len(chunk):
+                if in_header:
+                    line_end = chunk.find(b'\n', pos)
+                    if line_end == -1:
+                        header_parts.append(chunk[pos:])
+                        break
+                    header_parts.append(chunk[pos:line_end])
+                    
+                    # 新染色体
+                    current_chr = header_name(file_offset + pos)
+                    position = file_offset + line_end + 1  # 序列起始字节
+                    in_header = False
+                    pos = line_end + 1
+                    continue
+                
+                # 序列区域：累加计数，不保存序列
+                header_start = chunk.find(b'>', pos)
+                region_end = len(chunk) if header_start == -1 else header_start
+                if current_chr is not None:
+                    region = chunk[pos:region_end].translate(_QC_UPPER_TABLE, _WHITESPACE_BYTES)
+                    length += len(region)
+                    gc += region.count(b'G') + region.count(b'C')
+                    n_count += region.count(b'N')
+                
+                if header_start == -1:
+                    break
+                
+                # 遇到新标题：输出前一条染色体
+                if current_chr is not None:
+                    yield make_record()
+                length = gc = n_count = 0
+                header_parts = []
+                in_header = True
+                pos = header_start + 1
+            
+            file_offset += len(chunk)
+    
+    # 处理最后一条；文件以没有换行符的标题行结尾时，这个标题是一条空序列，
+    # 前一条染色体在遇到它时已经输出过了
+    if in_header:
+        current_chr = header_name(file_offset)
+        position = file_offset
+    if current_chr is not None:
+        yield make_record()
+
+
+def benchmark_batch_processing(n_files=32, file_mb=4, worker_counts=(1, 2, 4, 8)):
+    """
+    批量处理吞吐量测试：分别用1、2、4、8个进程处理同一批文件
+
+    参数：
+        n_files: 模拟样本文件数
+        file_mb: 每个文件的大小（MB）
+    """
+    print("\n" + "=" * 60)
+    print(f"批量处理吞吐量测试 ({n_files} 个文件 × {file_mb} MB)")
+    print("-" * 60)
+
+    base_table = bytes(b'ACGT'[i % 4] for i in range(256))
+    files = []
+    for i in range(n_files):
+        filename = f"bench_sample_{i:03d}.fasta"
+        with open(filename, 'wb') as f:
+            for j in range(file_mb):
+                f.write(f">read_{j}\n".encode())
+                sequence = os.urandom(1_000_000).translate(base_table)
+                f.write(b'\n'.join(sequence[k:k + 60]
+                                   for k in range(0, len(sequence), 60)))
+                f.write(b'\n')
+        files.append(filename)
+
+    total_mb = sum(os.path.getsize(path) for path in files) / 1_000_000
+    timings = {}
+    try:
+        for workers in worker_counts:
+            start_time = time.perf_counter()
+            run_batch_counts(files, workers=workers)
+            elapsed = time.perf_counter() - start_time
+            timings[workers] = elapsed
+            print(f"  {workers} 个进程: {elapsed:.2f}秒 ({total_mb / elapsed:.1f} MB/s)")
+    finally:
+        for path in files:
+            os.remove(path)
+
+    return timings
 
 
 def practice_1_basic_file_operations():
@@ -161,99 +470,59 @@ AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA
     with open("raw_sequences.fasta", "w") as f:
         f.write(raw_fasta)
     
-    def filter_sequences(input_file, output_file, min_length=50, max_n_percent=5):
+    def filter_sequences(input_file, output_file, min_length=50, max_n_percent=5,
+                         rules=None, verbose=False):
         """
-        过滤低质量序列 - 完整实现
+        过滤低质量序列 - 流式实现
+        
+        每条记录只计算一次组成直方图，再依次交给各条规则判断；
+        输出通过带缓冲区的二进制写入器，每条记录只调用一次write。
+        内存占用只与单条序列长度有关，可以处理上千万条reads。
+        
+        返回：(保留数, 过滤数, 每条规则的淘汰计数)
         """
+        if rules is None:
+            rules = [
+                min_length_rule(min_length),
+                max_n_rule(max_n_percent),
+                low_complexity_rule(0.8),
+            ]
+        
         kept_count = 0
         filtered_count = 0
+        rejections = {name: 0 for name, _ in rules}
         
-        with open(output_file, 'w') as out_f:
-            current_header = None
-            current_seq = []
-            
-            with open(input_file, 'r') as in_f:
-                for line in in_f:
-                    line = line.strip()
-                    
-                    if not line:
-                        continue
-                    
-                    if line.startswith('>'):
-                        # 处理前一条序列
-                        if current_header:
-                            sequence = ''.join(current_seq).upper()
-                            
-                            # 质量检查
-                            passed = True
-                            reason = ""
-                            
-                            # 检查长度
-                            if len(sequence) < min_length:
-                                passed = False
-                                reason = f"太短 ({len(sequence)} < {min_length})"
-                            
-                            # 检查N含量
-                            elif sequence.count('N') > len(sequence) * max_n_percent / 100:
-                                passed = False
-                                n_percent = sequence.count('N') / len(sequence) * 100
-                                reason = f"N含量过高 ({n_percent:.1f}%)"
-                            
-                            # 检查复杂度
-                            else:
-                                for base in 'ATCG':
-                                    if sequence.count(base) > len(sequence) * 0.8:
-                                        passed = False
-                                        reason = f"低复杂度 ({base}占比>80%)"
-                                        break
-                            
-                            # 输出结果
-                            if passed:
-                                out_f.write(f">{current_header}\n")
-                                # 每60个字符换行（标准FASTA格式）
-                                for i in range(0, len(sequence), 60):
-                                    out_f.write(sequence[i:i+60] + "\n")
-                                kept_count += 1
-                            else:
-                                filtered_count += 1
-                                print(f"  过滤: {current_header.split()[0]} - {reason}")
-                        
-                        # 开始新序列
-                        current_header = line[1:]
-                        current_seq = []
-                    else:
-                        current_seq.append(line)
+        with open(output_file, 'wb', buffering=1 << 20) as out_f:
+            for header, sequence in iter_fasta_records(input_file):
+                composition = base_composition(sequence)
                 
-                # 处理最后一条序列
-                if current_header:
-                    sequence = ''.join(current_seq).upper()
-                    
-                    passed = True
-                    if len(sequence) < min_length:
-                        passed = False
-                    elif sequence.count('N') > len(sequence) * max_n_percent / 100:
-                        passed = False
-                    else:
-                        for base in 'ATCG':
-                            if sequence.count(base) > len(sequence) * 0.8:
-                                passed = False
-                                break
-                    
-                    if passed:
-                        out_f.write(f">{current_header}\n")
-                        for i in range(0, len(sequence), 60):
-                            out_f.write(sequence[i:i+60] + "\n")
-                        kept_count += 1
-                    else:
-                        filtered_count += 1
+                # 按顺序检查规则，第一条不通过的规则即为淘汰原因
+                reason = None
+                for name, check in rules:
+                    reason = check(composition)
+                    if reason:
+                        rejections[name] += 1
+                        break
+                
+                if reason is None:
+                    out_f.write(format_fasta_record(header, sequence.upper()))
+                    kept_count += 1
+                else:
+                    filtered_count += 1
+                    if verbose:
+                        print(f"  过滤: {header.split()[0]} - {reason}")
         
-        return kept_count, filtered_count
+        return kept_count, filtered_count, rejections
     
     # 执行质量控制
-    kept, filtered = filter_sequences("raw_sequences.fasta", "clean.fasta")
+    kept, filtered, rejections = filter_sequences("raw_sequences.fasta", "clean.fasta",
+                                                  verbose=True)
     print(f"\n质量控制结果:")
     print(f"  ✓ 保留: {kept} 条高质量序列")
     print(f"  ✗ 过滤: {filtered} 条低质量序列")
+    print(f"  各规则淘汰数:")
+    for rule_name, count in rejections.items():
+        print(f"    {rule_name}: {count}")
     
     # 清理文件
     os.remove("raw_sequences.fasta")
@@ -261,9 +530,12 @@ AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA
         os.remove("clean.fasta")
 
 
-def practice_4_batch_processing():
+def practice_4_batch_processing(workers=1):
     """
     练习4参考答案: 批量文件处理 ⭐⭐
+    
+    参数：
+        workers: 并行进程数（1表示串行）
     """
     print("\n" + "=" * 60)
     print("练习4: 批量序列分析 ⭐⭐ [参考答案]")
@@ -292,51 +564,23 @@ ATATATATATATATATATATATATATATATATATATATATATATATAT
         with open(filename, "w") as f:
             f.write(content)
     
-    def batch_analyze_fasta(file_pattern="*.fasta"):
+    def batch_analyze_fasta(file_pattern="*.fasta", workers=1):
         """
         批量分析FASTA文件 - 完整实现
+        
+        workers > 1 时每个文件交给一个工作进程，按字节块流式统计，
+        结果按文件名排序，保证输出顺序确定
         """
         results = {}
         
-        # 获取所有匹配的文件
-        files = glob.glob(file_pattern)
+        # 获取所有匹配的文件（排序保证结果顺序确定）
+        files = sorted(glob.glob(file_pattern))
         
-        for filepath in files:
+        for filepath, counts in zip(files, run_batch_counts(files, workers=workers)):
             filename = os.path.basename(filepath)
-            
-            # 初始化统计
-            seq_count = 0
-            total_length = 0
-            gc_count = 0
-            
-            # 解析文件
-            with open(filepath, 'r') as f:
-                current_seq = []
-                
-                for line in f:
-                    line = line.strip()
-                    
-                    if not line:
-                        continue
-                    
-                    if line.startswith('>'):
-                        # 处理前一条序列
-                        if current_seq:
-                            sequence = ''.join(current_seq).upper()
-                            seq_count += 1
-                            total_length += len(sequence)
-                            gc_count += sequence.count('G') + sequence.count('C')
-                        
-                        current_seq = []
-                    else:
-                        current_seq.append(line)
-                
-                # 处理最后一条序列
-                if current_seq:
-                    sequence = ''.join(current_seq).upper()
-                    seq_count += 1
-                    total_length += len(sequence)
-                    gc_count += sequence.count('G') + sequence.count('C')
+            seq_count = counts['count']
+            total_length = counts['total_length']
+            gc_count = counts['gc_count']
             
             # 计算统计信息
             results[filename] = {
@@ -349,10 +593,10 @@ ATATATATATATATATATATATATATATATATATATATATATATATAT
         return results
     
     # 执行批量分析
-    stats = batch_analyze_fasta("sample_*.fasta")
+    stats = batch_analyze_fasta("sample_*.fasta", workers=workers)
     
-    print(f"\n批量分析结果 ({len(stats)} 个文件):")
-    for filename, stat in sorted(stats.items()):
+    print(f"\n批量分析结果 ({len(stats)} 个文件, {workers} 个进程):")
+    for filename, stat in stats.items():
         print(f"\n{filename}:")
         print(f"  序列数: {stat['count']}")
         print(f"  总长度: {stat['total_length']} bp")
@@ -511,57 +755,6 @@ def practice_6_large_genome_processor():
                 seq = ''.join(random.choices('ATCG', k=100))
                 f.write(seq + "\n")
     
-    def process_large_genome(filename, chunk_size=1000000):
-        """
-        大基因组处理器 - 使用生成器
-        """
-        with open(filename, 'r') as f:
-            current_chr = None
-            current_seq = []
-            position = 0
-            
-            for line in f:
-                line = line.strip()
-                
-                if not line:
-                    continue
-                
-                if line.startswith('>'):
-                    # 处理前一条染色体
-                    if current_chr:
-                        sequence = ''.join(current_seq)
-                        length = len(sequence)
-                        gc = sequence.count('G') + sequence.count('C')
-                        gc_content = (gc / length * 100) if length > 0 else 0
-                        
-                        yield {
-                            'chromosome': current_chr,
-                            'length': length,
-                            'gc_content': gc_content,
-                            'position': position
-                        }
-                    
-                    # 新染色体
-                    current_chr = line[1:].split()[0]
-                    current_seq = []
-                    position = f.tell()  # 记录文件位置
-                else:
-                    current_seq.append(line.upper())
-            
-            # 处理最后一条
-            if current_chr:
-                sequence = ''.join(current_seq)
-                length = len(sequence)
-                gc = sequence.count('G') + sequence.count('C')
-                gc_content = (gc / length * 100) if length > 0 else 0
-                
-                yield {
-                    'chromosome': current_chr,
-                    'length': length,
-                    'gc_content': gc_content,
-                    'position': position
-                }
-    
     # 使用生成器处理
     print("\n使用生成器处理大基因组:")
     print("(内存友好，适合处理GB级文件)")
@@ -585,8 +778,30 @@ def practice_6_large_genome_processor():
     print(f"  总长度: {total_length:,} bp")
     print(f"  最长染色体: {longest_chr} ({longest_length} bp)")
     
+    # 内存回归检查：一条10 Mb的染色体，峰值内存应只与chunk_size有关
+    print(f"\n内存占用检查 (tracemalloc):")
+    base_table = bytes(b'ACGT'[i % 4] for i in range(256))
+    with open("big_chromosome.fasta", "wb") as f:
+        f.write(b">chrBig single large chromosome\n")
+        for _ in range(10):
+            sequence = os.urandom(1_000_000).translate(base_table)
+            f.write(b'\n'.join(sequence[k:k + 60] for k in range(0, len(sequence), 60)))
+            f.write(b'\n')
+    
+    chunk_size = 256 * 1024
+    peak = measure_peak_memory(process_large_genome, "big_chromosome.fasta",
+                               chunk_size=chunk_size)
+    print(f"  染色体长度: 10,000,000 bp, chunk_size: {chunk_size // 1024} KB")
+    print(f"  内存峰值: {peak / 1024:.0f} KB")
+    # 每个块最多同时存在原始块和translate后的副本，留出余量
+    if peak < 4 * chunk_size:
+        print("  ✓ 内存峰值与染色体长度无关")
+    else:
+        print("  ✗ 内存峰值超出预期，请检查是否拼接了整条序列")
+    
     # 清理文件
     os.remove("genome.fasta")
+    os.remove("big_chromosome.fasta")
 
 
 def challenge_fasta_database():
@@ -614,79 +829,196 @@ MALWMRLLPLLALLALWGPDPAAAFVNQHLCGSHLVEALYLVCGERGFFYTPKT
     class FastaDatabase:
         """
         高效的FASTA数据库实现
+
+        索引保存为与samtools兼容的 .fai 文件（每行5列）：
+            序列名  序列长度  序列起始字节偏移  每行碱基数  每行字节数
+        再次打开同一个文件时直接读取 .fai，无需重新扫描整个基因组。
         """
         
         def __init__(self, fasta_file):
             """初始化数据库"""
             self.filename = fasta_file
-            self.index = {}  # {seq_id: (file_position, length, description)}
+            self.fai_file = fasta_file + ".fai"
+            # {seq_id: (offset, length, line_bases, line_width)}
+            self.index = {}
+            self._descriptions = {}  # 描述信息按需读取并缓存
             self._stats = None
-            self.build_index()
+            self.index_reused = False
+            
+            if self._fai_is_current():
+                self.load_index()
+                self.index_reused = True
+            else:
+                self.build_index()
+                self.save_index()
+        
+        def _fai_is_current(self):
+            """判断 .fai 是否可以直接复用（比FASTA新，且记录范围不超过文件大小）"""
+            if not os.path.exists(self.fai_file):
+                return False
+            fasta_stat = os.stat(self.filename)
+            fai_stat = os.stat(self.fai_file)
+            if fai_stat.st_mtime < fasta_stat.st_mtime:
+                return False
+            
+            # 检查索引中最后一条序列的结束位置是否与文件大小吻合
+            try:
+                with open(self.fai_file, 'r') as f:
+                    last_line = None
+                    for last_line in f:
+                        pass
+                if last_line is None:
+                    return fasta_stat.st_size == 0
+                fields = last_line.rstrip('\n').split('\t')
+                length, offset, line_bases, line_width = map(int, fields[1:5])
+            except (OSError, ValueError):
+                return False
+            
+            full_lines = length // line_bases if line_bases else 0
+            remainder = length % line_bases if line_bases else 0
+            data_end = offset + full_lines * line_width + remainder
+            # 允许末尾存在换行符或空行
+            return data_end <= fasta_stat.st_size <= data_end + line_width + 2
         
         def build_index(self):
-            """建立索引 - 不加载序列到内存"""
-            with open(self.filename, 'r') as f:
-                current_id = None
-                current_pos = 0
-                current_desc = ""
-                seq_start = 0
-                seq_length = 0
-                
-                while True:
-                    position = f.tell()
-                    line = f.readline()
-                    
-                    if not line:  # 文件结束
-                        if current_id:
-                            self.index[current_id] = (seq_start, seq_length, current_desc)
-                        break
-                    
-                    line = line.strip()
+            """建立索引 - 以二进制方式逐行扫描，用行长度累计字节偏移"""
+            self.index = {}
+            self._descriptions = {}
+            
+            current_id = None
+            offset = 0
+            
+            def save_current():
+                self.index[current_id] = (seq_offset, seq_length, line_bases, line_width)
+            
+            with open(self.filename, 'rb') as f:
+                for line in f:
+                    line_len = len(line)
                     
-                    if line.startswith('>'):
+                    if line.startswith(b'>'):
                         # 保存前一条序列信息
-                        if current_id:
-                            self.index[current_id] = (seq_start, seq_length, current_desc)
+                        if current_id is not None:
+                            save_current()
                         
                         # 新序列
-                        parts = line[1:].split(None, 1)
+                        parts = line[1:].decode('utf-8').split(None, 1)
                         current_id = parts[0]
-                        current_desc = parts[1] if len(parts) > 1 else ""
-                        seq_start = f.tell()  # 序列开始位置
+                        self._descriptions[current_id] = parts[1].strip() if len(parts) > 1 else ""
+                        seq_offset = offset + line_len  # 序列开始位置
                         seq_length = 0
-                    elif line and current_id:
-                        seq_length += len(line)
+                        line_bases = 0
+                        line_width = 0
+                        short_line_seen = False
+                    elif current_id is not None:
+                        bases = len(line.rstrip(b'\r\n'))
+                        
+                        if bases and short_line_seen:
+                            # .fai 要求除最后一行外，每行长度相同
+                            raise ValueError(f"序列 {current_id} 的行长度不一致，无法建立 .fai 索引")
+                        
+                        if line_bases == 0:
+                            line_bases = bases
+                            line_width = line_len
+                        elif bases > line_bases:
+                            raise ValueError(f"序列 {current_id} 的行长度不一致，无法建立 .fai 索引")
+                        elif bases < line_bases or line_len != line_width:
+                            short_line_seen = True
+                        
+                        if bases == 0 and seq_length > 0:
+                            short_line_seen = True
+                        seq_length += bases
+                    
+                    offset += line_len
+            
+            # 保存最后一条序列
+            if current_id is not None:
+                save_current()
+        
+        def save_index(self):
+            """把索引写入 .fai 文件（samtools faidx 格式）"""
+            with open(self.fai_file, 'w') as f:
+                for seq_id, (offset, length, line_bases, line_width) in self.index.items():
+                    f.write(f"{seq_id}\t{length}\t{offset}\t{line_bases}\t{line_width}\n")
+        
+        def load_index(self):
+            """从 .fai 文件读取索引"""
+            self.index = {}
+            with open(self.fai_file, 'r') as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) < 5:
+                        continue
+                    length, offset, line_bases, line_width = map(int, fields[1:5])
+                    self.index[fields[0]] = (offset, length, line_bases, line_width)
+        
+        def description(self, seq_id):
+            """获取序列描述：从序列起始位置向前读出标题行（结果会缓存）"""
+            if seq_id in self._descriptions:
+                return self._descriptions[seq_id]
+            
+            offset = self.index[seq_id][0]
+            with open(self.filename, 'rb') as f:
+                chunk = b''
+                chunk_start = offset
+                while True:
+                    chunk_start = max(0, chunk_start - 1024)
+                    f.seek(chunk_start)
+                    chunk = f.read(offset - chunk_start)
+                    # chunk以标题行的换行符结尾，向前找上一个换行符
+                    header_start = chunk.rfind(b'\n', 0, len(chunk) - 1)
+                    if header_start != -1 or chunk_start == 0:
+                        break
+            
+            header = chunk[header_start + 1:].decode('utf-8').strip()
+            parts = header[1:].split(None, 1)
+            self._descriptions[seq_id] = parts[1] if len(parts) > 1 else ""
+            return self._descriptions[seq_id]
+        
+        def fetch(self, seq_id, start, end):
+            """
+            随机读取子序列（0-based，左闭右开，与Python切片一致）
+            
+            根据每行碱基数和字节数直接算出起始字节，只需一次seek
+            """
+            if seq_id not in self.index:
+                return None
+            
+            offset, length, line_bases, line_width = self.index[seq_id]
+            start = max(0, start)
+            end = min(end, length)
+            if start >= end:
+                return ""
+            
+            def byte_position(pos):
+                return offset + (pos // line_bases) * line_width + pos % line_bases
+            
+            first_byte = byte_position(start)
+            last_byte = byte_position(end - 1) + 1
+            
+            with open(self.filename, 'rb') as f:
+                f.seek(first_byte)
+                raw = f.read(last_byte - first_byte)
+            
+            return raw.translate(None, b'\r\n').decode('utf-8')
         
         def get_sequence(self, seq_id):
             """快速获取指定序列"""
             if seq_id not in self.index:
                 return None
             
-            pos, length, desc = self.index[seq_id]
-            
-            with open(self.filename, 'r') as f:
-                f.seek(pos)  # 直接跳到序列位置
-                
-                sequence = []
-                read_length = 0
-                
-                while read_length < length:
-                    line = f.readline().strip()
-                    if line and not line.startswith('>'):
-                        sequence.append(line)
-                        read_length += len(line)
-                
-                return {
-                    'id': seq_id,
-                    'description': desc,
-                    'sequence': ''.join(sequence)
-                }
+            length = self.index[seq_id][1]
+            return {
+                'id': seq_id,
+                'description': self.description(seq_id),
+                'sequence': self.fetch(seq_id, 0, length)
+            }
         
         def search(self, keyword):
             """搜索序列（按ID或描述）"""
             results = []
             
-            for seq_id, (pos, length, desc) in self.index.items():
+            for seq_id, (offset, length, line_bases, line_width) in self.index.items():
+                desc = self.description(seq_id)
                 if keyword.lower() in seq_id.lower() or keyword.lower() in desc.lower():
                     results.append({
                         'id': seq_id,
@@ -714,6 +1046,11 @@ MALWMRLLPLLALLALWGPDPAAAFVNQHLCGSHLVEALYLVCGERGFFYTPKT
     # 测试数据库
     print("\n构建序列数据库...")
     db = FastaDatabase("sequence_db.fasta")
+    print(f"  ✓ 索引已保存到 {db.fai_file}")
+    
+    # 再次打开：直接复用 .fai 索引
+    db = FastaDatabase("sequence_db.fasta")
+    print(f"  再次打开数据库，复用索引: {'是' if db.index_reused else '否'}")
     
     # 显示统计信息
     stats = db.statistics()
@@ -729,6 +1066,10 @@ MALWMRLLPLLALLALWGPDPAAAFVNQHLCGSHLVEALYLVCGERGFFYTPKT
         print(f"  找到: {seq['id']} - {seq['description']}")
         print(f"  序列: {seq['sequence'][:50]}...")
     
+    # 测试随机读取子序列（一次seek）
+    print(f"\n区间读取测试:")
+    print(f"  NM_001[10:30]: {db.fetch('NM_001', 10, 30)}")
+    
     # 测试搜索功能
     print(f"\n搜索 'cancer':")
     results = db.search("cancer")
@@ -737,12 +1078,24 @@ MALWMRLLPLLALLALWGPDPAAAFVNQHLCGSHLVEALYLVCGERGFFYTPKT
     
     # 清理文件
     os.remove("sequence_db.fasta")
+    os.remove("sequence_db.fasta.fai")
 
 
 def main():
     """
     主函数：运行所有参考答案
+    
+    命令行参数：
+        --workers N   练习4使用N个进程并行处理
+        --benchmark   额外运行批量处理吞吐量测试（1/2/4/8个进程）
     """
+    parser = argparse.ArgumentParser(description="Chapter 05 参考答案")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="练习4批量处理使用的进程数（默认1，即串行）")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="运行批量处理吞吐量测试")
+    args = parser.parse_args()
+    
     print("🧬 Chapter 05: 文件IO与FASTA处理 - 参考答案")
     print("=" * 60)
     print()
@@ -751,11 +1104,14 @@ def main():
     practice_1_basic_file_operations()
     practice_2_simple_fasta_parser()
     practice_3_fasta_quality_control()
-    practice_4_batch_processing()
+    practice_4_batch_processing(workers=args.workers)
     practice_5_format_converter()
     practice_6_large_genome_processor()
     challenge_fasta_database()
     
+    if args.benchmark:
+        benchmark_batch_processing()
+    
     print("\n" + "=" * 60)
     print("📚 学习要点总结:")
     print()
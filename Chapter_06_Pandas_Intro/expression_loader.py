@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chapter 06 工具模块：大型表达矩阵的分块读取与列式缓存
+
+pd.read_csv 默认把数值读成float64、文本读成object，
+再对整张表 describe() —— 几十GB的矩阵根本放不进内存。这里：
+
+- 显式的dtype映射：数值列float32（内存减半），取值重复多的文本列用category
+- 分块模式：每次只读一块，用流式（Welford/Chan合并）累加器计算
+  count/mean/std/min/max；分位数来自行蓄水池抽样
+  （行数不超过蓄水池行数时与 describe() 一致）。
+  块和蓄水池的大小都按"值的个数"设预算，再除以列数换算成行数：
+  基因 × 几千个样本的宽矩阵和细长矩阵一样，内存有固定上限
+- 列式缓存：第一次读取时把数值矩阵写成 .npy（float32），
+  基因ID等注释列存成pickle，下次直接从缓存加载（可以内存映射），
+  源文件大小或修改时间变了缓存自动失效
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+
+# 每块读取的值的个数（行数 = CHUNK_VALUES // 列数）
+CHUNK_VALUES = 2_000_000
+
+# 分位数蓄水池保存的值的个数（行数 = RESERVOIR_VALUES // 数值列数）
+RESERVOIR_VALUES = 4_000_000
+
+# 文本列中不同取值的比例低于这个值时存为category
+CATEGORY_FRACTION = 0.5
+
+CACHE_VERSION = 1
+
+
+def expression_dtypes(path, sample_rows=10_000, category_fraction=CATEGORY_FRACTION,
+                      float_dtype='float32'):
+    """
+    读取文件开头的若干行，推断显式的dtype映射
+
+    数值列 → float_dtype（默认float32，表达值的有效数字足够，内存减半）；
+    文本列中重复取值多的（如基因类型、染色体）→ category，
+    基本唯一的（如基因ID、基因名）保持为字符串
+    """
+    sample = pd.read_csv(path, nrows=sample_rows)
+    dtypes = {}
+    for column in sample.columns:
+        if pd.api.types.is_numeric_dtype(sample[column]):
+            dtypes[column] = float_dtype
+        elif sample[column].nunique() <= category_fraction * len(sample):
+            dtypes[column] = 'category'
+        else:
+            dtypes[column] = 'object'
+    return dtypes
+
+
+def read_expression_csv(path, dtypes=None, **kwargs):
+    """按显式dtype映射一次性读取（适合能放进内存的文件）"""
+    dtypes = dtypes or expression_dtypes(path)
+    return pd.read_csv(path, dtype=dtypes, **kwargs)
+
+
+def budget_rows(n_columns, n_values):
+    """按值的个数预算换算成行数（至少1行）"""
+    return max(1, n_values // max(n_columns, 1))
+
+
+def iter_expression_chunks(path, dtypes=None, chunksize=None):
+    """
+    按显式dtype映射分块读取，每次产出一个DataFrame
+
+    chunksize 为每块行数；默认按 CHUNK_VALUES 和列数换算，
+    宽矩阵的一块不会因为列多而变得很大
+    """
+    dtypes = dtypes or expression_dtypes(path)
+    chunksize = chunksize or budget_rows(len(dtypes), CHUNK_VALUES)
+    yield from pd.read_csv(path, dtype=dtypes, chunksize=chunksize)
+
+
+class StreamingStats:
+    """
+    按列的流式统计量累加器
+
+    每个数据块先算出块内的 count/mean/M2/min/max，
+    再用Chan等人的并行Welford公式与已有结果合并，数值稳定且与块大小无关。
+    缺失值（NaN）不计入。分位数来自行蓄水池：每行赋一个随机键，
+    始终保留键最小的若干行，即所有行的均匀抽样。蓄水池一次分配好，
+    共 reservoir_values 个值（行数 = reservoir_values // 列数），之后原地替换。
+    """
+
+    def __init__(self, columns, reservoir_values=RESERVOIR_VALUES, seed=0):
+        self.columns = list(columns)
+        n_columns = len(self.columns)
+        self.count = np.zeros(n_columns)
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)
+        self.min = np.full(n_columns, np.inf)
+        self.max = np.full(n_columns, -np.inf)
+        self.reservoir_size = budget_rows(n_columns, reservoir_values)
+        self.reservoir = np.empty((self.reservoir_size, n_columns), dtype=np.float32)
+        # 空位的键为inf，最先被替换
+        self.reservoir_keys = np.full(self.reservoir_size, np.inf)
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        """加入一个数据块（行 × 列）"""
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=0).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, np.nansum(values, axis=0) / count, 0.0)
+        m2 = np.nansum((values - mean) ** 2, axis=0)
+
+        total = self.count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean - self.mean
+            self.mean = np.where(total > 0, self.mean + delta * count / total, 0.0)
+            self.m2 = self.m2 + m2 + np.where(total > 0, delta ** 2 * self.count * count / total, 0.0)
+        self.count = total
+        if valid.any():
+            self.min = np.fmin(self.min, np.nanmin(np.where(valid, values, np.inf), axis=0))
+            self.max = np.fmax(self.max, np.nanmax(np.where(valid, values, -np.inf), axis=0))
+
+        # 只有键小于蓄水池当前最大键的行才可能进入；
+        # 在 旧键 + 候选键 中取最小的 reservoir_size 个，被挤出的空位原地换成新行
+        keys = self.rng.random(len(values))
+        candidates = np.flatnonzero(keys < self.reservoir_keys.max())
+        if len(candidates) == 0:
+            return
+        all_keys = np.concatenate([self.reservoir_keys, keys[candidates]])
+        keep = np.zeros(len(all_keys), dtype=bool)
+        keep[np.argpartition(all_keys, self.reservoir_size - 1)[:self.reservoir_size]] = True
+        evicted = np.flatnonzero(~keep[:self.reservoir_size])
+        entering = candidates[keep[self.reservoir_size:]]
+        self.reservoir[evicted] = values[entering]
+        self.reservoir_keys[evicted] = keys[entering]
+
+    def summary(self):
+        """与 DataFrame.describe() 相同布局的统计表（std为样本标准差）"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(np.where(self.count > 1, self.m2 / (self.count - 1), np.nan))
+        filled = self.reservoir[np.isfinite(self.reservoir_keys)]
+        quantiles = np.nanquantile(filled.astype(np.float64), [0.25, 0.5, 0.75], axis=0) \
+            if len(filled) else np.full((3, len(self.columns)), np.nan)
+        empty = self.count == 0
+        return pd.DataFrame(
+            [self.count, np.where(empty, np.nan, self.mean), std,
+             np.where(empty, np.nan, self.min), *quantiles, np.where(empty, np.nan, self.max)],
+            index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'],
+            columns=self.columns)
+
+
+def _numeric_columns(dtypes):
+    return [column for column, dtype in dtypes.items() if dtype in ('float32', 'float64')]
+
+
+def summarize_expression_csv(path, dtypes=None, chunksize=None,
+                             reservoir_values=RESERVOIR_VALUES):
+    """
+    分块读取并计算所有数值列的 describe() 统计量
+
+    内存占用只与块和蓄水池的值预算有关，与文件的行数、列数无关
+    """
+    dtypes = dtypes or expression_dtypes(path)
+    numeric = _numeric_columns(dtypes)
+    stats = StreamingStats(numeric, reservoir_values)
+    for chunk in iter_expression_chunks(path, dtypes, chunksize):
+        stats.update(chunk[numeric].to_numpy(dtype=np.float64))
+    return stats.summary()
+
+
+def _count_rows(path, buffer_size=1 << 24):
+    """
+    数据行数的上限（不含表头），按字节块数换行符，不解析CSV
+
+    空行、引号内的换行符也会被计入，所以解析出的行数只会更少，不会更多
+    """
+    n_lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        while True:
+            buffer = f.read(buffer_size)
+            if not buffer:
+                break
+            n_lines += buffer.count(b'\n')
+            last = buffer[-1:]
+    # 最后一行没有换行符时也要计入；再减去表头
+    return n_lines + (last != b'\n') - 1
+
+
+def _truncate_npy_rows(path, n_rows):
+    """
+    把 .npy 文件截短到前 n_rows 行：原地改写表头的第0维，再截掉多余的数据
+
+    NumPy写表头时为第0维预留了足够的空格，改写后表头长度不变，数据不用移动
+    """
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                       else np.lib.format.read_array_header_2_0)
+        shape, fortran_order, dtype = read_header(f)
+        data_offset = f.tell()
+        header = {'descr': np.lib.format.dtype_to_descr(dtype),
+                  'fortran_order': fortran_order, 'shape': (n_rows,) + shape[1:]}
+        f.seek(0)
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(f, header)
+        else:
+            np.lib.format.write_array_header_2_0(f, header)
+        if f.tell() != data_offset:
+            raise ValueError(f"{path}: 改写表头后长度变化，无法原地截短")
+        f.truncate(data_offset + n_rows * int(np.prod(shape[1:])) * dtype.itemsize)
+
+
+def _source_signature(path):
+    status = os.stat(path)
+    return {'source': os.path.abspath(path), 'size': status.st_size,
+            'mtime_ns': status.st_mtime_ns, 'version': CACHE_VERSION}
+
+
+def default_cache_dir(path):
+    """缓存目录默认放在CSV旁边：gene_expression.csv → gene_expression.csv.cache/"""
+    return f"{path}.cache"
+
+
+def cache_is_fresh(path, cache_dir=None):
+    """缓存存在且与源文件的大小、修改时间一致"""
+    meta_path = os.path.join(cache_dir or default_cache_dir(path), 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return {key: meta.get(key) for key in _source_signature(path)} == _source_signature(path)
+
+
+def convert_to_cache(path, cache_dir=None, dtypes=None, chunksize=None,
+                     reservoir_values=RESERVOIR_VALUES):
+    """
+    把CSV一次性转换成列式缓存，同时计算统计量
+
+    缓存目录内容：
+        values.npy       数值列组成的float32矩阵（行 × 数值列），逐块写入内存映射
+        annotations.pkl  非数值列（基因ID、基因名、分类列）
+        meta.json        源文件签名、列名与dtype、统计摘要
+
+    返回统计摘要（与 summarize_expression_csv 相同）
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    dtypes = dtypes or expression_dtypes(path)
+    numeric = _numeric_columns(dtypes)
+    # 按换行符数先分配（上限），写完后截到实际解析出的行数（空行不算数据行）
+    max_rows = _count_rows(path)
+
+    # 先写到临时目录，完成后再替换，避免中断留下不完整的缓存
+    parent = os.path.dirname(os.path.abspath(cache_dir))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.expression_cache_', dir=parent)
+    try:
+        values = np.lib.format.open_memmap(os.path.join(staging, 'values.npy'), mode='w+',
+                                           dtype=np.float32, shape=(max_rows, len(numeric)))
+        stats = StreamingStats(numeric, reservoir_values)
+        annotations = []
+        row = 0
+        for chunk in iter_expression_chunks(path, dtypes, chunksize):
+            block = chunk[numeric].to_numpy(dtype=np.float32)
+            if row + len(block) > max_rows:
+                raise ValueError(f"{path}: 解析出的行数超过换行符数 {max_rows}（是否只用 \\r 换行？）")
+            values[row:row + len(block)] = block
+            row += len(block)
+            stats.update(block)
+            annotations.append(chunk.drop(columns=numeric))
+        values.flush()
+        del values
+        n_rows = row
+        if n_rows < max_rows:
+            _truncate_npy_rows(os.path.join(staging, 'values.npy'), n_rows)
+
+        annotation_df = pd.concat(annotations, ignore_index=True) if annotations else pd.DataFrame()
+        for column, dtype in dtypes.items():
+            if dtype == 'category' and column in annotation_df:
+                # 各块的类别可能不同，合并后重新统一为category
+                annotation_df[column] = annotation_df[column].astype(str).astype('category')
+        annotation_df.to_pickle(os.path.join(staging, 'annotations.pkl'))
+
+        summary = stats.summary()
+        meta = dict(_source_signature(path), columns=list(dtypes), dtypes=dtypes,
+                    n_rows=n_rows, summary=summary.to_dict())
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.replace(staging, cache_dir)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return summary
+
+
+def load_cached_summary(cache_dir):
+    """从缓存的 meta.json 读取统计摘要"""
+    with open(os.path.join(cache_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    return pd.DataFrame(meta['summary']).loc[
+        ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'], meta['summary'].keys()]
+
+
+def load_expression_matrix(path, cache_dir=None, dtypes=None, chunksize=None,
+                           mmap=False):
+    """
+    读取表达矩阵：缓存有效时直接从 .npy 加载，否则先分块转换成缓存
+
+    参数：
+        mmap: 为True时数值矩阵以只读内存映射方式打开，
+            按需从磁盘读取，适合比内存还大的矩阵（此时直接返回 (注释, 矩阵, 列名)）
+
+    返回列顺序与CSV相同的DataFrame（数值列为float32）
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    if not cache_is_fresh(path, cache_dir):
+        convert_to_cache(path, cache_dir, dtypes, chunksize)
+
+    with open(os.path.join(cache_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    numeric = _numeric_columns(meta['dtypes'])
+    values = np.load(os.path.join(cache_dir, 'values.npy'), mmap_mode='r' if mmap else None)
+    annotations = pd.read_pickle(os.path.join(cache_dir, 'annotations.pkl'))
+    if mmap:
+        return annotations, values, numeric
+
+    numeric_df = pd.DataFrame(values, columns=numeric, copy=False)
+    return pd.concat([annotations, numeric_df], axis=1)[meta['columns']]
+
+
+def _write_benchmark_csv(path, n_genes, n_samples, seed):
+    """分块写出模拟的表达矩阵CSV（基因ID、基因类型 + 样本列）"""
+    rng = np.random.default_rng(seed)
+    samples = [f"sample_{i:03d}" for i in range(n_samples)]
+    gene_types = np.array(['protein_coding', 'lncRNA', 'pseudogene', 'miRNA'])
+    with open(path, 'w') as f:
+        f.write(','.join(['gene_id', 'gene_type'] + samples) + '\n')
+        block_rows = budget_rows(n_samples, CHUNK_VALUES)
+        for start in range(0, n_genes, block_rows):
+            n = min(block_rows, n_genes - start)
+            block = pd.DataFrame(np.round(rng.lognormal(4, 2, (n, n_samples)), 2), columns=samples)
+            block.insert(0, 'gene_type', gene_types[rng.integers(0, 4, n)])
+            block.insert(0, 'gene_id', [f"ENSG{i:011d}" for i in range(start, start + n)])
+            block.to_csv(f, header=False, index=False)
+
+
+def _measure(function, trace_memory=False):
+    """
+    返回 (结果, 用时秒, 峰值内存MB)
+
+    tracemalloc 会记录numpy/pandas的分配，但也会拖慢大量小对象的分配，
+    所以需要峰值内存时单独再运行一次
+    """
+    start_time = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start_time
+    peak = None
+    if trace_memory:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def _compare_summaries(summary, expected):
+    """返回 (count/mean/std/min/max 是否一致, 分位数最大相对误差)"""
+    exact = ['count', 'mean', 'std', 'min', 'max']
+    quartiles = ['25%', '50%', '75%']
+    same = np.allclose(summary.loc[exact], expected.loc[exact], rtol=1e-5)
+    error = (np.abs(summary.loc[quartiles] - expected.loc[quartiles])
+             / expected.loc[quartiles]).to_numpy().max()
+    return same, error
+
+
+def benchmark_expression_loader(n_genes=400_000, n_samples=60, wide_shape=(6000, 2000), seed=11):
+    """
+    性能测试：约200 MB的细长表达矩阵CSV，以及 基因 × 几千样本 的宽矩阵
+
+    - 默认 read_csv + describe() 与分块流式统计的用时和峰值内存
+    - 第一次加载（转换为缓存）与第二次从缓存加载的用时
+    - 宽矩阵：默认参数下分块统计的峰值内存也不随列数膨胀
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'expression.csv')
+        _write_benchmark_csv(path, n_genes, n_samples, seed)
+        print(f"\n[TIME] 表达矩阵读取性能（{n_genes:,} 基因 × {n_samples} 样本，"
+              f"CSV {os.path.getsize(path) / 1e6:.0f} MB）")
+
+        def default_load():
+            df = pd.read_csv(path)
+            return df.describe()
+
+        expected, default_time, default_peak = _measure(default_load, trace_memory=True)
+        print(f"  - 默认 read_csv + describe: {default_time:.2f}秒，峰值内存 {default_peak:.0f} MB")
+
+        dtypes = expression_dtypes(path)
+        summary, stream_time, stream_peak = _measure(
+            lambda: summarize_expression_csv(path, dtypes), trace_memory=True)
+        same, quantile_error = _compare_summaries(summary, expected)
+        print(f"  - 分块流式统计: {stream_time:.2f}秒，峰值内存 {stream_peak:.0f} MB，"
+              f"count/mean/std/min/max一致: {'✓' if same else '✗'}，"
+              f"分位数最大相对误差 {quantile_error:.1%}")
+
+        cache_dir = os.path.join(tmpdir, 'cache')
+        _, first_time, _ = _measure(lambda: load_expression_matrix(path, cache_dir, dtypes))
+        df, second_time, _ = _measure(lambda: load_expression_matrix(path, cache_dir))
+        print(f"  - 第一次加载（分块转换为缓存）: {first_time:.2f}秒")
+        print(f"  - 第二次加载（从 .npy 缓存）: {second_time:.2f}秒，"
+              f"比默认 read_csv 快 {default_time / second_time:.0f}×，"
+              f"内存占用 {df.memory_usage(deep=True).sum() / 1e6:.0f} MB")
+        del df
+
+        n_wide_genes, n_wide_samples = wide_shape
+        wide_path = os.path.join(tmpdir, 'wide.csv')
+        _write_benchmark_csv(wide_path, n_wide_genes, n_wide_samples, seed)
+        print(f"\n[TIME] 宽矩阵（{n_wide_genes:,} 基因 × {n_wide_samples:,} 样本，"
+              f"CSV {os.path.getsize(wide_path) / 1e6:.0f} MB，"
+              f"float32矩阵 {n_wide_genes * n_wide_samples * 4 / 1e6:.0f} MB）")
+        expected, wide_default_time, wide_default_peak = _measure(
+            lambda: pd.read_csv(wide_path).describe(), trace_memory=True)
+        print(f"  - 默认 read_csv + describe: {wide_default_time:.2f}秒，"
+              f"峰值内存 {wide_default_peak:.0f} MB")
+        wide_dtypes = expression_dtypes(wide_path)
+        summary, wide_stream_time, wide_stream_peak = _measure(
+            lambda: summarize_expression_csv(wide_path, wide_dtypes), trace_memory=True)
+        same, quantile_error = _compare_summaries(summary, expected)
+        print(f"  - 分块流式统计（每块 {budget_rows(len(wide_dtypes), CHUNK_VALUES)} 行，"
+              f"蓄水池 {budget_rows(n_wide_samples, RESERVOIR_VALUES)} 行）: "
+              f"{wide_stream_time:.2f}秒，峰值内存 {wide_stream_peak:.0f} MB，"
+              f"count/mean/std/min/max一致: {'✓' if same else '✗'}，"
+              f"分位数最大相对误差 {quantile_error:.1%}")
+    return {'default': default_time, 'streaming': stream_time,
+            'first_load': first_time, 'cached_load': second_time,
+            'wide_default': wide_default_time, 'wide_streaming': wide_stream_time}
+
+
+if __name__ == "__main__":
+    benchmark_expression_loader()
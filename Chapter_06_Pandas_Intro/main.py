@@ -22,6 +22,8 @@ import os
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from expression_loader import expression_dtypes, read_expression_csv, summarize_expression_csv
+
 
 def demonstrate_pandas_basics():
     """
@@ -118,8 +120,11 @@ def load_gene_expression_data():
     
     try:
         # 读取CSV文件 - 最常见的数据格式
+        # 显式指定dtype，重复多的文本列用category
+        # 大矩阵用默认的float32可以省一半内存；示例文件很小，用float64让显示的数值保持原样
         print("尝试读取CSV文件...")
-        df = pd.read_csv(data_file)
+        dtypes = expression_dtypes(data_file, float_dtype='float64')
+        df = read_expression_csv(data_file, dtypes)
         print("[OK] 数据加载成功!")
         
         # 显示数据概览
@@ -156,6 +161,13 @@ def load_gene_expression_data():
             print("  - std: 表达变异程度")
             print("  - min/max: 表达范围")
             print("  - 25%/50%/75%: 四分位数，显示数据分布")
+            
+            # 大文件不能一次读入内存：分块读取，用流式累加器得到同样的统计量
+            chunked_stats = summarize_expression_csv(data_file, dtypes, chunksize=5)
+            same = np.allclose(chunked_stats[numeric_columns], stats, rtol=1e-5)
+            print(f"\n[TIP] 分块读取（每块5行）的流式统计与describe()一致: {same}")
+            print("  - 几十GB的矩阵用 load_expression_matrix() 分块转换成 .npy 缓存，")
+            print("    之后的加载直接读缓存，不再解析CSV")
         
         return df
         
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chapter 07 工具模块：基于稀疏矩阵的功能富集分析
+
+基因集（GO term、通路等）的成员关系存成稀疏的 基因 × 基因集 CSR矩阵：
+
+- 过表示分析（ORA）：多个查询基因列表也写成 查询 × 基因 的稀疏矩阵，
+  一次稀疏矩阵乘法得到所有 (查询, 基因集) 的重叠数，
+  再用向量化的超几何分布生存函数算p值（等价于单侧Fisher精确检验），
+  每个查询内做BH校正
+- GSEA：按排序统计量计算富集分数（ES），只需要每个基因集命中位置上的
+  累积和，所有基因集一起用分段累积和完成。
+  置换检验使用基因置换：随机基因集的零分布只与基因集大小有关，
+  一组随机排列的前K个基因就是大小为K的随机基因集，
+  所以每种大小的零分布只算一次并缓存，被所有相同大小的基因集共用
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse, special, stats
+
+from differential_expression import benjamini_hochberg
+
+
+def _log_choose(n, k):
+    return special.gammaln(n + 1) - special.gammaln(k + 1) - special.gammaln(n - k + 1)
+
+
+def hypergeom_sf(k, N, K, n, rtol=1e-15):
+    """
+    P(X >= k)，X ~ 超几何(总数N, 成功数K, 抽取n)，参数可广播
+
+    与 scipy.stats.hypergeom.sf(k - 1, N, K, n) 相同，但逐元素调用scipy约50微秒/个，
+    几十万个 (查询, 基因集) 对就要几十秒。这里用 gammaln 算起点的概率，
+    再用相邻概率之比 P(x+1)/P(x) 的递推向众数相反方向累加：
+    k 在众数右侧时直接累加上尾，否则累加下尾再用1减（此时p值不小，没有精度问题）。
+    每一步只保留尚未收敛的元素，通常十几次迭代就结束。
+    """
+    arrays = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (k, N, K, n)))
+    shape = arrays[0].shape
+    k, N, K, n = (a.ravel() for a in arrays)
+    result = np.ones(len(k))
+    low, high = np.maximum(0, n + K - N), np.minimum(n, K)
+    result[k > high] = 0.0
+
+    def log_pmf(x, i):
+        return (_log_choose(K[i], x) + _log_choose(N[i] - K[i], n[i] - x)
+                - _log_choose(N[i], n[i]))
+
+    mode = np.floor((n + 1) * (K + 1) / (N + 2))
+    upper = np.flatnonzero((k > low) & (k <= high) & (k > mode))
+    lower = np.flatnonzero((k > low) & (k <= high) & (k <= mode))
+
+    # 上尾：x = k, k+1, ..., 概率递减
+    x = k[upper].copy()
+    term = np.exp(log_pmf(x, upper))
+    total = term.copy()
+    active = np.arange(len(upper))
+    while len(active):
+        i = upper[active]
+        xa = x[active]
+        term[active] *= (K[i] - xa) * (n[i] - xa) / ((xa + 1) * (N[i] - K[i] - n[i] + xa + 1))
+        x[active] += 1
+        total[active] += term[active]
+        active = active[(term[active] > rtol * total[active]) & (x[active] < high[i])]
+    result[upper] = total
+
+    # 下尾：x = k-1, k-2, ..., 概率递减，sf = 1 - cdf(k-1)
+    x = k[lower] - 1
+    term = np.exp(log_pmf(x, lower))
+    total = term.copy()
+    active = np.arange(len(lower))
+    while len(active):
+        i = lower[active]
+        xa = x[active]
+        term[active] *= xa * (N[i] - K[i] - n[i] + xa) / ((K[i] - xa + 1) * (n[i] - xa + 1))
+        x[active] -= 1
+        total[active] += term[active]
+        active = active[(term[active] > rtol * total[active]) & (x[active] > low[i])]
+    result[lower] = 1.0 - total
+    return np.clip(result, 0.0, 1.0).reshape(shape)
+
+
+class GeneSetCollection:
+    """
+    一组基因集的稀疏成员矩阵
+
+    用法：
+        collection = GeneSetCollection.from_dict({'GO:0006955': [...], ...})
+        table = collection.enrich({'contrast_1': deg_genes, ...})
+        gsea_table = collection.gsea(ranked_scores)
+    """
+
+    # 最多缓存多少个不同 ranked_scores 的零分布ES（最近最少使用的先淘汰）
+    NULL_CACHE_SIZE = 8
+
+    def __init__(self, genes, terms, membership):
+        self.genes = np.asarray(genes)
+        self.terms = np.asarray(terms)
+        self.membership = sparse.csr_matrix(membership, dtype=np.float64)
+        self.gene_index = {gene: i for i, gene in enumerate(self.genes)}
+        self._permutation_cache = {}
+        self._null_cache = {}
+
+    def clear_cache(self):
+        """清空GSEA的置换矩阵和零分布缓存"""
+        self._permutation_cache.clear()
+        self._null_cache.clear()
+
+    @classmethod
+    def from_pairs(cls, gene_ids, term_ids):
+        """由 (基因, 基因集) 成对注释构建，重复的注释只计一次"""
+        genes, gene_codes = np.unique(np.asarray(gene_ids), return_inverse=True)
+        terms, term_codes = np.unique(np.asarray(term_ids), return_inverse=True)
+        membership = sparse.coo_matrix((np.ones(len(gene_codes)), (gene_codes, term_codes)),
+                                       shape=(len(genes), len(terms))).tocsr()
+        membership.data[:] = 1.0
+        return cls(genes, terms, membership)
+
+    @classmethod
+    def from_dict(cls, gene_sets):
+        """由 {基因集名: 基因列表} 构建"""
+        pairs = [(gene, term) for term, members in gene_sets.items() for gene in members]
+        gene_ids, term_ids = zip(*pairs)
+        return cls.from_pairs(gene_ids, term_ids)
+
+    @classmethod
+    def from_labels(cls, labels):
+        """由每个基因一个类别的Series（索引为基因）构建"""
+        return cls.from_pairs(labels.index.to_numpy(), labels.to_numpy())
+
+    @property
+    def term_sizes(self):
+        return np.asarray(self.membership.sum(axis=0)).ravel()
+
+    def _indicator_matrix(self, gene_lists):
+        """查询基因列表 → 查询 × 基因 的稀疏0/1矩阵（不在集合中的基因忽略）"""
+        rows, cols = [], []
+        for row, gene_list in enumerate(gene_lists):
+            index = {self.gene_index[gene] for gene in gene_list if gene in self.gene_index}
+            rows.extend([row] * len(index))
+            cols.extend(index)
+        return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                 shape=(len(gene_lists), len(self.genes)))
+
+    def enrich(self, queries, background=None, min_size=1, max_size=None,
+               report_zero_overlap=False):
+        """
+        过表示分析：所有查询列表 × 所有基因集一次完成
+
+        参数：
+            queries: {查询名: 基因列表}
+            background: 背景基因列表（例如实际检测到的基因），默认为集合中全部基因
+            min_size / max_size: 只检验（背景内）大小在此范围内的基因集
+            report_zero_overlap: 为False时结果只保留重叠数大于0的行（FDR仍按全部检验计算）
+
+        返回DataFrame：query, term, overlap, query_size, term_size, expected,
+        fold_enrichment, p_value, fdr（每个查询内BH校正）
+        """
+        names = list(queries)
+        query_matrix = self._indicator_matrix([queries[name] for name in names])
+        membership = self.membership
+        if background is not None:
+            keep = self._indicator_matrix([background])
+            membership = sparse.diags(keep.toarray().ravel()) @ membership
+            query_matrix = query_matrix.multiply(keep).tocsr()
+        n_background = int(membership.shape[0] if background is None else keep.sum())
+
+        term_sizes = np.asarray(membership.sum(axis=0)).ravel()
+        tested = term_sizes >= min_size
+        if max_size is not None:
+            tested &= term_sizes <= max_size
+        tested = np.flatnonzero(tested)
+
+        # 一次稀疏矩阵乘法得到所有重叠数
+        overlap = (query_matrix @ membership[:, tested]).toarray()
+        query_sizes = np.asarray(query_matrix.sum(axis=1)).ravel()
+        sizes = term_sizes[tested][None, :]
+        n_query = query_sizes[:, None]
+        # P(X >= k)，X ~ 超几何(总数N, 基因集大小K, 抽取n)
+        p_values = hypergeom_sf(overlap, n_background, sizes, n_query)
+        fdr = np.vstack([benjamini_hochberg(row) for row in p_values]) \
+            if len(names) else p_values
+        expected = n_query * sizes / n_background
+
+        query_idx, term_idx = (np.indices(overlap.shape).reshape(2, -1) if report_zero_overlap
+                               else np.nonzero(overlap))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fold = overlap[query_idx, term_idx] / expected[query_idx, term_idx]
+        result = pd.DataFrame({
+            'query': np.asarray(names, dtype=object)[query_idx],
+            'term': self.terms[tested][term_idx],
+            'overlap': overlap[query_idx, term_idx].astype(int),
+            'query_size': query_sizes[query_idx].astype(int),
+            'term_size': term_sizes[tested][term_idx].astype(int),
+            'expected': expected[query_idx, term_idx],
+            'fold_enrichment': fold,
+            'p_value': p_values[query_idx, term_idx],
+            'fdr': fdr[query_idx, term_idx],
+        })
+        return result.sort_values(['query', 'p_value'], kind='mergesort').reset_index(drop=True)
+
+    def _ranked_membership(self, ranked_genes):
+        """按排序后的基因顺序重排成员矩阵，返回 基因集 × 排名 的CSR（列下标即命中位置）"""
+        order = np.array([self.gene_index.get(gene, -1) for gene in ranked_genes])
+        present = order >= 0
+        # 不在集合中的基因对应全0行
+        ranked = sparse.diags(present.astype(np.float64)) @ self.membership[np.maximum(order, 0)]
+        ranked.eliminate_zeros()
+        ranked = ranked.T.tocsr()
+        ranked.sort_indices()
+        return ranked
+
+    def gsea(self, ranked_scores, n_permutations=1000, min_size=15, max_size=500,
+             weight=1.0, seed=0):
+        """
+        基于排序的基因集富集分析（GSEA，基因置换）
+
+        参数：
+            ranked_scores: 以基因为索引的统计量Series（如 log2FC 或 t值），从大到小排序使用
+            weight: 命中基因的权重为 |统计量|^weight（0为经典KS统计量）
+
+        返回DataFrame：term, size, es, nes, p_value, fdr, leading_edge_rank
+        p_value 为该基因集自身的置换p值（分辨率受置换次数限制），
+        fdr 按GSEA的做法由合并的NES零分布估计；leading_edge_rank 为ES所在的排名位置。
+        置换矩阵按 (基因数, 置换次数, seed) 只生成一次；同一个 ranked_scores 的零分布
+        按基因集大小缓存（最近的 NULL_CACHE_SIZE 个），可用 clear_cache() 释放
+        """
+        ranked_scores = ranked_scores.sort_values(ascending=False)
+        weights = np.abs(ranked_scores.to_numpy(dtype=np.float64)) ** weight
+        n_genes = len(weights)
+
+        hits = self._ranked_membership(ranked_scores.index)
+        sizes = np.diff(hits.indptr)
+        tested = np.flatnonzero((sizes >= min_size) & (sizes <= max_size))
+        if len(tested) == 0:
+            # 没有大小合适的基因集：不做置换，返回列齐全的空表
+            return pd.DataFrame({
+                'term': self.terms[tested],
+                'size': sizes[tested],
+                'es': np.empty(0),
+                'nes': np.empty(0),
+                'p_value': np.empty(0),
+                'fdr': np.empty(0),
+                'leading_edge_rank': np.empty(0, dtype=np.int64),
+            })
+        hits = hits[tested]
+        es, peak = _enrichment_scores(hits.indptr, hits.indices, weights, n_genes)
+
+        # 置换矩阵只与基因数、置换次数和随机种子有关，所有 ranked_scores 共用一份
+        permutation_key = (n_genes, n_permutations, seed)
+        if permutation_key not in self._permutation_cache:
+            rng = np.random.default_rng(seed)
+            self._permutation_cache[permutation_key] = np.argsort(
+                rng.random((n_permutations, n_genes)), axis=1)
+        permutations = self._permutation_cache[permutation_key]
+
+        # 零分布缓存：键为 (排序统计量的指纹, 置换参数)，值为 {基因集大小: 零分布ES}，
+        # 按最近使用顺序保留 NULL_CACHE_SIZE 个
+        cache_key = (hash(weights.tobytes()),) + permutation_key
+        cache = self._null_cache.pop(cache_key, {})
+        self._null_cache[cache_key] = cache
+        while len(self._null_cache) > self.NULL_CACHE_SIZE:
+            del self._null_cache[next(iter(self._null_cache))]
+
+        set_sizes = sizes[tested]
+        nes = np.full(len(tested), np.nan)
+        p_values = np.full(len(tested), np.nan)
+        null_nes, null_weights = [], []
+        for size in np.unique(set_sizes):
+            if size not in cache:
+                positions = np.sort(permutations[:, :size], axis=1)
+                indptr = np.arange(n_permutations + 1) * size
+                cache[size] = _enrichment_scores(indptr, positions.ravel(), weights, n_genes)[0]
+            null = cache[size]
+            members = np.flatnonzero(set_sizes == size)
+            normalized = np.zeros_like(null)
+            # 正、负ES分别与同号的零分布比较，NES = ES / 同号零分布|ES|的均值
+            for positive in (True, False):
+                null_side = (null >= 0) == positive
+                chosen = members[(es[members] >= 0) == positive]
+                if not null_side.any():
+                    continue
+                same_sign = np.sort(np.abs(null[null_side]))
+                scale = same_sign.mean()
+                greater = len(same_sign) - np.searchsorted(same_sign, np.abs(es[chosen]))
+                p_values[chosen] = (greater + 1) / (len(same_sign) + 1)
+                nes[chosen] = es[chosen] / scale
+                normalized[null_side] = null[null_side] / scale
+            null_nes.append(normalized)
+            null_weights.append(np.full(len(null), len(members)))
+
+        return pd.DataFrame({
+            'term': self.terms[tested],
+            'size': set_sizes,
+            'es': es,
+            'nes': nes,
+            'p_value': p_values,
+            'fdr': _nes_fdr(nes, np.concatenate(null_nes), np.concatenate(null_weights)),
+            'leading_edge_rank': peak,
+        }).sort_values(['fdr', 'p_value'], kind='mergesort').reset_index(drop=True)
+
+
+def _nes_fdr(nes, null_nes, null_weights):
+    """
+    GSEA的FDR：同号且|NES|更大的比例，零分布中的 / 观测值中的
+
+    零分布合并了所有被检验基因集的NES零分布（每个基因集贡献其大小对应的那一份，
+    用权重表示），分辨率远高于单个基因集的置换p值。
+    """
+    fdr = np.full(len(nes), np.nan)
+    for positive in (True, False):
+        selected = np.flatnonzero(~np.isnan(nes) & ((nes >= 0) == positive))
+        null_side = (null_nes >= 0) == positive
+        if len(selected) == 0 or not null_side.any():
+            continue
+        values = np.abs(nes[selected])
+        order = np.argsort(np.abs(null_nes[null_side]))
+        null_sorted = np.abs(null_nes[null_side])[order]
+        tail_weight = np.append(np.cumsum(null_weights[null_side][order][::-1])[::-1], 0.0)
+        null_fraction = tail_weight[np.searchsorted(null_sorted, values)] / tail_weight[0]
+        observed_sorted = np.sort(values)
+        observed_fraction = (len(values) - np.searchsorted(observed_sorted, values)) / len(values)
+        ratio = np.minimum(null_fraction / observed_fraction, 1.0)
+        # |NES|越大FDR不应越大：按|NES|从小到大取累积最小值
+        order = np.argsort(values)
+        ratio[order] = np.minimum.accumulate(ratio[order])
+        fdr[selected] = ratio
+    return fdr
+
+
+def _enrichment_scores(indptr, positions, weights, n_genes):
+    """
+    所有基因集（CSR的每一行）的GSEA富集分数
+
+    positions 为每个基因集命中基因在排序列表中的位置（每行内升序）。
+    运行和只在命中处跳变：第i个命中之后为 W_i - (p_i + 1 - i)/(N - K)，
+    第i个命中之前为 W_{i-1} - (p_i - (i - 1))/(N - K)，
+    最大偏离一定出现在这些位置上，所以只需对命中做分段累积和。
+    返回 (ES, ES所在的排名位置)
+    """
+    sizes = np.diff(indptr)
+    n_sets = len(sizes)
+    set_id = np.repeat(np.arange(n_sets), sizes)
+    hit_weights = weights[positions]
+
+    # 分段累积和：全局cumsum减去每段开始前的值
+    cumulative = np.cumsum(hit_weights)
+    segment_offset = np.concatenate([[0.0], cumulative])[indptr[:-1]]
+    running_weight = cumulative - segment_offset[set_id]
+    totals = running_weight[np.maximum(indptr[1:] - 1, 0)]
+    totals = np.where(totals > 0, totals, 1.0)
+    hit_fraction = running_weight / totals[set_id]
+    rank_in_set = np.arange(len(positions)) - indptr[:-1][set_id] + 1
+    miss_norm = 1.0 / np.maximum(n_genes - sizes, 1)
+
+    after_hit = hit_fraction - (positions + 1 - rank_in_set) * miss_norm[set_id]
+    before_hit = (hit_fraction - hit_weights / totals[set_id]) \
+        - (positions - rank_in_set + 1) * miss_norm[set_id]
+
+    # 调用方保证每个基因集至少有一个命中，reduceat 的分段不会为空
+    starts = indptr[:-1]
+    top = np.maximum.reduceat(after_hit, starts)
+    bottom = np.minimum(np.minimum.reduceat(before_hit, starts), 0.0)
+    positive = top >= -bottom
+    es = np.where(positive, top, bottom)
+
+    # ES所在的排名位置：正向为达到峰值的命中处，负向为谷底（下一个命中之前）
+    at_peak = np.where(positive[set_id], after_hit, before_hit) == es[set_id]
+    peak_rank = np.full(n_sets, -1)
+    hit_index = np.flatnonzero(at_peak)[::-1]
+    peak_rank[set_id[hit_index]] = positions[hit_index] - (~positive[set_id[hit_index]])
+    return es, peak_rank
+
+
+def benchmark_enrichment(n_genes=20_000, n_terms=15_000, n_queries=50,
+                         n_permutations=1000, seed=13):
+    """
+    性能测试：2万基因、1.5万个基因集（大小呈对数正态分布）
+    - ORA：50个查询列表一次完成，并与逐个 hypergeom.sf 的结果抽查对比
+    - GSEA：1000次置换，以及第二次调用时的缓存效果（植入5个整体上调的基因集）
+    """
+    rng = np.random.default_rng(seed)
+    genes = np.array([f"GENE_{i:05d}" for i in range(n_genes)])
+    term_sizes = np.clip(rng.lognormal(3.5, 1.2, n_terms).astype(int), 3, 2000)
+    gene_ids = np.concatenate([rng.choice(n_genes, size, replace=False) for size in term_sizes])
+    term_ids = np.repeat(np.arange(n_terms), term_sizes)
+    collection = GeneSetCollection.from_pairs(genes[gene_ids],
+                                              np.char.add('TERM:', term_ids.astype(str)))
+
+    # 查询列表：一部分来自某个基因集（保证有真实富集），其余随机
+    queries = {}
+    for q in range(n_queries):
+        source = collection.membership[:, q].nonzero()[0]
+        picked = rng.choice(source, min(len(source), 30), replace=False)
+        noise = rng.choice(n_genes, rng.integers(200, 1000), replace=False)
+        queries[f"query_{q}"] = list(collection.genes[np.union1d(picked, noise)])
+
+    print(f"\n⏱️ 富集分析性能（{n_genes:,} 基因，{n_terms:,} 个基因集，{n_queries} 个查询）")
+    start_time = time.perf_counter()
+    table = collection.enrich(queries)
+    elapsed = time.perf_counter() - start_time
+    print(f"   ORA: {elapsed:.2f}秒，FDR<0.05的 (查询, 基因集) 对: {(table['fdr'] < 0.05).sum()}")
+
+    sample = table.sample(200, random_state=0)
+    expected_p = [stats.hypergeom.sf(row.overlap - 1, n_genes, row.term_size, row.query_size)
+                  for row in sample.itertuples()]
+    print(f"   与逐个 hypergeom.sf 对比一致: {'✓' if np.allclose(sample['p_value'], expected_p) else '✗'}")
+
+    # 5个中等大小基因集的成员整体上调
+    scores = pd.Series(rng.normal(0, 1, n_genes), index=genes)
+    sizes = collection.term_sizes
+    boosted_terms = np.flatnonzero((sizes >= 15) & (sizes <= 500))[:5]
+    scores[collection.genes[collection.membership[:, boosted_terms].nonzero()[0]]] += 1.0
+    for label in ('首次（含置换）', '再次（使用缓存）'):
+        start_time = time.perf_counter()
+        result = collection.gsea(scores, n_permutations=n_permutations)
+        found = set(collection.terms[boosted_terms]) <= set(result['term'][result['fdr'] < 0.05])
+        print(f"   GSEA {label}: {time.perf_counter() - start_time:.2f}秒，"
+              f"检验 {len(result)} 个基因集，FDR<0.05: {(result['fdr'] < 0.05).sum()}，"
+              f"找回全部上调基因集: {'✓' if found else '✗'}")
+    return elapsed
+
+
+if __name__ == "__main__":
+    benchmark_enrichment()
@@ -16,9 +16,14 @@ Chapter 07: Pandas高级数据分析 - 完整的RNA-seq分析流程
 
 import pandas as pd
 import numpy as np
-from scipy import stats
-from statsmodels.stats.multitest import multipletests
 import warnings
+
+from coexpression import coexpression_network
+from differential_expression import differential_expression
+from enrichment import GeneSetCollection
+from negative_binomial import nb_differential_expression
+from time_course import cluster_time_courses, kinetics_features
+
 warnings.filterwarnings('ignore')
 
 
@@ -90,15 +95,24 @@ def demonstrate_data_integration():
     return long_data, pivot_table
 
 
-def perform_differential_expression_analysis():
+# 差异表达分析支持的后端
+DE_BACKENDS = ('negative_binomial', 't-test')
+
+
+def perform_differential_expression_analysis(backend='negative_binomial'):
     """
     执行完整的差异表达分析流程
     
     生物学类比：像做qPCR验证，需要多个技术重复和生物学重复，
     还要进行统计检验确保结果可靠
+    
+    backend: 'negative_binomial'（计数模型，默认）或 't-test'
     """
+    if backend not in DE_BACKENDS:
+        raise ValueError(f"未知的分析方法: {backend}（可选: {', '.join(DE_BACKENDS)}）")
     print("\n📊 差异表达分析：识别疾病相关基因")
     print("=" * 60)
+    print(f"分析方法: {backend}")
     
     # 创建模拟的RNA-seq计数数据
     np.random.seed(42)
@@ -142,25 +156,31 @@ def perform_differential_expression_analysis():
     })
     
     # 计算统计指标
-    expression_df['control_mean'] = expression_df[['control_1', 'control_2', 'control_3']].mean(axis=1)
-    expression_df['treatment_mean'] = expression_df[['treatment_1', 'treatment_2', 'treatment_3']].mean(axis=1)
-    expression_df['fold_change'] = expression_df['treatment_mean'] / (expression_df['control_mean'] + 1)  # 加1避免除零
-    expression_df['log2_fc'] = np.log2(expression_df['fold_change'] + 0.01)  # 加小值避免log(0)
-    
-    # 执行t检验
-    p_values = []
-    for i in range(len(expression_df)):
-        control_values = expression_df.iloc[i][['control_1', 'control_2', 'control_3']].values.astype(float)
-        treatment_values = expression_df.iloc[i][['treatment_1', 'treatment_2', 'treatment_3']].values.astype(float)
-        _, p_value = stats.ttest_ind(control_values, treatment_values)
-        p_values.append(p_value)
-    
-    expression_df['p_value'] = p_values
-    
-    # FDR校正（控制假阳性）
-    _, fdr_corrected, _, _ = multipletests(expression_df['p_value'].values, 
-                                           method='fdr_bh')
-    expression_df['fdr'] = fdr_corrected
+    control_cols = ['control_1', 'control_2', 'control_3']
+    treatment_cols = ['treatment_1', 'treatment_2', 'treatment_3']
+    expression_df['control_mean'] = expression_df[control_cols].mean(axis=1)
+    expression_df['treatment_mean'] = expression_df[treatment_cols].mean(axis=1)
+    
+    if backend == 'negative_binomial':
+        # 计数模型：size factor校正文库大小，负二项GLM直接给出log2倍数变化，
+        # 不需要给计数加1
+        nb_result = nb_differential_expression(expression_df[control_cols + treatment_cols],
+                                               control_cols, treatment_cols)
+        expression_df['log2_fc'] = nb_result['log2_fc'].values
+        expression_df['fold_change'] = 2 ** expression_df['log2_fc']
+        expression_df['p_value'] = nb_result['p_value'].values
+        expression_df['fdr'] = nb_result['fdr'].values
+    else:  # 't-test'
+        expression_df['fold_change'] = expression_df['treatment_mean'] / (expression_df['control_mean'] + 1)  # 加1避免除零
+        expression_df['log2_fc'] = np.log2(expression_df['fold_change'] + 0.01)  # 加小值避免log(0)
+        
+        # 执行t检验：整个表达矩阵一次完成，不再逐基因iloc取行
+        de_result = differential_expression(expression_df[control_cols + treatment_cols],
+                                            control_cols, treatment_cols, method='student')
+        expression_df['p_value'] = de_result['p_value'].values
+        
+        # FDR校正（控制假阳性，Benjamini-Hochberg）
+        expression_df['fdr'] = de_result['fdr'].values
     
     # 筛选显著差异表达基因
     sig_threshold = 0.05
@@ -261,27 +281,29 @@ def analyze_time_series_expression():
     high_var_genes = time_series_data[time_series_data['cv'] > 0.3]
     print(high_var_genes[['gene_id', 'pattern_type', 'cv', 'max_change']].head(10).round(3))
     
-    # 计算相关性矩阵（找出相似表达模式的基因）
-    correlation_matrix = time_series_data[time_cols].T.corr()
+    # 响应动力学特征（按实际时间间隔计算）和基于表达形状的聚类
+    kinetics = kinetics_features(time_series_data.set_index('gene_id')[time_cols], time_points)
+    kinetics['pattern_type'] = pattern_types
+    print("\n各模式的动力学特征（均值）：")
+    print(kinetics.groupby('pattern_type')[['peak_time', 'auc_change', 'early_slope',
+                                            'oscillation_power']].mean().round(2))
+    
+    clusters = cluster_time_courses(time_series_data.set_index('gene_id')[time_cols],
+                                    n_clusters=4, method='hierarchical')
+    print("\n按表达形状聚类（相关距离层次聚类）与真实模式对照：")
+    print(pd.crosstab(kinetics['pattern_type'], clusters.values, colnames=['cluster']))
+    
+    # 共表达网络（找出相似表达模式的基因）：分块矩阵乘法直接得到 |r| > 0.9 的边，
+    # 不构建完整的相关性矩阵，也不逐对iloc
+    high_corr_df = coexpression_network(time_series_data.set_index('gene_id')[time_cols],
+                                        threshold=0.9)
     
     print("\n基因表达相关性分析：")
-    print(f"相关性矩阵大小: {correlation_matrix.shape}")
-    
-    # 找出高度相关的基因对
-    high_corr_pairs = []
-    for i in range(len(correlation_matrix)):
-        for j in range(i+1, len(correlation_matrix)):
-            if abs(correlation_matrix.iloc[i, j]) > 0.9:
-                high_corr_pairs.append({
-                    'gene1': gene_ids[i],
-                    'gene2': gene_ids[j],
-                    'correlation': correlation_matrix.iloc[i, j]
-                })
-    
-    if high_corr_pairs:
-        high_corr_df = pd.DataFrame(high_corr_pairs).head(5)
+    print(f"共表达网络: {len(time_series_data)} 个基因, {len(high_corr_df)} 条边")
+    
+    if len(high_corr_df):
         print(f"高度相关的基因对（|r| > 0.9，前5对）：")
-        print(high_corr_df.round(3))
+        print(high_corr_df.head(5).round(3))
     
     return time_series_data
 
@@ -360,22 +382,16 @@ def perform_functional_grouping_analysis():
     # 假设我们有一组差异表达基因
     n_deg = 50  # 差异表达基因数
     deg_indices = np.random.choice(n_genes, n_deg, replace=False)
-    deg_functions = gene_annotation_df.iloc[deg_indices]['function'].value_counts()
-    
-    enrichment_results = []
-    for func in functions:
-        n_func_in_deg = deg_functions.get(func, 0)
-        n_func_total = (gene_annotation_df['function'] == func).sum()
-        # 简化的富集分数计算
-        enrichment_score = (n_func_in_deg / n_deg) / (n_func_total / n_genes)
-        enrichment_results.append({
-            'function': func,
-            'genes_in_DEG': n_func_in_deg,
-            'genes_total': n_func_total,
-            'enrichment_score': enrichment_score
-        })
-    
-    enrichment_df = pd.DataFrame(enrichment_results)
+    # 所有功能类别一次完成超几何检验（基因集为稀疏成员矩阵）
+    collection = GeneSetCollection.from_labels(
+        gene_annotation_df.set_index('gene_id')['function'])
+    deg_genes = gene_annotation_df['gene_id'].iloc[deg_indices]
+    enrichment_df = collection.enrich({'DEG': deg_genes}, report_zero_overlap=True)
+    enrichment_df = enrichment_df.rename(columns={
+        'term': 'function', 'overlap': 'genes_in_DEG', 'term_size': 'genes_total',
+        'fold_enrichment': 'enrichment_score'})
+    enrichment_df = enrichment_df[['function', 'genes_in_DEG', 'genes_total',
+                                   'enrichment_score', 'fdr']]
     enrichment_df = enrichment_df.sort_values('enrichment_score', ascending=False)
     print(enrichment_df.round(3))
     
@@ -9,9 +9,13 @@ Chapter 07: Pandas高级数据分析 - 练习题参考答案
 
 import pandas as pd
 import numpy as np
-from scipy import stats
-from statsmodels.stats.multitest import multipletests
 import warnings
+
+from coexpression import coexpression_network
+from differential_expression import differential_expression
+from enrichment import GeneSetCollection
+from time_course import cluster_time_courses, kinetics_features
+
 warnings.filterwarnings('ignore')
 
 
@@ -292,19 +296,15 @@ def practice_4_differential_analysis():
     df['fold_change'] = (df['disease_mean'] + 1) / (df['healthy_mean'] + 1)
     df['log2_fc'] = np.log2(df['fold_change'])
     
-    # 执行t检验
-    p_values = []
-    for i in range(len(df)):
-        healthy_vals = df.iloc[i][['healthy_1', 'healthy_2', 'healthy_3']].values
-        disease_vals = df.iloc[i][['disease_1', 'disease_2', 'disease_3']].values
-        _, p_val = stats.ttest_ind(healthy_vals, disease_vals)
-        p_values.append(p_val)
-    
-    df['p_value'] = p_values
+    # 执行t检验：整个矩阵一次完成
+    healthy_cols = ['healthy_1', 'healthy_2', 'healthy_3']
+    disease_cols = ['disease_1', 'disease_2', 'disease_3']
+    de_result = differential_expression(df[healthy_cols + disease_cols],
+                                        healthy_cols, disease_cols, method='student')
+    df['p_value'] = de_result['p_value'].values
     
     # FDR校正
-    _, fdr_values, _, _ = multipletests(df['p_value'].values, method='fdr_bh')
-    df['fdr'] = fdr_values
+    df['fdr'] = de_result['fdr'].values
     
     # 筛选差异基因
     sig_threshold = 0.05
@@ -463,24 +463,14 @@ def practice_6_functional_grouping():
     
     # 随机选择50个基因作为"差异表达基因"
     deg_indices = np.random.choice(n_genes, 50, replace=False)
-    deg_functions = df.iloc[deg_indices]['function'].value_counts()
-    
-    # 计算富集分数
-    enrichment_results = []
-    for func in functions:
-        observed = deg_functions.get(func, 0)
-        expected = (df['function'] == func).sum() * (50 / n_genes)
-        enrichment = observed / expected if expected > 0 else 0
-        
-        enrichment_results.append({
-            'function': func,
-            'observed': observed,
-            'expected': round(expected, 1),
-            'enrichment_score': enrichment,
-            'enriched': 'Yes' if enrichment > 1.5 else 'No'
-        })
-    
-    enrichment_df = pd.DataFrame(enrichment_results)
+    # 超几何检验计算富集（所有功能类别一次完成）
+    collection = GeneSetCollection.from_labels(df['function'])
+    enrichment_df = collection.enrich({'DEG': df.index[deg_indices]}, report_zero_overlap=True)
+    enrichment_df = enrichment_df.rename(columns={
+        'term': 'function', 'overlap': 'observed', 'fold_enrichment': 'enrichment_score'})
+    enrichment_df['enriched'] = np.where(enrichment_df['fdr'] < 0.05, 'Yes', 'No')
+    enrichment_df = enrichment_df[['function', 'observed', 'expected', 'enrichment_score',
+                                   'p_value', 'fdr', 'enriched']]
     enrichment_df = enrichment_df.sort_values('enrichment_score', ascending=False)
     print(enrichment_df.round(2))
     
@@ -548,6 +538,15 @@ def practice_7_time_series():
     }).rename(columns={'T0h': 'gene_count'})
     print(pattern_summary.round(2))
     
+    # 动力学特征 + 按形状聚类：不依赖构造数据时给出的模式标签
+    kinetics = kinetics_features(df[time_cols], time_points)
+    df['cluster'] = cluster_time_courses(df[time_cols], n_clusters=5, method='kmeans', seed=42)
+    print("\n各簇的动力学特征（均值）：")
+    summary = kinetics.groupby(df['cluster'])[['peak_time', 'peak_log2fc',
+                                               'late_slope']].mean()
+    summary['main_pattern'] = df.groupby('cluster')['pattern'].agg(lambda x: x.mode()[0])
+    print(summary.round(2))
+    
     # 识别早期响应基因（1-2小时内显著变化）
     early_threshold = 1.5  # 1.5倍变化
     early_genes = df[
@@ -560,27 +559,14 @@ def practice_7_time_series():
     if len(early_genes) > 0:
         print(f"  前5个: {early_genes.index[:5].tolist()}")
     
-    # 计算基因间相关性（找出共调控基因）
-    correlation_matrix = df[time_cols].T.corr()
-    
-    # 找出高度相关的基因对
-    high_corr_pairs = []
-    for i in range(len(correlation_matrix)):
-        for j in range(i+1, len(correlation_matrix)):
-            corr_val = correlation_matrix.iloc[i, j]
-            if abs(corr_val) > 0.95:
-                high_corr_pairs.append({
-                    'gene1': gene_ids[i],
-                    'gene2': gene_ids[j],
-                    'correlation': corr_val,
-                    'pattern1': df.iloc[i]['pattern'],
-                    'pattern2': df.iloc[j]['pattern']
-                })
-    
-    if high_corr_pairs:
+    # 计算基因间相关性（找出共调控基因）：分块计算，只保留 |r| > 0.95 的基因对
+    corr_df = coexpression_network(df[time_cols], threshold=0.95)
+    corr_df['pattern1'] = df.loc[corr_df['gene1'], 'pattern'].values
+    corr_df['pattern2'] = df.loc[corr_df['gene2'], 'pattern'].values
+    
+    if len(corr_df):
         print(f"\n高度相关的基因对（|r| > 0.95）：")
-        corr_df = pd.DataFrame(high_corr_pairs).head(5)
-        print(corr_df[['gene1', 'gene2', 'correlation', 'pattern1']].round(3))
+        print(corr_df[['gene1', 'gene2', 'correlation', 'pattern1']].head(5).round(3))
     
     return df
 
@@ -840,27 +826,17 @@ def bonus_challenge():
     control_cols = [col for col in tpm_corrected.columns if 'Control' in col]
     treatment_cols = [col for col in tpm_corrected.columns if 'Treatment' in col]
     
-    # 计算fold change和p值
-    results = []
-    for gene in tpm_corrected.index:
-        control_vals = tpm_corrected.loc[gene, control_cols].values
-        treatment_vals = tpm_corrected.loc[gene, treatment_cols].values
-        
-        fc = treatment_vals.mean() / (control_vals.mean() + 0.01)
-        _, p_val = stats.ttest_ind(control_vals, treatment_vals)
-        
-        results.append({
-            'gene': gene,
-            'fold_change': fc,
-            'log2_fc': np.log2(fc + 0.01),
-            'p_value': p_val
-        })
-    
-    deg_df = pd.DataFrame(results)
-    
-    # FDR校正
-    _, fdr, _, _ = multipletests(deg_df['p_value'].values, method='fdr_bh')
-    deg_df['fdr'] = fdr
+    # 计算fold change和p值（矩阵化，一次处理所有基因）
+    de_result = differential_expression(tpm_corrected, control_cols, treatment_cols,
+                                        method='student')
+    fc = de_result['mean_b'] / (de_result['mean_a'] + 0.01)
+    deg_df = pd.DataFrame({
+        'gene': tpm_corrected.index,
+        'fold_change': fc.values,
+        'log2_fc': np.log2(fc.values + 0.01),
+        'p_value': de_result['p_value'].values,
+        'fdr': de_result['fdr'].values,
+    })
     
     # 筛选差异基因
     sig_genes = deg_df[(deg_df['fdr'] < 0.05) & (np.abs(deg_df['log2_fc']) > 1)]
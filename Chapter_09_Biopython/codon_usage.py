@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chapter 09 工具模块：数组化的密码子使用统计（RSCU / CAI / ENC）
+
+逐个切片 Seq 再更新字典，每个密码子都要创建一个新对象。这里：
+
+1. 把一批CDS拼接后一次编码成uint8数组（A=0, C=1, G=2, T=3, 其他=4）
+2. 用数组运算算出每条CDS所有同框密码子的编号（0-63，含N的记为64）
+3. 用一次 np.bincount 得到 (基因数 × 64) 的计数矩阵
+4. RSCU、CAI、ENC 都是这个计数矩阵上的矩阵运算
+
+指标说明：
+- RSCU：某密码子的使用次数 / 同义密码子的平均使用次数（1表示无偏好）
+- CAI（Sharp & Li 1987）：参考基因集中每个密码子相对同义最优密码子的
+  使用比例 w，基因的CAI是其密码子 w 值的几何平均；
+  参考集中没出现的密码子按0.5次计，单密码子氨基酸和终止密码子不计入
+- ENC（Wright 1990）：有效密码子数，20（极端偏好）到61（完全均匀）
+"""
+
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from Bio.Data import CodonTable
+
+from orf_finder import INVALID_CODON, encode_sequence
+
+
+# 密码子编号与 orf_finder.codon_indices 相同：第一位×16 + 第二位×4 + 第三位
+CODONS = [a + b + c for a in 'ACGT' for b in 'ACGT' for c in 'ACGT']
+
+# 每批拼接编码的碱基数，控制中间数组的内存
+BATCH_BASES = 1 << 24
+
+
+def genetic_code(table=1):
+    """
+    返回长度64的数组：每个密码子编号对应的氨基酸（终止密码子为 '*'）
+    """
+    codon_table = CodonTable.unambiguous_dna_by_id[table]
+    amino_acids = np.array(['*'] * 64, dtype='<U1')
+    for index, codon in enumerate(CODONS):
+        if codon in codon_table.forward_table:
+            amino_acids[index] = codon_table.forward_table[codon]
+    return amino_acids
+
+
+def _families(table):
+    """
+    同义密码子家族
+
+    返回 (amino_acids, membership)：
+        amino_acids: 家族对应的氨基酸（按字母排序，'*'在最前）
+        membership: 64×家族数 的0/1矩阵，计数矩阵乘以它就是每个氨基酸的总数
+    """
+    codon_aa = genetic_code(table)
+    amino_acids = np.unique(codon_aa)
+    membership = (codon_aa[:, None] == amino_acids[None, :]).astype(np.float64)
+    return amino_acids, membership
+
+
+def _as_sequences(sequences):
+    """{ID: 序列}、序列列表或 SeqRecord 列表 → (ID列表, 大写字符串列表)"""
+    if isinstance(sequences, dict):
+        items = sequences.items()
+    else:
+        items = ((getattr(seq, 'id', f"seq_{i}"), seq) for i, seq in enumerate(sequences, 1))
+    seq_ids, seq_strs = [], []
+    for seq_id, seq in items:
+        seq_ids.append(seq_id)
+        seq_strs.append(str(getattr(seq, 'seq', seq)).upper())
+    return seq_ids, seq_strs
+
+
+def _count_batch(seq_strs):
+    """统计一批序列的同框密码子，返回 (序列数 × 65) 的计数，最后一列是含N的密码子"""
+    lengths = np.array([len(seq) for seq in seq_strs], dtype=np.int64)
+    n_codons = lengths // 3
+    codes = encode_sequence(''.join(seq_strs))
+
+    # 每个密码子在拼接序列中的起点：序列起点 + 3×(序列内的密码子序号)
+    seq_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    codon_offsets = np.concatenate([[0], np.cumsum(n_codons)[:-1]])
+    record = np.repeat(np.arange(len(seq_strs)), n_codons)
+    starts = seq_starts[record] + 3 * (np.arange(n_codons.sum()) - codon_offsets[record])
+
+    first, second, third = codes[starts], codes[starts + 1], codes[starts + 2]
+    indices = first.astype(np.int64) * 16 + second * 4 + third
+    indices[(first > 3) | (second > 3) | (third > 3)] = INVALID_CODON
+
+    counts = np.bincount(record * 65 + indices, minlength=len(seq_strs) * 65)
+    return counts.reshape(len(seq_strs), 65)
+
+
+def codon_counts(sequences):
+    """
+    统计每条CDS的密码子使用
+
+    参数：
+        sequences: {ID: 序列}、序列列表或 SeqRecord 列表；
+            从第一个碱基开始按密码子读取，末尾不足3个的碱基忽略
+
+    返回 (seq_ids, counts)，counts 是 (序列数 × 64) 的int64矩阵，
+    列顺序与 CODONS 相同；含N等非标准碱基的密码子不计入
+    """
+    seq_ids, seq_strs = _as_sequences(sequences)
+    blocks = []
+    batch, batch_bases = [], 0
+    for seq in seq_strs:
+        batch.append(seq)
+        batch_bases += len(seq)
+        if batch_bases >= BATCH_BASES:
+            blocks.append(_count_batch(batch))
+            batch, batch_bases = [], 0
+    if batch or not blocks:
+        blocks.append(_count_batch(batch) if batch else np.zeros((0, 65), dtype=np.int64))
+    counts = np.vstack(blocks)[:, :64]
+    return seq_ids, counts
+
+
+def rscu(counts, table=1):
+    """
+    同义密码子相对使用度（RSCU）
+
+    counts 可以是长度64的向量或 (基因数 × 64) 的矩阵；
+    某个氨基酸完全没出现时，它的密码子RSCU为nan
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    codon_aa = genetic_code(table)
+    amino_acids, membership = _families(table)
+    family = np.searchsorted(amino_acids, codon_aa)
+    family_size = membership.sum(axis=0)[family]
+    family_total = (counts @ membership)[..., family]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return counts * family_size / family_total
+
+
+def relative_adaptiveness(reference_counts, table=1):
+    """
+    由参考基因集的密码子计数得到每个密码子的相对适应度 w
+
+    w = 该密码子使用次数 / 同义密码子中最高的使用次数；
+    参考集中没出现的密码子按0.5次计（Sharp & Li 的约定）。
+    单密码子氨基酸（如Met、Trp）和终止密码子的 w 为nan，不参与CAI。
+    """
+    reference = np.asarray(reference_counts, dtype=np.float64)
+    if reference.ndim == 2:
+        reference = reference.sum(axis=0)
+    reference = np.where(reference > 0, reference, 0.5)
+
+    codon_aa = genetic_code(table)
+    weights = np.full(64, np.nan)
+    for aa in np.unique(codon_aa):
+        members = np.flatnonzero(codon_aa == aa)
+        if aa == '*' or len(members) < 2:
+            continue
+        weights[members] = reference[members] / reference[members].max()
+    return weights
+
+
+def cai(counts, weights):
+    """
+    密码子适应指数：基因中所有（有 w 值的）密码子 w 的几何平均
+
+    counts: 长度64的向量或 (基因数 × 64) 的矩阵
+    weights: relative_adaptiveness 的结果
+    没有可计入密码子的基因返回nan
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    scored = ~np.isnan(weights)
+    used = counts[..., scored]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.exp(used @ np.log(weights[scored]) / used.sum(axis=-1))
+
+
+def effective_number_of_codons(counts, table=1):
+    """
+    有效密码子数 ENC（Wright 1990）
+
+    对每个氨基酸计算纯合度 F = (n·Σp² - 1)/(n - 1)，
+    按简并度（2、3、4、6重等）分类取平均，ENC = Σ 该类氨基酸数 / 平均F，
+    单密码子氨基酸各计1。只有Ile的3重简并类缺失时用2重和4重的平均值代替；
+    其他类别缺失时返回nan。结果不超过有义密码子总数（标准密码表为61）。
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    amino_acids, membership = _families(table)
+    sense = amino_acids != '*'
+    amino_acids, membership = amino_acids[sense], membership[:, sense]
+    degeneracy = membership.sum(axis=0).astype(int)
+
+    totals = counts @ membership
+    with np.errstate(divide='ignore', invalid='ignore'):
+        homozygosity = ((counts ** 2 @ membership) / totals - 1) / (totals - 1)
+    homozygosity[totals < 2] = np.nan
+
+    enc = np.zeros(counts.shape[:-1])
+    class_f = {}
+    for size in np.unique(degeneracy):
+        in_class = degeneracy == size
+        if size == 1:
+            enc += in_class.sum()
+            continue
+        with warnings.catch_warnings():
+            # 这一类氨基酸在某些基因里全都没出现时 nanmean 会警告，结果是nan
+            warnings.simplefilter('ignore', RuntimeWarning)
+            class_f[size] = np.nanmean(homozygosity[..., in_class], axis=-1)
+
+    if 3 in class_f and 2 in class_f and 4 in class_f:
+        class_f[3] = np.where(np.isnan(class_f[3]), (class_f[2] + class_f[4]) / 2, class_f[3])
+    for size, mean_f in class_f.items():
+        with np.errstate(divide='ignore'):
+            enc = enc + (degeneracy == size).sum() / mean_f
+
+    return np.minimum(enc, membership.sum())
+
+
+def profile_cds(sequences, reference=None, table=1):
+    """
+    一次性统计一批CDS的密码子使用指标
+
+    参数：
+        sequences: {ID: 序列}、序列列表或 SeqRecord 列表
+        reference: 计算CAI的参考基因集（同样的格式，或长度64的计数向量）；
+            默认用全部输入基因合并的密码子使用作参考
+        table: NCBI遗传密码表编号
+
+    返回 (profile, counts)：
+        profile: pandas.DataFrame，列为 id, n_codons, gc3, cai, enc
+        counts: (基因数 × 64) 的计数矩阵，列顺序与 CODONS 相同
+    """
+    seq_ids, counts = codon_counts(sequences)
+    if reference is None:
+        reference_counts = counts.sum(axis=0)
+    elif isinstance(reference, np.ndarray):
+        reference_counts = reference
+    else:
+        reference_counts = codon_counts(reference)[1].sum(axis=0)
+    weights = relative_adaptiveness(reference_counts, table)
+
+    # GC3：有义密码子中第三位是G或C的比例
+    sense = genetic_code(table) != '*'
+    third_gc = np.array([codon[2] in 'GC' for codon in CODONS])
+    sense_counts = counts[:, sense].sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gc3 = counts[:, sense & third_gc].sum(axis=1) / sense_counts
+
+    profile = pd.DataFrame({
+        'id': seq_ids,
+        'n_codons': counts.sum(axis=1),
+        'gc3': gc3,
+        'cai': cai(counts, weights),
+        'enc': effective_number_of_codons(counts, table),
+    })
+    return profile, counts
+
+
+def _simulate_cds(n_genes, mean_codons, rng, table=1):
+    """模拟一批CDS：ATG开头、终止密码子结尾，每个基因的密码子偏好强弱不同"""
+    codon_aa = genetic_code(table)
+    sense = np.flatnonzero((codon_aa != '*') & (np.array(CODONS) != 'ATG'))
+    stops = np.flatnonzero(codon_aa == '*')
+    preferred = rng.dirichlet(np.full(len(sense), 0.5))
+    codon_bytes = np.frombuffer(''.join(CODONS).encode(), dtype=np.uint8).reshape(64, 3)
+
+    sequences = {}
+    for k in range(n_genes):
+        n_codons = max(int(rng.exponential(mean_codons)), 50)
+        bias = rng.random()
+        probabilities = bias * preferred + (1 - bias) / len(sense)
+        body = rng.choice(sense, size=n_codons, p=probabilities)
+        codons = np.concatenate([[CODONS.index('ATG')], body, [rng.choice(stops)]])
+        sequences[f"gene_{k}"] = codon_bytes[codons].tobytes().decode()
+    return sequences
+
+
+def benchmark_codon_usage(n_genes=20_000, mean_codons=500, seed=11):
+    """性能测试：约2万条CDS（人类蛋白编码基因的规模）的RSCU/CAI/ENC"""
+    rng = np.random.default_rng(seed)
+    sequences = _simulate_cds(n_genes, mean_codons, rng)
+    total_bases = sum(len(seq) for seq in sequences.values())
+    reference = dict(list(sequences.items())[:200])
+
+    print(f"\n⏱️ 密码子使用统计性能（{n_genes:,} 条CDS，共 {total_bases / 1e6:.1f} Mb）")
+    start_time = time.perf_counter()
+    profile, counts = profile_cds(sequences, reference=reference)
+    rscu(counts.sum(axis=0))
+    elapsed = time.perf_counter() - start_time
+    print(f"   计数 + RSCU + CAI + ENC: {elapsed:.2f}秒")
+    print(f"   平均CAI: {profile['cai'].mean():.3f}，平均ENC: {profile['enc'].mean():.1f}")
+    return elapsed
+
+
+if __name__ == "__main__":
+    benchmark_codon_usage()
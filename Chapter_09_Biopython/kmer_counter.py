@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chapter 09 工具模块：线性时间k-mer计数（2-bit编码）
+
+每个碱基用2个bit表示（A=00, C=01, G=10, T=11），
+一个k-mer就是一个 2k bit 的整数。对整条序列：
+- 用移位和按位或一次算出所有k-mer的编号（共k次数组运算）
+- k ≤ 12 时用 np.bincount 得到完整的 4^k 频谱
+- k 更大时频谱太大，改为只统计实际出现的k-mer（np.unique）
+
+含N等非标准碱基的k-mer会被跳过。可选"规范k-mer"（canonical）计数：
+k-mer与它的反向互补取编号较小的一个，两条链合并统计。
+"""
+
+import numpy as np
+
+from orf_finder import encode_sequence
+
+
+# 超过这个k值，完整频谱（4^k个计数）就太大了
+MAX_DENSE_K = 12
+# uint64能容纳的最大k
+MAX_K = 31
+
+
+def kmer_codes(sequence, k, canonical=False):
+    """
+    计算序列中所有有效k-mer的编号
+
+    sequence 可以是字符串/bytes，也可以是 encode_sequence 编码好的uint8数组。
+    返回 (codes, positions)：
+        codes: uint64数组，每个k-mer的2-bit编码
+        positions: 对应的起始位置（跳过了含N的k-mer）
+    """
+    if not 1 <= k <= MAX_K:
+        raise ValueError(f"k必须在1到{MAX_K}之间")
+
+    bases = sequence if isinstance(sequence, np.ndarray) else encode_sequence(sequence)
+    n_kmers = len(bases) - k + 1
+    if n_kmers <= 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+
+    # 含N的窗口：用无效碱基的前缀和判断窗口内是否有N
+    invalid = np.concatenate([[0], np.cumsum(bases > 3)])
+    valid = (invalid[k:] - invalid[:-k]) == 0
+
+    values = (bases & 3).astype(np.uint64)
+    codes = np.zeros(n_kmers, dtype=np.uint64)
+    for offset in range(k):
+        codes = (codes << np.uint64(2)) | values[offset:offset + n_kmers]
+
+    if canonical:
+        # 反向互补：互补碱基 = 3 - 碱基，且顺序颠倒
+        complement = np.uint64(3) - values
+        rc_codes = np.zeros(n_kmers, dtype=np.uint64)
+        for offset in range(k - 1, -1, -1):
+            rc_codes = (rc_codes << np.uint64(2)) | complement[offset:offset + n_kmers]
+        codes = np.minimum(codes, rc_codes)
+
+    positions = np.flatnonzero(valid)
+    return codes[valid], positions
+
+
+def decode_kmer(code, k):
+    """把k-mer编号还原成字符串"""
+    code = int(code)
+    bases = []
+    for _ in range(k):
+        bases.append('ACGT'[code & 3])
+        code >>= 2
+    return ''.join(reversed(bases))
+
+
+def encode_kmer(kmer):
+    """k-mer字符串 → 编号（与 kmer_codes 一致）"""
+    code = 0
+    for base in kmer.upper():
+        code = (code << 2) | 'ACGT'.index(base)
+    return code
+
+
+def kmer_spectrum(sequence, k, canonical=False):
+    """
+    完整的k-mer频谱：长度为 4^k 的计数数组，下标就是k-mer编号
+
+    只适用于 k ≤ 12（4^12 ≈ 1670万个计数）
+    """
+    if k > MAX_DENSE_K:
+        raise ValueError(f"k > {MAX_DENSE_K} 时频谱过大，请使用 count_kmers")
+    codes, _ = kmer_codes(sequence, k, canonical)
+    return np.bincount(codes.astype(np.int64), minlength=4 ** k)
+
+
+def count_kmers(sequence, k, canonical=False):
+    """
+    统计实际出现的k-mer
+
+    返回 (codes, counts)，codes按编号升序排列。
+    k ≤ 12 时走 np.bincount，k 更大时用 np.unique 汇总。
+    """
+    if k <= MAX_DENSE_K:
+        spectrum = kmer_spectrum(sequence, k, canonical)
+        codes = np.flatnonzero(spectrum)
+        return codes.astype(np.uint64), spectrum[codes]
+    codes, _ = kmer_codes(sequence, k, canonical)
+    return np.unique(codes, return_counts=True)
+
+
+def top_kmers(sequence, k, n=10, min_count=2, canonical=False):
+    """
+    出现次数最多的n个k-mer
+
+    返回 [(k-mer字符串, 次数), ...]，次数相同时按k-mer字母顺序
+    """
+    codes, counts = count_kmers(sequence, k, canonical)
+    keep = counts >= min_count
+    codes, counts = codes[keep], counts[keep]
+    # 先按次数降序，再按编号（即字母顺序）升序
+    order = np.lexsort((codes, -counts))[:n]
+    return [(decode_kmer(codes[i], k), int(counts[i])) for i in order]
+
+
+def kmer_positions(sequence, kmer):
+    """某个k-mer在序列中出现的所有起始位置"""
+    codes, positions = kmer_codes(sequence, len(kmer))
+    return positions[codes == np.uint64(encode_kmer(kmer))]
@@ -16,13 +16,21 @@ from Bio.SeqRecord import SeqRecord
 from Bio import SeqIO, Entrez, AlignIO
 from Bio.SeqUtils import gc_fraction, molecular_weight
 from Bio.SeqUtils.ProtParam import ProteinAnalysis
-from Bio.Data import CodonTable
 from Bio.Restriction import *
 from Bio.SeqFeature import SeqFeature, FeatureLocation
 import io
 import random
 from datetime import datetime
 
+from codon_usage import (CODONS, cai, codon_counts, effective_number_of_codons,
+                         genetic_code, relative_adaptiveness, rscu)
+from cpg_islands import find_cpg_islands
+from gc_profile import window_profile
+from kmer_counter import decode_kmer, kmer_positions, kmer_spectrum, top_kmers
+from motif_search import MotifMatcher
+from orf_finder import find_orfs_vectorized
+from restriction_digest import DigestEngine, fragment_lengths
+
 
 def demonstrate_seq_fundamentals():
     """
@@ -252,8 +260,12 @@ def demonstrate_restriction_analysis():
     # 定义要检查的酶
     enzymes_to_check = [EcoRI, BamHI, HindIII, PstI, SalI, NotI]
     
+    # 所有酶编译成一个搜索引擎，质粒只扫描一遍
+    engine = DigestEngine(RestrictionBatch(enzymes_to_check))
+    all_sites = engine.cut_positions(plasmid_seq)
+    
     for enzyme in enzymes_to_check:
-        sites = enzyme.search(plasmid_seq)
+        sites = all_sites.get(str(enzyme), [])
         if sites:
             print(f"{enzyme.__name__:8} ({enzyme.site:6}): 切割位点 {sites}")
         else:
@@ -264,9 +276,9 @@ def demonstrate_restriction_analysis():
     print("-" * 40)
     
     # 用EcoRI和BamHI双酶切
-    if EcoRI.search(plasmid_seq) and BamHI.search(plasmid_seq):
-        eco_site = EcoRI.search(plasmid_seq)[0]
-        bam_site = BamHI.search(plasmid_seq)[0]
+    if 'EcoRI' in all_sites and 'BamHI' in all_sites:
+        eco_site = all_sites['EcoRI'][0]
+        bam_site = all_sites['BamHI'][0]
         
         print(f"EcoRI切割位点: {eco_site}")
         print(f"BamHI切割位点: {bam_site}")
@@ -276,6 +288,9 @@ def demonstrate_restriction_analysis():
             insert = plasmid_seq[eco_site:bam_site]
             print(f"插入片段 ({eco_site}-{bam_site}): {insert}")
             print(f"片段长度: {len(insert)} bp")
+        
+        double_digest = all_sites['EcoRI'] + all_sites['BamHI']
+        print(f"双酶切片段长度: {fragment_lengths(double_digest, len(plasmid_seq)).tolist()}")
 
 
 def demonstrate_protein_analysis():
@@ -336,39 +351,14 @@ def demonstrate_orf_finding():
     print(f"基因组序列: {genomic_seq}")
     print(f"序列长度: {len(genomic_seq)} bp\n")
     
-    def find_orfs(sequence, min_length=6):
-        """查找所有可能的ORF"""
-        orfs = []
-        seq_len = len(sequence)
-        
-        # 检查三个阅读框
-        for frame in range(3):
-            for i in range(frame, seq_len - 2, 3):
-                codon = sequence[i:i+3]
-                # 查找起始密码子
-                if str(codon) == 'ATG':
-                    # 查找终止密码子
-                    for j in range(i + 3, seq_len - 2, 3):
-                        stop_codon = sequence[j:j+3]
-                        if str(stop_codon) in ['TAA', 'TAG', 'TGA']:
-                            orf_seq = sequence[i:j+3]
-                            if len(orf_seq) >= min_length:
-                                protein = orf_seq.translate()
-                                orfs.append({
-                                    'frame': frame,
-                                    'start': i,
-                                    'end': j+3,
-                                    'length': len(orf_seq),
-                                    'sequence': orf_seq,
-                                    'protein': protein
-                                })
-                            break
-        return orfs
+    # 六个阅读框一次完成：序列编码成数组后，
+    # 用向量化比较找出所有起始/终止密码子（见 orf_finder.py）
+    all_orfs = find_orfs_vectorized(genomic_seq, min_length=6)
     
     # 正向链ORF
     print("正向链ORF搜索:")
     print("-" * 40)
-    forward_orfs = find_orfs(genomic_seq)
+    forward_orfs = [orf for orf in all_orfs if orf['strand'] == '+']
     
     if forward_orfs:
         for i, orf in enumerate(forward_orfs, 1):
@@ -383,13 +373,12 @@ def demonstrate_orf_finding():
     # 反向互补链ORF
     print("\n反向互补链ORF搜索:")
     print("-" * 40)
-    rev_comp = genomic_seq.reverse_complement()
-    reverse_orfs = find_orfs(rev_comp)
+    reverse_orfs = [orf for orf in all_orfs if orf['strand'] == '-']
     
     if reverse_orfs:
         for i, orf in enumerate(reverse_orfs, 1):
             print(f"ORF {i} (反向):")
-            print(f"  位置: {orf['start']}-{orf['end']} (框{orf['frame']})")
+            print(f"  位置: {orf['start']}-{orf['end']} (正链坐标, 反向框{orf['frame']})")
             print(f"  长度: {orf['length']} bp")
             print(f"  蛋白: {orf['protein']}")
     else:
@@ -425,23 +414,16 @@ def demonstrate_sequence_patterns():
     print("调控元件搜索:")
     print("-" * 40)
     
+    # 把所有模体（含简并碱基和反向互补）编译成一个Aho-Corasick自动机，
+    # 序列只扫描一遍就能找到全部模体（见 motif_search.py）
+    matcher = MotifMatcher(patterns)
+    hits = matcher.search(regulatory_seq)
+    
     for name, pattern in patterns.items():
-        # 简单模式搜索
-        positions = []
-        search_pattern = pattern.replace('R', '[AG]')  # 处理简并碱基
-        
-        # 搜索所有出现位置
-        seq_str = str(regulatory_seq)
-        start = 0
-        while True:
-            pos = seq_str.find(pattern, start)
-            if pos == -1:
-                break
-            positions.append(pos)
-            start = pos + 1
-        
-        if positions:
-            print(f"{name:12} ({pattern}): 位置 {positions}")
+        motif_hits = [hit for hit in hits if hit['name'] == name]
+        if motif_hits:
+            locations = [f"{hit['position']}({hit['strand']})" for hit in motif_hits]
+            print(f"{name:12} ({pattern}): 位置 {locations}")
         else:
             print(f"{name:12} ({pattern}): 未找到")
     
@@ -449,22 +431,15 @@ def demonstrate_sequence_patterns():
     print("\n重复序列分析:")
     print("-" * 40)
     
-    # 查找串联重复
+    # 2-bit编码后一次算出所有k-mer的计数（见 kmer_counter.py），
+    # 不再为每个k-mer保存位置列表
     for length in [2, 3, 4]:
-        repeats = {}
-        seq_str = str(regulatory_seq)
-        for i in range(len(seq_str) - length + 1):
-            motif = seq_str[i:i+length]
-            if motif not in repeats:
-                repeats[motif] = []
-            repeats[motif].append(i)
-        
-        # 找出重复的模体
-        repeated_motifs = {k: v for k, v in repeats.items() if len(v) > 1}
+        repeated_motifs = top_kmers(regulatory_seq, length, n=3, min_count=2)
         if repeated_motifs:
             print(f"{length}bp重复:")
-            for motif, positions in list(repeated_motifs.items())[:3]:
-                print(f"  {motif}: 出现{len(positions)}次，位置{positions[:5]}")
+            for motif, count in repeated_motifs:
+                positions = kmer_positions(regulatory_seq, motif)
+                print(f"  {motif}: 出现{count}次，位置{positions[:5].tolist()}")
 
 
 def demonstrate_codon_usage():
@@ -484,41 +459,43 @@ def demonstrate_codon_usage():
     print(f"CDS序列: {cds_seq[:30]}...")
     print(f"序列长度: {len(cds_seq)} bp\n")
     
-    # 统计密码子使用
-    codon_count = {}
-    for i in range(0, len(cds_seq)-2, 3):
-        codon = str(cds_seq[i:i+3])
-        if len(codon) == 3:
-            codon_count[codon] = codon_count.get(codon, 0) + 1
+    # 统计密码子使用：编码成数组后一次 bincount
+    _, counts = codon_counts([cds_seq])
+    codon_count = dict(zip(CODONS, counts[0]))
+    codon_rscu = dict(zip(CODONS, rscu(counts[0])))
     
-    print("密码子使用频率:")
+    print("密码子使用频率 [次数/RSCU]:")
     print("-" * 40)
     
     # 按氨基酸分组显示
-    standard_table = CodonTable.unambiguous_dna_by_id[1]
+    codon_aa = genetic_code(1)
     aa_codons = {}
-    
-    for codon, aa in standard_table.forward_table.items():
-        if aa not in aa_codons:
-            aa_codons[aa] = []
-        aa_codons[aa].append(codon)
-    
-    # 添加终止密码子
-    aa_codons['*'] = standard_table.stop_codons
+    for codon, aa in zip(CODONS, codon_aa):
+        aa_codons.setdefault(aa, []).append(codon)
     
     # 显示每个氨基酸的密码子使用
     for aa in sorted(aa_codons.keys())[:10]:  # 只显示前10个
         print(f"{aa}: ", end="")
         for codon in aa_codons[aa]:
-            count = codon_count.get(codon, 0)
+            count = codon_count[codon]
             if count > 0:
-                print(f"{codon}({count}) ", end="")
+                print(f"{codon}({count}/{codon_rscu[codon]:.2f}) ", end="")
         print()
     
-    # 计算CAI (Codon Adaptation Index) - 简化版
-    total_codons = sum(codon_count.values())
+    total_codons = int(counts.sum())
     print(f"\n密码子总数: {total_codons}")
-    print(f"不同密码子数: {len(codon_count)}")
+    print(f"不同密码子数: {int((counts > 0).sum())}")
+    
+    # CAI需要一个参考基因集（通常是高表达基因），这里用几条示例CDS代替
+    reference_set = [
+        "ATGGCTGCTAAAGAAGGTGCTCGTAAAGCTGAAGAAGCTCTGAAAGGTTAA",
+        "ATGAAAGCTGGTGAAGCTCGTCTGGCTAAAGAAGGTTCTAAAGCTGAATAA",
+        "ATGTCTGAAGCTAAAGGTCGTGCTGAAAAAGCTGGTCTGTCTGAAGCTTAA",
+    ]
+    weights = relative_adaptiveness(codon_counts(reference_set)[1])
+    print(f"CAI（相对示例参考集）: {cai(counts[0], weights):.3f}")
+    print(f"有效密码子数 ENC: {effective_number_of_codons(counts[0]):.1f}")
+    print("（ENC越接近20偏好越强；序列太短时某些简并类缺失，ENC为nan）")
 
 
 def demonstrate_genome_statistics():
@@ -565,16 +542,17 @@ def demonstrate_genome_statistics():
     # 二核苷酸频率
     print("\n二核苷酸频率 (前5个):")
     print("-" * 40)
-    dinuc_count = {}
+    # 二核苷酸频谱：16个计数一次得到
+    dinuc_spectrum = kmer_spectrum(genome_fragment, 2)
+    total_dinuc = dinuc_spectrum.sum()
     seq_str = str(genome_fragment)
-    for i in range(len(seq_str) - 1):
-        dinuc = seq_str[i:i+2]
-        dinuc_count[dinuc] = dinuc_count.get(dinuc, 0) + 1
-    
-    # 排序并显示前5个
-    sorted_dinuc = sorted(dinuc_count.items(), key=lambda x: x[1], reverse=True)
-    for dinuc, count in sorted_dinuc[:5]:
-        freq = count / (len(genome_fragment) - 1) * 100
+    
+    # 排序并显示前5个（直接用上面的频谱；sorted是稳定排序，次数相同时按字母顺序）
+    sorted_dinuc = sorted(((decode_kmer(code, 2), int(count))
+                           for code, count in enumerate(dinuc_spectrum) if count),
+                          key=lambda item: -item[1])[:5]
+    for dinuc, count in sorted_dinuc:
+        freq = count / total_dinuc * 100
         print(f"{dinuc}: {count:3d} ({freq:5.1f}%)")
     
     # CpG岛检测（简化版）
@@ -588,6 +566,25 @@ def demonstrate_genome_statistics():
     print(f"观察/期望比: {obs_exp_ratio:.2f}")
     if obs_exp_ratio > 0.6 and gc_content > 50:
         print("可能存在CpG岛")
+    
+    # 整段只有一个比值，不知道岛在哪里；逐窗口扫描可以给出CpG岛的具体位置
+    flank = "ATGCATTATAGCTTAAATGCAT" * 15
+    test_region = Seq(flank + "GCGCCGGACGCGTCCGCAGC" * 20 + flank)
+    islands = find_cpg_islands(test_region, criteria='gardiner-garden')
+    print(f"\nCpG岛扫描 (Gardiner-Garden标准, 测试序列 {len(test_region)} bp):")
+    for island in islands:
+        print(f"  {island['start']}-{island['end']} ({island['length']} bp) "
+              f"GC={island['gc']:.1f}% O/E={island['obs_exp']:.2f} CpG数={island['cpg']}")
+    
+    # 滑动窗口：所有窗口的统计量由边界处的累积和一次算出
+    print("\n滑动窗口统计 (窗口100bp, 步长50bp, 前5个):")
+    print("-" * 40)
+    profile = window_profile(genome_fragment, window=100, step=50)
+    print(f"{'区间':>12} {'GC%':>6} {'GC偏斜':>7} {'CpG O/E':>8}")
+    for i in range(min(5, len(profile['start']))):
+        interval = f"{profile['start'][i]}-{profile['end'][i]}"
+        print(f"{interval:>12} {profile['gc'][i]:6.1f} {profile['gc_skew'][i]:7.3f} "
+              f"{profile['cpg_oe'][i]:8.2f}")
 
 
 def demonstrate_complete_workflow():
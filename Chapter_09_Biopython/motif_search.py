@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chapter 09 工具模块：多模式IUPAC模体搜索（Aho-Corasick自动机）
+
+逐个模体调用 str.find 时，搜索1000个模体就要把序列扫描1000遍。
+Aho-Corasick自动机把所有模体（包括它们的反向互补）合并成一棵前缀树，
+再加上"失败链接"，整条序列只需要扫描一遍，每个碱基只做一次查表。
+
+简并碱基（如 R = A/G）会先展开成所有具体序列再放进自动机。
+流式搜索时，只要把自动机的当前状态带到下一个数据块，
+跨越块边界的模体也能被找到，不需要额外保存重叠区域。
+"""
+
+from collections import deque
+from itertools import product
+
+
+# IUPAC核苷酸简并代码
+IUPAC_CODES = {
+    'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T',
+    'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+    'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG', 'N': 'ACGT',
+}
+
+# IUPAC代码的互补
+IUPAC_COMPLEMENT = str.maketrans('ACGTRYSWKMBDHVN', 'TGCAYRSWMKVHDBN')
+
+
+def expand_iupac(motif):
+    """把含简并碱基的模体展开成所有具体序列，例如 GCCRCC → [GCCACC, GCCGCC]"""
+    options = [IUPAC_CODES[base] for base in motif.upper()]
+    return [''.join(bases) for bases in product(*options)]
+
+
+def reverse_complement_iupac(motif):
+    """IUPAC模体的反向互补"""
+    return motif.upper().translate(IUPAC_COMPLEMENT)[::-1]
+
+
+class MotifMatcher:
+    """
+    编译好的多模体匹配器
+
+    用法：
+        matcher = MotifMatcher({"TATA box": "TATAA", "Kozak": "GCCRCC"})
+        hits = matcher.search(sequence)
+
+    每个命中是一个字典：
+        {'name': 模体名, 'motif': 模体, 'position': 起点, 'end': 终点,
+         'strand': '+'/'-', 'match': 实际匹配的序列（正链）}
+    坐标是正链上的0-based左闭右开区间。
+    """
+
+    def __init__(self, motifs, both_strands=True):
+        """
+        参数：
+            motifs: {模体名: IUPAC模体}
+            both_strands: 是否同时搜索反向互补链
+        """
+        self.motifs = dict(motifs)
+        # 自动机结构：goto[state] 是 {字节: 下一状态}，output[state] 是命中列表
+        self._goto = [{}]
+        self._output = [[]]
+
+        for name, motif in self.motifs.items():
+            forward = set(expand_iupac(motif))
+            for word in forward:
+                self._add_word(word, (name, motif, '+', len(word)))
+
+            if both_strands:
+                reverse = set(expand_iupac(reverse_complement_iupac(motif)))
+                # 回文模体（如限制性位点）两条链完全相同，只报告一次
+                if reverse != forward:
+                    for word in reverse:
+                        self._add_word(word, (name, motif, '-', len(word)))
+
+        self._build()
+
+    def _add_word(self, word, label):
+        """把一个具体序列加入前缀树"""
+        state = 0
+        for byte in word.encode('ascii'):
+            next_state = self._goto[state].get(byte)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][byte] = next_state
+                self._goto.append({})
+                self._output.append([])
+            state = next_state
+        self._output[state].append(label)
+
+    def _build(self):
+        """
+        广度优先计算失败链接，并展开成稠密的状态转移表
+
+        展开后每个状态对每个字节都有确定的下一状态，
+        扫描时每个碱基只需一次列表索引。非ACGT字节（如N）回到根状态。
+        """
+        n_states = len(self._goto)
+        fail = [0] * n_states
+        delta = [None] * n_states
+
+        root_row = [0] * 256
+        for byte, child in self._goto[0].items():
+            root_row[byte] = child
+        # 小写碱基与大写等价
+        for base in b'ACGT':
+            root_row[base + 32] = root_row[base]
+        delta[0] = root_row
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            row = list(delta[fail[state]])
+            for byte, child in self._goto[state].items():
+                fail[child] = delta[fail[state]][byte]
+                # 通过失败链接继承更短模体的命中
+                self._output[child] = self._output[child] + self._output[fail[child]]
+                row[byte] = child
+                row[byte + 32] = child
+                queue.append(child)
+            delta[state] = row
+
+        self._delta = delta
+        self.n_states = n_states
+
+    def _scan(self, data, offset, state, hits):
+        """扫描一段bytes，返回扫描结束时的自动机状态"""
+        delta = self._delta
+        output = self._output
+        for i, byte in enumerate(data):
+            state = delta[state][byte]
+            if output[state]:
+                end = offset + i + 1
+                for name, motif, strand, length in output[state]:
+                    hits.append((name, motif, strand, end - length, end))
+        return state
+
+    def search(self, sequence):
+        """在一条序列中搜索所有模体（两条链），按位置排序返回"""
+        data = str(sequence).encode('ascii')
+        hits = []
+        self._scan(data, 0, 0, hits)
+        return self._format_hits(hits, data)
+
+    def search_chunks(self, chunks):
+        """
+        流式搜索：依次处理一个个数据块（bytes或str），边扫描边产出命中
+
+        自动机状态在块之间延续，所以跨越块边界的模体同样会被找到；
+        'match' 字段在流式模式下不提供（数据块用完即丢弃）。
+        """
+        state = 0
+        offset = 0
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('ascii')
+            hits = []
+            state = self._scan(chunk, offset, state, hits)
+            offset += len(chunk)
+            for hit in self._format_hits(hits):
+                yield hit
+
+    def search_fasta(self, filename, chunk_size=1 << 20):
+        """
+        对FASTA文件中的每条序列流式搜索，产出 (序列ID, 命中)
+
+        每次只读取 chunk_size 字节，适合染色体级别的输入
+        """
+        for seq_id, chunks in iter_fasta_chunks(filename, chunk_size):
+            for hit in self.search_chunks(chunks):
+                yield seq_id, hit
+
+    @staticmethod
+    def _format_hits(hits, data=None):
+        """把内部的元组转换成字典并排序"""
+        hits.sort(key=lambda hit: (hit[3], hit[0], hit[2]))
+        formatted = []
+        for name, motif, strand, start, end in hits:
+            hit = {
+                'name': name,
+                'motif': motif,
+                'position': start,
+                'end': end,
+                'strand': strand,
+            }
+            if data is not None:
+                hit['match'] = data[start:end].decode('ascii')
+            formatted.append(hit)
+        return formatted
+
+
+def iter_fasta_chunks(filename, chunk_size=1 << 20):
+    """
+    逐条序列产出 (序列ID, 数据块生成器)，序列中的换行已去除
+
+    同一条序列的数据块必须在读取下一条序列之前用完
+    """
+    with open(filename, 'rb') as f:
+        pending = b''
+
+        def sequence_chunks():
+            nonlocal pending
+            while True:
+                block = pending or f.read(chunk_size)
+                pending = b''
+                if not block:
+                    return
+                header_start = block.find(b'>')
+                if header_start == -1:
+                    yield block.translate(None, b' \t\r\n')
+                    continue
+                if header_start > 0:
+                    yield block[:header_start].translate(None, b' \t\r\n')
+                pending = block[header_start:]
+                return
+
+        while True:
+            block = pending or f.read(chunk_size)
+            pending = b''
+            if not block:
+                return
+            header_start = block.find(b'>')
+            if header_start == -1:
+                continue  # 第一条序列之前的内容忽略
+            # 读完整个标题行（可能跨块）
+            block = block[header_start + 1:]
+            while b'\n' not in block:
+                more = f.read(chunk_size)
+                if not more:
+                    break
+                block += more
+            header, _, pending = block.partition(b'\n')
+            seq_id = header.decode('utf-8').split()[0] if header.strip() else ''
+            chunks = sequence_chunks()
+            yield seq_id, chunks
+            # 调用方没有读完的数据块在这里跳过
+            for _ in chunks:
+                pass
+
+
+def benchmark_motif_search(sequence_length=1_000_000, n_motifs=1000, seed=7):
+    """
+    性能对比：1个模体 vs n_motifs 个模体
+
+    扫描本身每个碱基只查一次表，与模体数量无关；
+    模体多时多出来的时间主要用于整理数量更多的命中结果。
+    """
+    import random
+    import time
+
+    rng = random.Random(seed)
+    sequence = ''.join(rng.choices('ACGT', k=sequence_length))
+    motif_sets = {
+        1: {"motif_0": "GCCRCC"},
+        n_motifs: {f"motif_{i}": ''.join(rng.choices('ACGTRY', k=8))
+                   for i in range(n_motifs)},
+    }
+
+    print(f"\n⏱️ 多模体搜索性能（序列 {sequence_length:,} bp）")
+    timings = {}
+    for count, motifs in motif_sets.items():
+        matcher = MotifMatcher(motifs)
+        start_time = time.perf_counter()
+        hits = matcher.search(sequence)
+        timings[count] = time.perf_counter() - start_time
+        print(f"   {count:5d} 个模体: {timings[count]:.3f}秒，"
+              f"{matcher.n_states:,} 个状态，{len(hits):,} 个命中")
+    return timings
+
+
+if __name__ == "__main__":
+    benchmark_motif_search()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chapter 09 工具模块：向量化六框ORF查找
+
+main.py 和 practice_solution.py 中的ORF查找都基于这个模块。
+
+思路：
+- 把序列一次性编码成uint8数组（A=0, C=1, G=2, T=3, 其他=4）
+- 用数组运算算出每个位置的密码子编号（0-63），一次找出所有起始/终止密码子
+- 在每个阅读框内用 np.searchsorted 为每个起始密码子找到下一个同框终止密码子
+
+这样整个基因组只需要扫描几遍数组，而不是对每个ATG再循环一次。
+"""
+
+import time
+
+import numpy as np
+from Bio.Data import CodonTable
+from Bio.Seq import Seq
+
+from translation import get_translator
+
+
+# 碱基 → 数字的查找表，非ACGT（如N）编码为4
+_BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate('ACGT'):
+    _BASE_CODES[ord(_base)] = _code
+    _BASE_CODES[ord(_base.lower())] = _code
+
+# 互补碱基：A<->T, C<->G, 4保持不变
+_COMPLEMENT_CODES = np.array([3, 2, 1, 0, 4], dtype=np.uint8)
+
+# 含非ACGT碱基的密码子使用的编号
+INVALID_CODON = 64
+
+
+def encode_sequence(sequence):
+    """把DNA序列（str/Seq/bytes）编码成uint8数组"""
+    if isinstance(sequence, (bytes, bytearray)):
+        raw = bytes(sequence)
+    else:
+        raw = str(sequence).encode('ascii')
+    return _BASE_CODES[np.frombuffer(raw, dtype=np.uint8)]
+
+
+def codon_index(codon):
+    """密码子字符串 → 0-63的编号（与 codon_indices 使用相同的编码）"""
+    codes = encode_sequence(codon)
+    return int(codes[0]) * 16 + int(codes[1]) * 4 + int(codes[2])
+
+
+def codon_indices(codes):
+    """
+    计算每个位置开始的密码子编号
+
+    返回长度为 len(codes) - 2 的数组，第i个元素是 codes[i:i+3] 的编号；
+    含N等非标准碱基的密码子编号为 INVALID_CODON
+    """
+    if len(codes) < 3:
+        return np.empty(0, dtype=np.int16)
+    first, second, third = codes[:-2], codes[1:-1], codes[2:]
+    indices = first.astype(np.int16) * 16 + second * 4 + third
+    invalid = (first > 3) | (second > 3) | (third > 3)
+    indices[invalid] = INVALID_CODON
+    return indices
+
+
+def _orfs_on_strand(codes, start_ids, stop_ids, min_length, longest_per_stop):
+    """
+    在一条链的三个阅读框中查找ORF
+
+    返回按(阅读框, 起点)排序的 (frame, start, end) 数组
+    """
+    indices = codon_indices(codes)
+    start_positions = np.flatnonzero(np.isin(indices, start_ids))
+    stop_positions = np.flatnonzero(np.isin(indices, stop_ids))
+
+    results = []
+    for frame in range(3):
+        frame_starts = start_positions[start_positions % 3 == frame]
+        frame_stops = stop_positions[stop_positions % 3 == frame]
+        if len(frame_starts) == 0 or len(frame_stops) == 0:
+            continue
+
+        # 每个起始密码子之后的第一个同框终止密码子
+        stop_rank = np.searchsorted(frame_stops, frame_starts)
+        has_stop = stop_rank < len(frame_stops)
+        frame_starts = frame_starts[has_stop]
+        stop_rank = stop_rank[has_stop]
+
+        if longest_per_stop and len(stop_rank) > 0:
+            # 共享同一个终止密码子的ORF只保留最上游（最长）的那个
+            first_for_stop = np.r_[True, stop_rank[1:] != stop_rank[:-1]]
+            frame_starts = frame_starts[first_for_stop]
+            stop_rank = stop_rank[first_for_stop]
+
+        frame_ends = frame_stops[stop_rank] + 3
+        long_enough = frame_ends - frame_starts >= min_length
+        frame_starts = frame_starts[long_enough]
+        frame_ends = frame_ends[long_enough]
+
+        results.append(np.column_stack([
+            np.full(len(frame_starts), frame), frame_starts, frame_ends
+        ]))
+
+    if not results:
+        return np.empty((0, 3), dtype=np.int64)
+    return np.vstack(results)
+
+
+def find_orfs_vectorized(sequence, min_length=6, strands="+-", table=1,
+                         start_codons=("ATG",), longest_per_stop=False,
+                         with_sequences=True):
+    """
+    六框ORF查找（向量化实现）
+
+    参数：
+        sequence: DNA序列（str或Seq）
+        min_length: ORF最短长度（bp，包含终止密码子）
+        strands: "+-" 两条链，"+" 只查正链，"-" 只查反向互补链
+        table: NCBI遗传密码表编号，决定终止密码子
+        start_codons: 起始密码子
+        longest_per_stop: 为True时每个终止密码子只保留最长的ORF
+        with_sequences: 为False时不生成 'sequence' / 'protein'，
+                        适合只需要坐标的全基因组扫描
+
+    返回：ORF字典列表，字段与原来的find_orfs一致：
+        'frame', 'start', 'end', 'length', 'sequence', 'protein'，
+        另外加上 'strand'。坐标都是正链上的0-based左闭右开区间，
+        'frame' 是在各自链上的阅读框。
+    """
+    seq = sequence if isinstance(sequence, Seq) else Seq(str(sequence))
+    seq_len = len(seq)
+    codes = encode_sequence(seq)
+
+    stop_codons = CodonTable.unambiguous_dna_by_id[table].stop_codons
+    start_ids = [codon_index(codon) for codon in start_codons]
+    stop_ids = [codon_index(codon) for codon in stop_codons]
+
+    orfs = []
+    for strand in strands:
+        if strand == "+":
+            strand_codes = codes
+            strand_seq = seq
+        else:
+            strand_codes = _COMPLEMENT_CODES[codes][::-1]
+            strand_seq = seq.reverse_complement() if with_sequences else None
+
+        hits = _orfs_on_strand(strand_codes, start_ids, stop_ids,
+                               min_length, longest_per_stop)
+        if with_sequences:
+            # 这条链上所有ORF一次查表翻译
+            proteins = get_translator(table).translate_regions(
+                str(strand_seq), hits[:, 1], hits[:, 2])
+
+        for k, (frame, start, end) in enumerate(hits.tolist()):
+            orf = {
+                'strand': strand,
+                'frame': frame,
+                # 反向链的坐标换算回正链
+                'start': start if strand == "+" else seq_len - end,
+                'end': end if strand == "+" else seq_len - start,
+                'length': end - start,
+            }
+            if with_sequences:
+                orf_seq = strand_seq[start:end]
+                orf['sequence'] = orf_seq
+                orf['protein'] = Seq(proteins[k])
+            orfs.append(orf)
+
+    return orfs
+
+
+def find_orfs_nested_loop(sequence, min_length=6):
+    """原来的嵌套循环实现（只查正链），保留下来用于对比测试"""
+    orfs = []
+    seq_len = len(sequence)
+    for frame in range(3):
+        for i in range(frame, seq_len - 2, 3):
+            if str(sequence[i:i+3]) == 'ATG':
+                for j in range(i + 3, seq_len - 2, 3):
+                    if str(sequence[j:j+3]) in ['TAA', 'TAG', 'TGA']:
+                        if j + 3 - i >= min_length:
+                            orfs.append({'frame': frame, 'start': i, 'end': j + 3})
+                        break
+    return orfs
+
+
+def benchmark_orf_finder(genome_length=5_000_000, legacy_length=20_000, seed=42):
+    """
+    性能对比：在随机序列上比较嵌套循环和向量化实现
+
+    嵌套循环在5 Mb上要运行很久，所以只在前 legacy_length bp 上计时，
+    再按长度线性换算（实际复杂度更高，换算结果偏乐观）。
+    """
+    print(f"\n⏱️ ORF查找性能对比（随机序列 {genome_length:,} bp）")
+    rng = np.random.default_rng(seed)
+    genome = ''.join(np.array(list('ACGT'))[rng.integers(0, 4, genome_length)])
+
+    # 两种实现结果必须一致
+    sample = Seq(genome[:legacy_length])
+    start_time = time.perf_counter()
+    legacy = find_orfs_nested_loop(sample, min_length=90)
+    legacy_time = time.perf_counter() - start_time
+    fast = find_orfs_vectorized(sample, min_length=90, strands="+",
+                                with_sequences=False)
+    same = [(o['frame'], o['start'], o['end']) for o in legacy] == \
+           [(o['frame'], o['start'], o['end']) for o in fast]
+    print(f"   结果一致性检查（{legacy_length:,} bp）: {'✓' if same else '✗'}")
+
+    start_time = time.perf_counter()
+    orfs = find_orfs_vectorized(genome, min_length=90, with_sequences=False)
+    fast_time = time.perf_counter() - start_time
+
+    estimated_legacy = legacy_time * genome_length / legacy_length
+    print(f"   嵌套循环（单链）: {legacy_time:.3f}秒 / {legacy_length:,} bp，"
+          f"换算到全长约 {estimated_legacy:.1f}秒")
+    print(f"   向量化（六框）:   {fast_time:.3f}秒，找到 {len(orfs):,} 个ORF (≥90 bp)")
+    return {'legacy_estimate': estimated_legacy, 'vectorized': fast_time}
+
+
+if __name__ == "__main__":
+    benchmark_orf_finder()
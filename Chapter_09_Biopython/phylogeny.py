@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chapter 09 工具模块：距离矩阵与UPGMA/邻接法建树
+
+原来的练习9对每一对物种用Python生成器逐位比较（每对还算了两遍），
+"UPGMA"只是找出最近的一对，然后打印一棵写死的树。这里：
+
+1. 把比对编码成 (序列数 × 长度) 的uint8矩阵（A=0, C=1, G=2, T=3, 其他=4）
+2. 把每种碱基写成0/1矩阵，所有序列对的相同碱基数、转换数、有效位点数
+   都变成矩阵乘法（BLAS），按位点分块累加，内存只与 序列数² 有关
+3. 由计数得到 p-distance、Jukes-Cantor (JC69) 或 Kimura双参数 (K2P) 距离
+4. UPGMA：scipy 的 average linkage（最近邻链算法，O(n²)）
+   邻接法（NJ）：在原地收缩的距离矩阵上迭代，Q矩阵用float32分块计算，
+   并按每行的下界跳过不可能包含最优对的行
+5. 两种树都输出Newick字符串，可以直接交给 Bio.Phylo 读取和绘制
+
+5000条序列时距离矩阵本身约200 MB；建树时的额外内存也都是 O(n²)
+（UPGMA的压缩距离向量、邻接法的工作矩阵及其float32副本）。
+"""
+
+import time
+
+import numpy as np
+from scipy.cluster.hierarchy import linkage
+from scipy.spatial.distance import squareform
+
+from orf_finder import encode_sequence
+
+
+DISTANCE_MODELS = ('p', 'jc69', 'k2p')
+
+# 每次参与矩阵乘法的位点数
+BLOCK_SITES = 2048
+
+# 邻接法求Q矩阵最小值时每次处理的行数
+NJ_BLOCK_ROWS = 32
+
+
+def encode_alignment(sequences):
+    """
+    把等长序列（str/Seq/SeqRecord，或 MultipleSeqAlignment）编码成uint8矩阵
+
+    返回形状为 (序列数, 比对长度) 的数组；空位和N等编码为4
+    """
+    texts = [str(getattr(seq, 'seq', seq)).upper() for seq in sequences]
+    if not texts:
+        return np.empty((0, 0), dtype=np.uint8)
+    length = len(texts[0])
+    if any(len(text) != length for text in texts):
+        raise ValueError("比对中的序列长度必须相同")
+    return encode_sequence(''.join(texts)).reshape(len(texts), length)
+
+
+def _site_counts(codes, need_transitions, block_sites=BLOCK_SITES):
+    """
+    对所有序列对统计：有效位点数、相同碱基数，以及（可选）同类碱基数
+
+    "同类"指同为嘌呤(A/G)或同为嘧啶(C/T)；同类但不相同的位点就是转换。
+    每个位点块内用0/1矩阵相乘，计数在float32里是精确的（不超过2^24个位点）。
+    """
+    n_seqs, length = codes.shape
+    valid = np.zeros((n_seqs, n_seqs), dtype=np.float32)
+    matches = np.zeros((n_seqs, n_seqs), dtype=np.float32)
+    same_class = np.zeros((n_seqs, n_seqs), dtype=np.float32) if need_transitions else None
+
+    for start in range(0, length, block_sites):
+        block = codes[:, start:start + block_sites]
+        one_hot = np.concatenate([block == base for base in range(4)], axis=1).astype(np.float32)
+        matches += one_hot @ one_hot.T
+        is_valid = (block < 4).astype(np.float32)
+        valid += is_valid @ is_valid.T
+        if need_transitions:
+            # 编码中 A=0, G=2 是嘌呤，C=1, T=3 是嘧啶
+            classes = np.concatenate([(block == 0) | (block == 2),
+                                      (block == 1) | (block == 3)], axis=1).astype(np.float32)
+            same_class += classes @ classes.T
+
+    return valid, matches, same_class
+
+
+def distance_matrix(alignment, model='k2p', block_sites=BLOCK_SITES):
+    """
+    计算所有序列对之间的进化距离
+
+    参数：
+        alignment: encode_alignment 得到的矩阵，或等长序列的列表
+        model: 'p'（不同位点比例）、'jc69'（Jukes-Cantor）或 'k2p'（Kimura双参数）
+
+    只统计两条序列都是ACGT的位点（成对删除空位）。
+    距离饱和（对数的参数≤0）时返回inf，没有共同有效位点时返回nan。
+    返回 n×n 的float64对称矩阵。
+    """
+    if model not in DISTANCE_MODELS:
+        raise ValueError(f"未知的距离模型: {model}（可选 {', '.join(DISTANCE_MODELS)}）")
+    codes = alignment if isinstance(alignment, np.ndarray) else encode_alignment(alignment)
+
+    valid, matches, same_class = _site_counts(codes, model == 'k2p', block_sites)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        valid = valid.astype(np.float64)
+        p = (valid - matches) / valid
+        if model == 'p':
+            distances = p
+        elif model == 'jc69':
+            distances = -0.75 * np.log(1 - 4 / 3 * p)
+        else:
+            transitions = (same_class - matches) / valid
+            transversions = (valid - same_class) / valid
+            distances = (-0.5 * np.log(1 - 2 * transitions - transversions)
+                         - 0.25 * np.log(1 - 2 * transversions))
+        # 对数参数≤0（饱和）时 log 给出nan或-inf，统一记为inf
+        distances[np.isnan(distances) & (valid > 0)] = np.inf
+        distances += 0.0  # 相同序列的 -log(1) 得到 -0.0，统一成 0.0
+
+    np.fill_diagonal(distances, 0.0)
+    return distances
+
+
+def _check_distances(distances, names):
+    """建树前检查距离矩阵"""
+    distances = np.asarray(distances, dtype=np.float64)
+    if distances.ndim != 2 or distances.shape[0] != distances.shape[1]:
+        raise ValueError("距离矩阵必须是方阵")
+    if len(names) != len(distances):
+        raise ValueError("名称数量与距离矩阵大小不一致")
+    if len(names) < 2:
+        raise ValueError("至少需要2条序列才能建树")
+    if not np.isfinite(distances).all():
+        raise ValueError("距离矩阵中有inf/nan（距离饱和或缺少共同位点），"
+                         "请换用p-distance或检查比对")
+    return distances
+
+
+def _newick_label(name):
+    """Newick中的名字：含特殊字符时加单引号"""
+    name = str(name)
+    if any(char in name for char in " ()[]':;,\t"):
+        return "'" + name.replace("'", "''") + "'"
+    return name
+
+
+def _to_newick(children, branch_lengths, names, root):
+    """
+    把 (子节点列表, 枝长) 表示的树写成Newick字符串
+
+    用显式栈代替递归，5000个物种的梯形树也不会超过递归深度限制
+    """
+    parts = []
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+            continue
+        suffix = '' if item == root else f":{branch_lengths[item]:.6f}"
+        kids = children[item]
+        if not kids:
+            parts.append(_newick_label(names[item]) + suffix)
+            continue
+        parts.append('(')
+        stack.append(')' + suffix)
+        for position, kid in enumerate(reversed(kids)):
+            if position:
+                stack.append(',')
+            stack.append(kid)
+    return ''.join(parts) + ';'
+
+
+def upgma_tree(distances, names):
+    """
+    UPGMA建树（有根、超度量），返回Newick字符串
+
+    使用 scipy 的 average linkage：合并距离为 d 的两个簇时，
+    新节点的高度是 d/2，枝长是父子节点的高度差。
+    """
+    distances = _check_distances(distances, names)
+    n_taxa = len(names)
+    merges = linkage(squareform(distances, checks=False), method='average')
+
+    heights = np.zeros(2 * n_taxa - 1)
+    branch_lengths = np.zeros(2 * n_taxa - 1)
+    children = [[] for _ in range(2 * n_taxa - 1)]
+    for step, (left, right, distance, _) in enumerate(merges):
+        node = n_taxa + step
+        heights[node] = distance / 2
+        for child in (int(left), int(right)):
+            children[node].append(child)
+            branch_lengths[child] = heights[node] - heights[child]
+
+    return _to_newick(children, branch_lengths, names, 2 * n_taxa - 2)
+
+
+def _nj_closest_pair(distances, scaled_sums, row_min, size):
+    """
+    在当前 size×size 的子矩阵上找Q值最小的一对 (i, j)，i < j
+
+    Q(i, j) = (size-2)·d(i, j) - r(i) - r(j)，等价于比较
+    d(i, j) - s(i) - s(j)，其中 s = r/(size-2)（scaled_sums）。
+    row_min[i] 是第i行距离最小值的下界，于是第i行的Q不会小于
+    row_min[i] - s(i) - max(s)。按这个下界从小到大分块计算，
+    下界已经不小于当前最优值时剩下的行都可以跳过。
+    distances 是float32副本：选择合并对只需要比较大小，读一半的内存。
+    """
+    s = scaled_sums[:size]
+    s32 = s.astype(np.float32)
+    bounds = row_min[:size] - s - s.max()
+    order = np.argsort(bounds)
+
+    best_value = np.inf
+    best_pair = (0, 1)
+    for start in range(0, size, NJ_BLOCK_ROWS):
+        rows = order[start:start + NJ_BLOCK_ROWS]
+        if bounds[rows[0]] >= best_value:
+            break
+        q = distances[rows, :size]
+        q -= s32[rows, None]
+        q -= s32[None, :]
+        q[np.arange(len(rows)), rows] = np.inf
+        row, column = divmod(int(q.argmin()), size)
+        if q[row, column] < best_value:
+            best_value = q[row, column]
+            best_pair = (int(rows[row]), column)
+    i, j = best_pair
+    return (i, j) if i < j else (j, i)
+
+
+def neighbor_joining_tree(distances, names):
+    """
+    邻接法建树，返回Newick字符串（无根树，写成根处三分叉的形式）
+
+    距离矩阵原地收缩：合并i、j后新节点放在第i行/列，
+    最后一行/列搬到第j行/列，始终只用左上角的 size×size 区域。
+    每一步的代价是 O(size²)。枝长和距离更新用float64矩阵，
+    寻找合并对用它的float32副本，内存约为 12·n² 字节。
+    负枝长按 Bio.Phylo 的做法截为0。
+    """
+    distances = _check_distances(distances, names).copy()
+    n_taxa = len(names)
+    if n_taxa == 2:
+        half = distances[0, 1] / 2
+        return (f"({_newick_label(names[0])}:{half:.6f},"
+                f"{_newick_label(names[1])}:{half:.6f});")
+
+    n_nodes = 2 * n_taxa - 2
+    children = [[] for _ in range(n_nodes)]
+    branch_lengths = np.zeros(n_nodes)
+    slot_nodes = np.arange(n_taxa)  # 矩阵第k行对应的树节点
+    row_sums = distances.sum(axis=1)
+    search_distances = distances.astype(np.float32)
+    # 每行（除对角线外）距离最小值的下界：删掉列时保持不变，新增列时取较小值
+    row_min = np.where(np.eye(n_taxa, dtype=bool), np.inf, distances).min(axis=1)
+    next_node = n_taxa
+    size = n_taxa
+
+    while size > 3:
+        i, j = _nj_closest_pair(search_distances, row_sums / (size - 2), row_min, size)
+        d_ij = distances[i, j]
+        delta = (row_sums[i] - row_sums[j]) / (size - 2)
+        length_i = max(0.5 * (d_ij + delta), 0.0)
+        length_j = max(d_ij - 0.5 * (d_ij + delta), 0.0)
+
+        node = next_node
+        next_node += 1
+        children[node] = [int(slot_nodes[i]), int(slot_nodes[j])]
+        branch_lengths[slot_nodes[i]] = length_i
+        branch_lengths[slot_nodes[j]] = length_j
+
+        # 新节点到其他节点的距离，以及所有行和的增量更新
+        new_row = 0.5 * (distances[i, :size] + distances[j, :size] - d_ij)
+        new_row[i] = new_row[j] = 0.0
+        row_sums[:size] += new_row - distances[i, :size] - distances[j, :size]
+        distances[i, :size] = new_row
+        distances[:size, i] = new_row
+        search_distances[i, :size] = new_row
+        search_distances[:size, i] = new_row
+        row_sums[i] = new_row.sum()
+        slot_nodes[i] = node
+        others = np.ones(size, dtype=bool)
+        others[[i, j]] = False
+        np.minimum(row_min[:size], np.where(others, new_row, np.inf), out=row_min[:size])
+        row_min[i] = new_row[others].min()
+
+        # 把最后一行/列搬到第j行/列，收缩矩阵
+        last = size - 1
+        if j != last:
+            distances[j, :last] = distances[last, :last]
+            distances[:last, j] = distances[:last, last]
+            distances[j, j] = 0.0
+            search_distances[j, :last] = search_distances[last, :last]
+            search_distances[:last, j] = search_distances[:last, last]
+            search_distances[j, j] = 0.0
+            row_sums[j] = row_sums[last]
+            row_min[j] = row_min[last]
+            slot_nodes[j] = slot_nodes[last]
+        size -= 1
+
+    # 剩下三个节点连到同一个根上
+    a, b, c = (int(slot_nodes[k]) for k in range(3))
+    d_ab, d_ac, d_bc = distances[0, 1], distances[0, 2], distances[1, 2]
+    branch_lengths[a] = max(0.5 * (d_ab + d_ac - d_bc), 0.0)
+    branch_lengths[b] = max(0.5 * (d_ab + d_bc - d_ac), 0.0)
+    branch_lengths[c] = max(0.5 * (d_ac + d_bc - d_ab), 0.0)
+    root = next_node
+    children[root] = [a, b, c]
+
+    return _to_newick(children, branch_lengths, names, root)
+
+
+def _simulate_alignment(n_taxa, n_sites, rng, rate=0.02):
+    """模拟一组有亲缘关系的序列：每条新序列由随机一条已有序列突变而来"""
+    codes = np.empty((n_taxa, n_sites), dtype=np.uint8)
+    codes[0] = rng.integers(0, 4, n_sites)
+    for k in range(1, n_taxa):
+        parent = codes[rng.integers(0, k)]
+        mutated = rng.random(n_sites) < rate
+        codes[k] = np.where(mutated, rng.integers(0, 4, n_sites), parent)
+    return codes
+
+
+def benchmark_phylogeny(n_taxa=5000, n_sites=1000, seed=3):
+    """性能测试：n_taxa 条序列的K2P距离矩阵、UPGMA和邻接法建树"""
+    rng = np.random.default_rng(seed)
+    codes = _simulate_alignment(n_taxa, n_sites, rng)
+    names = [f"taxon_{k}" for k in range(n_taxa)]
+
+    print(f"\n⏱️ 建树性能（{n_taxa} 条序列 × {n_sites} 位点）")
+    timings = {}
+
+    start_time = time.perf_counter()
+    distances = distance_matrix(codes, model='k2p')
+    timings['distance'] = time.perf_counter() - start_time
+    print(f"   K2P距离矩阵: {timings['distance']:.2f}秒")
+
+    start_time = time.perf_counter()
+    upgma_tree(distances, names)
+    timings['upgma'] = time.perf_counter() - start_time
+    print(f"   UPGMA: {timings['upgma']:.2f}秒")
+
+    start_time = time.perf_counter()
+    neighbor_joining_tree(distances, names)
+    timings['nj'] = time.perf_counter() - start_time
+    print(f"   邻接法: {timings['nj']:.2f}秒")
+    return timings
+
+
+if __name__ == "__main__":
+    benchmark_phylogeny()
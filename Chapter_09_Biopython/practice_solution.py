@@ -8,13 +8,22 @@ Chapter 09: Biopython - 练习题参考答案
 
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
-from Bio import SeqIO
+from Bio import Phylo, SeqIO
 from Bio.SeqUtils import GC, molecular_weight
 from Bio.SeqUtils.ProtParam import ProteinAnalysis
 from Bio.SeqFeature import SeqFeature, FeatureLocation
 from Bio.Restriction import *
 import io
-import math
+import os
+import tempfile
+
+import numpy as np
+
+from orf_finder import find_orfs_vectorized
+from pairwise_alignment import align_pair, score_matrix
+from phylogeny import distance_matrix, encode_alignment, neighbor_joining_tree, upgma_tree
+from seed_search import BlastSearcher, SeedIndex
+from translation import get_translator
 
 
 def practice_1_basic_seq_solution():
@@ -53,12 +62,11 @@ def practice_1_basic_seq_solution():
     print(f"A碱基数: {dna_seq.count('A')}")
     print(f"起始密码子位置: {dna_seq.find('ATG')}")
     
-    # 六框翻译
+    # 六框翻译（查表翻译，末尾不足一个密码子的碱基自动忽略）
     print("\n六框翻译:")
-    for frame in range(3):
-        print(f"正向框{frame}: {dna_seq[frame:].translate()}")
-    for frame in range(3):
-        print(f"反向框{frame}: {rev_comp[frame:].translate()}")
+    for (strand, frame), protein in get_translator(1).six_frames(dna_seq).items():
+        label = "正向框" if strand == "+" else "反向框"
+        print(f"{label}{frame}: {protein}")
 
 
 def practice_2_file_parsing_solution():
@@ -253,33 +261,8 @@ def practice_3_orf_finding_solution():
     print(f"序列长度: {len(genomic_seq)} bp\n")
     
     def find_orfs(sequence, min_length=6):
-        """查找所有可能的ORF"""
-        orfs = []
-        seq_len = len(sequence)
-        
-        # 检查三个阅读框
-        for frame in range(3):
-            for i in range(frame, seq_len - 2, 3):
-                codon = sequence[i:i+3]
-                # 查找起始密码子
-                if str(codon) == 'ATG':
-                    # 查找终止密码子
-                    for j in range(i + 3, seq_len - 2, 3):
-                        stop_codon = sequence[j:j+3]
-                        if str(stop_codon) in ['TAA', 'TAG', 'TGA']:
-                            orf_seq = sequence[i:j+3]
-                            if len(orf_seq) >= min_length:
-                                protein = orf_seq.translate()
-                                orfs.append({
-                                    'frame': frame,
-                                    'start': i,
-                                    'end': j+3,
-                                    'length': len(orf_seq),
-                                    'sequence': orf_seq,
-                                    'protein': protein
-                                })
-                            break
-        return orfs
+        """查找正链三个阅读框中所有可能的ORF（向量化实现，见 orf_finder.py）"""
+        return find_orfs_vectorized(sequence, min_length=min_length, strands="+")
     
     # 查找ORF
     orfs = find_orfs(genomic_seq)
@@ -454,35 +437,35 @@ def practice_6_sequence_alignment_solution():
         print(f"Seq{i}: {seq}")
     
     def simple_alignment(seq1, seq2):
-        """计算两条序列的相似度"""
-        matches = 0
-        for i in range(min(len(seq1), len(seq2))):
-            if seq1[i] == seq2[i]:
-                matches += 1
-        similarity = matches / max(len(seq1), len(seq2)) * 100
-        return similarity, matches
-    
-    # 计算所有序列对的相似度
+        """计算两条序列的相似度（全局比对，允许插入/缺失）"""
+        result = align_pair(seq1, seq2, mode='global')
+        return result['identity'], result['matches']
+    
+    # 计算所有序列对的相似度（一次批量计算整个矩阵）
     print("\n成对序列相似度矩阵:")
     print("     ", end="")
     for i in range(len(sequences)):
         print(f"Seq{i+1:1d}  ", end="")
     print()
     
+    _, identity = score_matrix(sequences, mode='global')
     similarity_matrix = []
     for i in range(len(sequences)):
         print(f"Seq{i+1:1d} ", end="")
         row = []
         for j in range(len(sequences)):
-            if i == j:
-                sim = 100.0
-            else:
-                sim, _ = simple_alignment(sequences[i], sequences[j])
+            sim = 100.0 if i == j else identity[i, j]
             row.append(sim)
             print(f"{sim:5.1f} ", end="")
         similarity_matrix.append(row)
         print()
     
+    # 用比对结果展示差异最大的一对序列
+    i, j = divmod(int(np.argmin(identity)), len(sequences))
+    sim, matches = simple_alignment(sequences[i], sequences[j])
+    print(f"\n差异最大的序列对: Seq{i+1} vs Seq{j+1}（{matches} 个相同碱基，{sim:.1f}%）")
+    print(align_pair(sequences[i], sequences[j])['alignment'])
+    
     # 识别保守位点
     print("\n保守位点分析:")
     conserved_positions = []
@@ -526,25 +509,8 @@ def practice_7_genome_annotation_solution():
     print(f"基因组片段长度: {len(genome_fragment)} bp\n")
     
     def find_all_orfs(sequence, min_length=9):
-        """查找所有ORF"""
-        orfs = []
-        for strand, seq in [("+", sequence), ("-", sequence.reverse_complement())]:
-            for frame in range(3):
-                for i in range(frame, len(seq) - 2, 3):
-                    if str(seq[i:i+3]) == 'ATG':
-                        for j in range(i + 3, len(seq) - 2, 3):
-                            if str(seq[j:j+3]) in ['TAA', 'TAG', 'TGA']:
-                                if j + 3 - i >= min_length:
-                                    orfs.append({
-                                        'strand': strand,
-                                        'frame': frame,
-                                        'start': i if strand == "+" else len(sequence) - j - 3,
-                                        'end': j + 3 if strand == "+" else len(sequence) - i,
-                                        'sequence': seq[i:j+3],
-                                        'protein': seq[i:j+3].translate()
-                                    })
-                                break
-        return orfs
+        """查找两条链六个阅读框中的所有ORF"""
+        return find_orfs_vectorized(sequence, min_length=min_length)
     
     # Step 1 - 查找所有ORF
     orfs = find_all_orfs(genome_fragment)
@@ -634,44 +600,33 @@ def practice_8_blast_search_solution():
     print(f"数据库大小: {len(database)} 条序列\n")
     
     def blast_search(query, database):
-        """简化的BLAST搜索算法"""
-        results = []
-        query_len = len(query)
-        db_size = sum(len(seq) for _, seq in database)
-        
-        for seq_id, subject in database:
-            # 计算匹配分数
-            matches = 0
-            mismatches = 0
-            for i in range(min(len(query), len(subject))):
-                if i < len(query) and query[i] == subject[i]:
-                    matches += 1
-                else:
-                    mismatches += 1
-            
-            # 计算得分（简化版）
-            score = matches * 2 - mismatches
-            
-            # 计算相似度百分比
-            identity = (matches / query_len) * 100 if query_len > 0 else 0
-            
-            # 计算E-value（极简化版）
-            # E = K * m * n * exp(-λ * S)
-            # 这里使用简化公式
-            e_value = db_size * query_len * math.exp(-0.1 * score) if score > 0 else 1000
-            
-            results.append({
-                'id': seq_id,
-                'score': score,
-                'identity': identity,
-                'e_value': e_value,
-                'matches': matches,
-                'length': len(subject),
-                'alignment': f"{str(query)[:20]}...\n{str(subject)[:20]}..."
-            })
+        """种子-延伸BLAST搜索：k-mer索引找种子，X-drop延伸，Karlin-Altschul E-value"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # 把数据库写成FASTA并建立磁盘上的种子索引
+            # 真实场景中索引只需建一次，之后 SeedIndex.open 会直接复用
+            fasta_path = os.path.join(tmpdir, 'database.fasta')
+            records = [SeqRecord(seq, id=seq_id, description="") for seq_id, seq in database]
+            SeqIO.write(records, fasta_path, "fasta")
+
+            index = SeedIndex.open(fasta_path)
+            searcher = BlastSearcher(index)
+            print(f"Karlin-Altschul参数: λ={searcher.lam:.3f}, K={searcher.K:.3f}\n")
+
+            results = []
+            for hit in searcher.search(query):
+                results.append({
+                    'id': hit['id'],
+                    'score': hit['score'],
+                    'identity': hit['identity'],
+                    'e_value': hit['e_value'],
+                    'matches': hit['matches'],
+                    'length': hit['length'],
+                    'alignment': str(hit['alignment']).rstrip()
+                })
+            del index, searcher
         
-        # 按分数排序
-        return sorted(results, key=lambda x: x['score'], reverse=True)
+        # search 已经按E-value排序
+        return results
     
     # 执行搜索
     results = blast_search(query, database)
@@ -682,7 +637,7 @@ def practice_8_blast_search_solution():
     print("-" * 60)
     
     for hit in results:
-        print(f"{hit['id']:<8} {hit['score']:<8} {hit['identity']:<10.1f}% {hit['e_value']:<12.2e} {hit['length']:<8}")
+        print(f"{hit['id']:<8} {hit['score']:<8g} {hit['identity']:<10.1f}% {hit['e_value']:<12.2e} {hit['length']:<8}")
     
     # 显示最佳匹配的详细信息
     if results:
@@ -718,86 +673,36 @@ def practice_9_phylogenetic_analysis_solution():
     for species, seq in species_sequences.items():
         print(f"{species:8}: {seq}")
     
-    def calculate_distance(seq1, seq2):
-        """计算Hamming距离"""
-        differences = sum(1 for a, b in zip(seq1, seq2) if a != b)
-        return differences / len(seq1)
-    
-    # 构建距离矩阵
-    print("\n距离矩阵:")
+    # 把比对编码成矩阵，一次算出所有序列对的距离
     species_list = list(species_sequences.keys())
-    distance_matrix = {}
-    
-    # 打印表头
-    print("        ", end="")
-    for sp in species_list:
-        print(f"{sp:8}", end="")
-    print()
-    
-    # 计算并打印距离
-    for sp1 in species_list:
-        print(f"{sp1:8}", end="")
-        distance_matrix[sp1] = {}
-        for sp2 in species_list:
-            if sp1 == sp2:
-                dist = 0.000
-            else:
-                dist = calculate_distance(
-                    species_sequences[sp1],
-                    species_sequences[sp2]
-                )
-            distance_matrix[sp1][sp2] = dist
-            print(f"{dist:8.3f}", end="")
-        print()
-    
-    # 使用UPGMA算法构建简单的树（简化版）
-    print("\n系统发育关系（基于UPGMA）:")
-    print("-" * 40)
-    
-    # 找出最近的物种对
-    min_dist = float('inf')
-    closest_pair = None
-    for sp1 in species_list:
-        for sp2 in species_list:
-            if sp1 != sp2 and distance_matrix[sp1][sp2] < min_dist:
-                min_dist = distance_matrix[sp1][sp2]
-                closest_pair = (sp1, sp2)
-    
-    if closest_pair:
-        print(f"最近的物种对: {closest_pair[0]} - {closest_pair[1]}")
-        print(f"进化距离: {min_dist:.3f}")
-    
-    # 简单的聚类分析
-    print("\n聚类分析:")
-    # 灵长类
-    primates = ["Human", "Chimp"]
-    rodents = ["Mouse", "Rat"]
-    
-    print("灵长类分支: " + ", ".join(primates))
-    primate_dist = calculate_distance(
-        species_sequences["Human"],
-        species_sequences["Chimp"]
-    )
-    print(f"  分支内距离: {primate_dist:.3f}")
-    
-    print("啮齿类分支: " + ", ".join(rodents))
-    rodent_dist = calculate_distance(
-        species_sequences["Mouse"],
-        species_sequences["Rat"]
-    )
-    print(f"  分支内距离: {rodent_dist:.3f}")
-    
-    # 简单的进化树表示
-    print("\n简化的进化树:")
-    print("         ┌─── Human")
-    print("    ┌────┤")
-    print("    │    └─── Chimp")
-    print("────┤")
-    print("    │    ┌─── Mouse")
-    print("    ├────┤")
-    print("    │    └─── Rat")
-    print("    │")
-    print("    └──────── Fly")
+    alignment = encode_alignment(species_sequences.values())
+    p_distances = distance_matrix(alignment, model='p')
+    k2p_distances = distance_matrix(alignment, model='k2p')
+    
+    print("\n距离矩阵（上三角: p-distance，下三角: K2P）:")
+    print("        " + "".join(f"{sp:8}" for sp in species_list))
+    for i, sp1 in enumerate(species_list):
+        row = [k2p_distances[i, j] if j < i else p_distances[i, j]
+               for j in range(len(species_list))]
+        print(f"{sp1:8}" + "".join(f"{dist:8.3f}" for dist in row))
+    
+    # 找出最近的物种对（只看上三角，每对只比较一次）
+    upper_i, upper_j = np.triu_indices(len(species_list), k=1)
+    closest = int(np.argmin(k2p_distances[upper_i, upper_j]))
+    sp1, sp2 = species_list[upper_i[closest]], species_list[upper_j[closest]]
+    print(f"\n最近的物种对: {sp1} - {sp2}")
+    print(f"进化距离(K2P): {k2p_distances[upper_i[closest], upper_j[closest]]:.3f}")
+    
+    # UPGMA（有根）和邻接法（无根）建树，输出Newick格式
+    trees = {
+        "UPGMA": upgma_tree(k2p_distances, species_list),
+        "邻接法(NJ)": neighbor_joining_tree(k2p_distances, species_list),
+    }
+    for method, newick in trees.items():
+        print(f"\n{method} 进化树:")
+        print(f"Newick: {newick}")
+        tree = Phylo.read(io.StringIO(newick), "newick")
+        Phylo.draw_ascii(tree, column_width=60)
 
 
 def practice_10_complete_pipeline_solution():
@@ -848,24 +753,9 @@ def practice_10_complete_pipeline_solution():
     # Step 2 - 基因预测
     def predict_genes(sequence):
         """预测可能的基因"""
-        genes = []
-        # 查找所有ATG起始的ORF
-        for i in range(len(sequence) - 2):
-            if str(sequence[i:i+3]) == 'ATG':
-                # 查找最近的终止密码子
-                for j in range(i + 3, len(sequence) - 2, 3):
-                    if str(sequence[j:j+3]) in ['TAA', 'TAG', 'TGA']:
-                        if j - i >= 30:  # 至少10个氨基酸
-                            gene_seq = sequence[i:j+3]
-                            genes.append({
-                                'start': i,
-                                'end': j + 3,
-                                'length': j + 3 - i,
-                                'sequence': gene_seq,
-                                'protein': gene_seq.translate()
-                            })
-                        break
-        return genes
+        # 正链所有ATG起始的ORF，至少10个氨基酸（含终止密码子33 bp）
+        genes = find_orfs_vectorized(sequence, min_length=33, strands="+")
+        return sorted(genes, key=lambda gene: gene['start'])
     
     print("\nStep 2: 基因预测")
     print("-" * 30)
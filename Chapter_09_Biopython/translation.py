@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chapter 09 工具模块：查表翻译引擎
+
+按密码子切片、查字典、拼接字符串，每个密码子都要经过好几次Python对象操作。
+这里为每个NCBI遗传密码表预先算好一张 16×16×16 = 4096 项的翻译表：
+
+- 每个碱基（包括IUPAC简并碱基和RNA的U）先编码成 0-15 的数字
+- 密码子编号 = 第一位×256 + 第二位×16 + 第三位
+- 简并密码子展开后如果都编码同一个氨基酸（如 CTN → L），就翻译成该氨基酸；
+  都是终止密码子（如 TAR）则为 '*'；只在D/N、E/Q、I/L之间不确定时
+  用简并氨基酸 B、Z、J；否则为 'X'
+
+整条序列的翻译就是：编码 → reshape成 (密码子数, 3) → 算编号 → 一次花式索引，
+得到的uint8数组直接就是蛋白质序列的ASCII字节。
+批量翻译许多ORF时，所有ORF的密码子编号一起计算，同样只需要一次查表。
+"""
+
+import time
+from functools import lru_cache
+from itertools import product
+
+import numpy as np
+from Bio.Data import CodonTable
+from Bio.Seq import Seq
+
+
+# IUPAC碱基的编码顺序：前4个是ACGT，N排在最后，其他字符也当作N
+IUPAC_BASES = 'ACGTRYSWKMBDHVN'
+_IUPAC_MEANING = {
+    'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T',
+    'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+    'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG', 'N': 'ACGT',
+}
+_N_CODE = IUPAC_BASES.index('N')
+
+_BASE_CODES = np.full(256, _N_CODE, dtype=np.uint16)
+for _code, _base in enumerate(IUPAC_BASES):
+    _BASE_CODES[ord(_base)] = _code
+    _BASE_CODES[ord(_base.lower())] = _code
+_BASE_CODES[ord('U')] = _BASE_CODES[ord('u')] = IUPAC_BASES.index('T')
+
+# 简并氨基酸代码：D/N → B，E/Q → Z，I/L → J（与Biopython一致）
+_AMBIGUOUS_AMINO_ACIDS = {
+    frozenset('DN'): 'B', frozenset('EQ'): 'Z', frozenset('IL'): 'J',
+}
+
+# IUPAC互补，用于六框翻译时的反向互补链
+_COMPLEMENT = bytes.maketrans(b'ACGTURYSWKMBDHVNacgturyswkmbdhvn',
+                              b'TGCAAYRSWMKVHDBNtgcaayrswmkvhdbn')
+
+
+def _encode(sequence):
+    """序列（str/Seq/bytes）→ 0-15 的编码数组"""
+    if isinstance(sequence, (bytes, bytearray)):
+        raw = bytes(sequence)
+    else:
+        raw = str(sequence).encode('ascii')
+    return _BASE_CODES[np.frombuffer(raw, dtype=np.uint8)]
+
+
+class Translator:
+    """
+    一个遗传密码表的查表翻译器
+
+    用法：
+        translator = Translator(table=1)
+        protein = translator.translate("ATGGCC...", to_stop=True)
+        proteins = translator.translate_many(orf_sequences)
+    """
+
+    def __init__(self, table=1, stop_symbol='*'):
+        codon_table = CodonTable.unambiguous_dna_by_id[table]
+        self.table = table
+        self.stop_symbol = stop_symbol
+        self.start_codons = list(codon_table.start_codons)
+        self._lookup = self._build_lookup(codon_table, stop_symbol)
+
+    @staticmethod
+    def _build_lookup(codon_table, stop_symbol):
+        """预先计算全部4096个（含简并碱基的）密码子的翻译结果"""
+        lookup = np.full(16 ** 3, ord('X'), dtype=np.uint8)
+        forward = codon_table.forward_table
+        for i, j, k in product(range(len(IUPAC_BASES)), repeat=3):
+            # 少数密码表中既是终止又编码氨基酸的密码子，与Biopython一样按氨基酸翻译
+            meanings = frozenset(forward.get(''.join(codon), stop_symbol)
+                                 for codon in product(_IUPAC_MEANING[IUPAC_BASES[i]],
+                                                      _IUPAC_MEANING[IUPAC_BASES[j]],
+                                                      _IUPAC_MEANING[IUPAC_BASES[k]]))
+            if len(meanings) == 1:
+                lookup[i * 256 + j * 16 + k] = ord(next(iter(meanings)))
+            elif meanings in _AMBIGUOUS_AMINO_ACIDS:
+                lookup[i * 256 + j * 16 + k] = ord(_AMBIGUOUS_AMINO_ACIDS[meanings])
+        return lookup
+
+    def translate(self, sequence, frame=0, to_stop=False):
+        """
+        翻译一条序列
+
+        参数：
+            frame: 从第几个碱基开始读（0/1/2）
+            to_stop: 为True时在第一个终止密码子处截断（不含终止符号）
+        末尾不足一个密码子的碱基被忽略。
+        """
+        codes = _encode(sequence)[frame:]
+        n_codons = len(codes) // 3
+        triplets = codes[:n_codons * 3].reshape(n_codons, 3)
+        ids = triplets[:, 0] * 256 + triplets[:, 1] * 16 + triplets[:, 2]
+        protein = self._lookup[ids].tobytes().decode('ascii')
+        if to_stop:
+            stop = protein.find(self.stop_symbol)
+            if stop != -1:
+                protein = protein[:stop]
+        return protein
+
+    def six_frames(self, sequence, to_stop=False):
+        """
+        六框翻译
+
+        返回 {(链, 阅读框): 蛋白质}，链为 '+' 或 '-'，阅读框为0/1/2；
+        '-' 链在反向互补序列上从5'端读起
+        """
+        raw = sequence if isinstance(sequence, bytes) else str(sequence).encode('ascii')
+        reverse = raw.translate(_COMPLEMENT)[::-1]
+        proteins = {}
+        for strand, strand_seq in (('+', raw), ('-', reverse)):
+            for frame in range(3):
+                proteins[(strand, frame)] = self.translate(strand_seq, frame, to_stop)
+        return proteins
+
+    def translate_regions(self, sequence, starts, ends, to_stop=False):
+        """
+        批量翻译同一条序列上的许多区间 [start, end)
+
+        所有区间的密码子编号一起计算、一次查表，再按区间切分成字符串
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        codes = sequence if isinstance(sequence, np.ndarray) else _encode(sequence)
+
+        n_codons = np.maximum((ends - starts) // 3, 0)
+        bounds = np.concatenate([[0], np.cumsum(n_codons)])
+        region = np.repeat(np.arange(len(starts)), n_codons)
+        first_base = starts[region] + 3 * (np.arange(bounds[-1]) - bounds[region])
+
+        ids = codes[first_base] * 256 + codes[first_base + 1] * 16 + codes[first_base + 2]
+        joined = self._lookup[ids].tobytes().decode('ascii')
+
+        proteins = [joined[bounds[k]:bounds[k + 1]] for k in range(len(starts))]
+        if to_stop:
+            proteins = [protein.split(self.stop_symbol, 1)[0] for protein in proteins]
+        return proteins
+
+    def translate_many(self, sequences, to_stop=False):
+        """批量翻译许多条序列（如一批ORF），返回蛋白质字符串列表"""
+        seq_strs = [str(seq) for seq in sequences]
+        lengths = np.array([len(seq) for seq in seq_strs], dtype=np.int64)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        return self.translate_regions(''.join(seq_strs), starts, starts + lengths, to_stop)
+
+
+@lru_cache(maxsize=None)
+def get_translator(table=1):
+    """每个遗传密码表只构建一次翻译表"""
+    return Translator(table)
+
+
+def translate(sequence, table=1, to_stop=False):
+    """用缓存的翻译器翻译一条序列，返回字符串"""
+    return get_translator(table).translate(sequence, to_stop=to_stop)
+
+
+def translate_dict_loop(dna, codon_table, to_stop=False):
+    """逐密码子查字典的传统写法，保留下来用于对比测试"""
+    protein = []
+    for i in range(0, len(dna) - 2, 3):
+        amino_acid = codon_table.get(dna[i:i+3], 'X')
+        if to_stop and amino_acid == '*':
+            break
+        protein.append(amino_acid)
+    return ''.join(protein)
+
+
+def benchmark_translation(sequence_length=10_000_000, seed=21):
+    """性能对比：10 Mb 随机序列上的字典循环、Bio.Seq.translate 和查表翻译"""
+    rng = np.random.default_rng(seed)
+    bases = np.frombuffer(b'ACGT', dtype=np.uint8)
+    dna = bases[rng.integers(0, 4, sequence_length)].tobytes().decode('ascii')
+
+    codon_table = CodonTable.unambiguous_dna_by_id[1]
+    forward = dict(codon_table.forward_table)
+    forward.update({codon: '*' for codon in codon_table.stop_codons})
+    translator = get_translator(1)
+
+    print(f"\n⏱️ 翻译性能对比（随机序列 {sequence_length / 1e6:.0f} Mb）")
+    timings = {}
+    start_time = time.perf_counter()
+    loop_protein = translate_dict_loop(dna, forward)
+    timings['dict_loop'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    bio_protein = str(Seq(dna[:len(dna) // 3 * 3]).translate())
+    timings['biopython'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    protein = translator.translate(dna)
+    timings['lookup'] = time.perf_counter() - start_time
+
+    same = protein == loop_protein == bio_protein
+    print(f"   结果一致性检查: {'✓' if same else '✗'}")
+    print(f"   字典循环:          {timings['dict_loop']:.3f}秒")
+    print(f"   Bio.Seq.translate: {timings['biopython']:.3f}秒")
+    print(f"   查表翻译:          {timings['lookup']:.3f}秒"
+          f"（字典循环的 {timings['dict_loop'] / timings['lookup']:.0f} 倍）")
+    return timings
+
+
+if __name__ == "__main__":
+    benchmark_translation()
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chapter 10 工具模块：kNN图与基于图的细胞聚类
+
+AgglomerativeClustering 需要 O(n²) 的距离矩阵，silhouette_score 需要 O(n²) 的两两距离，
+10万个细胞时都撑不住。单细胞分析的标准做法是：
+
+1. 在PCA空间（约50维）里建近似kNN图：随机投影树（Annoy的思路）把相近的细胞分进
+   同一个叶子，叶内精确计算距离；多棵树的候选合并后，再做几轮 NN-descent
+   （"邻居的邻居也可能是邻居"）。全部是 NumPy 批量运算，O(n·log n)
+2. 在稀疏的kNN图上做模块度优化（Louvain式）：所有节点同时计算最佳的目标社区，
+   随机取一部分移动，避免相邻节点来回交换；收敛后把社区合并成超节点，重复。
+   每层结束时把不连通的社区拆开（Leiden算法保证社区内部连通的那一步）
+3. 轮廓系数只在分层抽样的子集上计算，O(sample_size²)
+
+GraphClustering 的接口与 sklearn 的聚类器相同（fit / fit_predict / labels_）。
+"""
+
+import time
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from sklearn.metrics import adjusted_rand_score, silhouette_score
+from sklearn.neighbors import NearestNeighbors
+
+from reduction import AutoPCA
+
+
+# 细胞数不超过这个值时直接用精确kNN
+EXACT_KNN_MAX = 10_000
+
+# 叶内距离计算时，每批距离矩阵的元素数上限
+_LEAF_BATCH_ELEMENTS = 2 ** 24
+
+# 合并候选和 NN-descent 时每批处理的行数
+_ROW_CHUNK = 20_000
+
+
+def _drop_self(indices, distances):
+    """去掉每行中的细胞自身（有重复细胞时自身不一定排第一，找不到时去掉最远的一个）"""
+    n, width = indices.shape
+    is_self = indices == np.arange(n)[:, None]
+    is_self[~is_self.any(axis=1), -1] = True
+    is_self[np.cumsum(is_self, axis=1) > 1] = False
+    keep = ~is_self
+    return indices[keep].reshape(n, width - 1), distances[keep].reshape(n, width - 1)
+
+
+def exact_knn(X, n_neighbors=15):
+    """精确kNN（sklearn），返回 (indices, distances)，不含自身"""
+    n_neighbors = min(n_neighbors, len(X) - 1)
+    distances, indices = NearestNeighbors(n_neighbors=n_neighbors + 1).fit(X).kneighbors(X)
+    return _drop_self(indices, distances)
+
+
+def _rp_tree(X, leaf_size, rng, n_directions=16):
+    """
+    一棵随机投影树：逐层把每个节点的点按随机方向上的投影排序，从中位数切开，
+    直到每个叶子不超过 leaf_size 个点。
+    每层只生成 n_directions 个随机方向，每个节点从中随机挑一个，投影是一次矩阵乘法。
+    返回 (按叶子排好的点序号, 叶子边界)
+    """
+    n, n_dims = X.shape
+    order = np.arange(n)
+    bounds = np.array([0, n])
+    while True:
+        sizes = np.diff(bounds)
+        split = sizes > leaf_size
+        if not split.any():
+            return order, bounds
+        directions = rng.standard_normal((n_dims, n_directions)).astype(X.dtype)
+        node_of = np.repeat(np.arange(len(sizes)), sizes)
+        choice = rng.integers(n_directions, size=len(sizes))
+        values = (X @ directions)[order, choice[node_of]]
+        order = order[np.lexsort((values, node_of))]
+        bounds = np.sort(np.concatenate([bounds, bounds[:-1][split] + sizes[split] // 2]))
+
+
+def _leaf_neighbors(X, sq_norms, order, bounds, n_neighbors):
+    """叶内精确kNN：同样大小的叶子拼成一批，用批量矩阵乘法算距离"""
+    n = len(X)
+    indices = np.full((n, n_neighbors), -1, dtype=np.int64)
+    distances = np.full((n, n_neighbors), np.inf, dtype=np.float32)
+    sizes = np.diff(bounds)
+    for size in np.unique(sizes):
+        k = min(n_neighbors, size - 1)
+        if k <= 0:
+            continue
+        starts = bounds[:-1][sizes == size]
+        step = max(1, _LEAF_BATCH_ELEMENTS // (size * size))
+        for first in range(0, len(starts), step):
+            members = order[starts[first:first + step, None] + np.arange(size)]
+            points = X[members]
+            norms = sq_norms[members]
+            d2 = norms[:, :, None] + norms[:, None, :] - 2 * points @ points.transpose(0, 2, 1)
+            d2[:, np.arange(size), np.arange(size)] = np.inf
+            nearest = np.argpartition(d2, k - 1, axis=2)[:, :, :k]
+            candidates = np.broadcast_to(members[:, None, :], d2.shape)
+            indices[members, :k] = np.take_along_axis(candidates, nearest, axis=2)
+            distances[members, :k] = np.maximum(np.take_along_axis(d2, nearest, axis=2), 0)
+    return indices, distances
+
+
+def _merge_candidates(indices, distances, new_indices, new_distances):
+    """
+    把候选邻居合并进当前的kNN表（原地修改）：按序号排序去重，
+    去掉自身和无效候选，保留最近的 k 个并按距离升序排列
+    """
+    n, k = indices.shape
+    for start in range(0, n, _ROW_CHUNK):
+        rows = slice(start, min(start + _ROW_CHUNK, n))
+        merged = np.concatenate([indices[rows], new_indices[rows]], axis=1)
+        merged_d = np.concatenate([distances[rows], new_distances[rows]], axis=1)
+        by_index = np.argsort(merged, axis=1, kind='stable')
+        merged = np.take_along_axis(merged, by_index, axis=1)
+        merged_d = np.take_along_axis(merged_d, by_index, axis=1)
+        invalid = (merged < 0) | (merged == np.arange(start, rows.stop)[:, None])
+        invalid[:, 1:] |= merged[:, 1:] == merged[:, :-1]
+        merged_d[invalid] = np.inf
+        best = np.argpartition(merged_d, k - 1, axis=1)[:, :k]
+        best_d = np.take_along_axis(merged_d, best, axis=1)
+        by_distance = np.argsort(best_d, axis=1)
+        best = np.take_along_axis(best, by_distance, axis=1)
+        distances[rows] = np.take_along_axis(best_d, by_distance, axis=1)
+        indices[rows] = np.where(np.isfinite(distances[rows]),
+                                 np.take_along_axis(merged, best, axis=1), -1)
+
+
+def _neighbors_of_neighbors(X, sq_norms, indices, n_sampled):
+    """NN-descent 的一轮：每个点的前 n_sampled 个邻居的邻居作为候选，计算距离"""
+    n, k = indices.shape
+    candidates = indices[np.maximum(indices[:, :n_sampled], 0)].reshape(n, -1)
+    candidates[np.repeat(indices[:, :n_sampled] < 0, k, axis=1)] = -1
+    distances = np.full(candidates.shape, np.inf, dtype=np.float32)
+    chunk = max(1, _LEAF_BATCH_ELEMENTS // (candidates.shape[1] * X.shape[1]))
+    for start in range(0, n, chunk):
+        rows = slice(start, min(start + chunk, n))
+        valid = candidates[rows] >= 0
+        targets = np.where(valid, candidates[rows], 0)
+        dots = (X[targets] @ X[rows][:, :, None])[:, :, 0]
+        d2 = np.maximum(sq_norms[rows, None] + sq_norms[targets] - 2 * dots, 0)
+        distances[rows] = np.where(valid, d2, np.inf)
+    return candidates, distances
+
+
+def approximate_knn(X, n_neighbors=15, n_trees=4, leaf_size=None, n_iters=2, seed=0):
+    """
+    近似kNN：随机投影森林 + NN-descent，返回 (indices, distances)，
+    每行按距离升序，不含自身。细胞数不超过 EXACT_KNN_MAX 时直接用精确kNN
+
+    参数：
+        n_trees: 随机投影树的棵数
+        leaf_size: 叶子的最大点数，默认 max(4·n_neighbors, 64)
+        n_iters: NN-descent 的轮数
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    if len(X) <= EXACT_KNN_MAX:
+        indices, distances = exact_knn(X, n_neighbors)
+        return indices, distances.astype(np.float32)
+
+    rng = np.random.default_rng(seed)
+    leaf_size = leaf_size or max(4 * n_neighbors, 64)
+    sq_norms = np.einsum('ij,ij->i', X, X)
+    indices = np.full((len(X), n_neighbors), -1, dtype=np.int64)
+    distances = np.full((len(X), n_neighbors), np.inf, dtype=np.float32)
+    for _ in range(n_trees):
+        order, bounds = _rp_tree(X, leaf_size, rng)
+        _merge_candidates(indices, distances, *_leaf_neighbors(X, sq_norms, order, bounds,
+                                                              n_neighbors))
+    for _ in range(n_iters):
+        _merge_candidates(indices, distances,
+                          *_neighbors_of_neighbors(X, sq_norms, indices, max(n_neighbors // 2, 5)))
+    return indices, np.sqrt(distances)
+
+
+def knn_graph(indices):
+    """kNN表 → 对称的0/1邻接矩阵（CSR）：i 和 j 只要有一方把对方列为邻居就连边"""
+    n, k = indices.shape
+    rows = np.repeat(np.arange(n), k)
+    cols = indices.ravel()
+    valid = cols >= 0
+    graph = sparse.csr_matrix((np.ones(valid.sum()), (rows[valid], cols[valid])), shape=(n, n))
+    return graph.maximum(graph.T).tocsr()
+
+
+def modularity(graph, labels, resolution=1.0):
+    """模块度 Q = Σ_c [ 社区内边权/2m - γ·(社区度数和/2m)² ]"""
+    graph = sparse.coo_matrix(graph)
+    two_m = graph.data.sum()
+    inside = graph.data[labels[graph.row] == labels[graph.col]].sum()
+    degree_sums = np.bincount(labels, weights=np.asarray(graph.sum(axis=1)).ravel())
+    return inside / two_m - resolution * ((degree_sums / two_m) ** 2).sum()
+
+
+def _local_moving(graph, resolution, rng, max_sweeps, move_fraction, tol):
+    """
+    一层的局部移动：每一轮所有节点同时计算移到各相邻社区的模块度增益，
+    有正增益的节点随机取 move_fraction 移动，一轮的模块度提升小于 tol 时停止。
+    返回模块度最高的一轮的社区标签
+    """
+    n = graph.shape[0]
+    degrees = np.asarray(graph.sum(axis=1)).ravel()
+    two_m = degrees.sum()
+    self_loops = graph.diagonal()
+    rows = np.repeat(np.arange(n), np.diff(graph.indptr))
+    labels = np.arange(n)
+    best_labels, best_q = labels, modularity(graph, labels, resolution)
+    for _ in range(max_sweeps):
+        totals = np.bincount(labels, weights=degrees, minlength=n)
+        # 每个节点到各相邻社区的边权和（COO转CSR时重复项自动相加）
+        links = sparse.csr_matrix((graph.data, (rows, labels[graph.indices])), shape=(n, n))
+        link_rows = np.repeat(np.arange(n), np.diff(links.indptr))
+        own = links.indices == labels[link_rows]
+        own_links = np.zeros(n)
+        own_links[link_rows[own]] = links.data[own]
+        # 留在原社区（先把自己移出）与移入社区 c 的得分，两者之差即模块度增益（差一个常数因子）
+        stay = own_links - self_loops - resolution * degrees * (totals[labels] - degrees) / two_m
+        score = links.data - resolution * degrees[link_rows] * totals[links.indices] / two_m
+        score[own] = -np.inf
+        best = np.full(n, -np.inf)
+        nonempty = np.diff(links.indptr) > 0
+        best[nonempty] = np.maximum.reduceat(score, links.indptr[:-1][nonempty])
+        is_best = np.flatnonzero((score == best[link_rows]) & np.isfinite(score))
+        first_of_row = np.ones(len(is_best), dtype=bool)
+        first_of_row[1:] = link_rows[is_best[1:]] != link_rows[is_best[:-1]]
+        first = is_best[first_of_row]
+        target = labels.copy()
+        target[link_rows[first]] = links.indices[first]
+
+        improving = best - stay > 1e-12 * max(degrees.max(), 1)
+        if not improving.any():
+            break
+        move = improving & (rng.random(n) < move_fraction)
+        labels = np.where(move, target, labels)
+        q = (graph.data[labels[rows] == labels[graph.indices]].sum() / two_m
+             - resolution * ((np.bincount(labels, weights=degrees) / two_m) ** 2).sum())
+        if q > best_q:
+            best_labels, best_q, gain = labels, q, q - best_q
+        else:
+            gain = 0.0
+        # 剩下的零星移动交给合并后的上一层，比在这一层逐个节点挪动快得多
+        if gain < tol:
+            break
+    return best_labels
+
+
+def modularity_clustering(graph, resolution=1.0, max_sweeps=100, move_fraction=0.5, tol=1e-4,
+                          seed=0):
+    """
+    Louvain式多层模块度优化：局部移动 → 拆开不连通的社区 → 社区合并成超节点，
+    直到社区数不再减少。返回按聚类大小从大到小编号的标签
+    """
+    rng = np.random.default_rng(seed)
+    graph = sparse.csr_matrix(graph, dtype=np.float64)
+    labels = np.arange(graph.shape[0])
+    while True:
+        level_labels = _local_moving(graph, resolution, rng, max_sweeps, move_fraction, tol)
+        # 只保留社区内部的边，求连通分量：每个分量成为一个社区
+        coo = graph.tocoo()
+        inside = level_labels[coo.row] == level_labels[coo.col]
+        intra = sparse.csr_matrix((coo.data[inside], (coo.row[inside], coo.col[inside])),
+                                  shape=graph.shape)
+        n_communities, level_labels = connected_components(intra, directed=False)
+        if n_communities == graph.shape[0]:
+            break
+        labels = level_labels[labels]
+        membership = sparse.csr_matrix(
+            (np.ones(graph.shape[0]), (np.arange(graph.shape[0]), level_labels)),
+            shape=(graph.shape[0], n_communities))
+        graph = (membership.T @ graph @ membership).tocsr()
+    sizes = np.bincount(labels)
+    rank = np.empty_like(sizes)
+    rank[np.argsort(-sizes, kind='stable')] = np.arange(len(sizes))
+    return rank[labels]
+
+
+def subsampled_silhouette(X, labels, sample_size=5000, seed=0):
+    """
+    分层抽样的轮廓系数：每个聚类按比例抽样（至少2个点），
+    小聚类不会因为均匀抽样而被漏掉。O(sample_size²)
+    """
+    labels = np.asarray(labels)
+    if len(labels) <= sample_size:
+        return silhouette_score(X, labels)
+    rng = np.random.default_rng(seed)
+    clusters, counts = np.unique(labels, return_counts=True)
+    quotas = np.maximum(np.round(counts * sample_size / len(labels)).astype(int),
+                        np.minimum(counts, 2))
+    sample = np.concatenate([rng.choice(np.flatnonzero(labels == c), q, replace=False)
+                             for c, q in zip(clusters, quotas)])
+    return silhouette_score(np.asarray(X[np.sort(sample)]), labels[np.sort(sample)])
+
+
+class GraphClustering:
+    """
+    kNN图 + 模块度聚类，接口与 sklearn 的聚类器相同
+
+    参数：
+        n_neighbors: kNN图中每个细胞的邻居数
+        resolution: 模块度的分辨率，越大聚类越多越小
+        n_pcs: 特征数多于它时先用 AutoPCA 降到 n_pcs 维，在PCA空间里建图
+
+    拟合后的属性：labels_, n_clusters_, graph_（稀疏邻接矩阵）, modularity_, embedding_
+    """
+
+    def __init__(self, n_neighbors=15, resolution=1.0, n_pcs=50, n_trees=4, n_iters=2,
+                 random_state=0):
+        self.n_neighbors = n_neighbors
+        self.resolution = resolution
+        self.n_pcs = n_pcs
+        self.n_trees = n_trees
+        self.n_iters = n_iters
+        self.random_state = random_state
+
+    def fit(self, X):
+        if X.shape[1] > self.n_pcs:
+            X = AutoPCA(self.n_pcs, random_state=self.random_state).fit_transform(X)
+        self.embedding_ = np.asarray(X, dtype=np.float32)
+        indices, _ = approximate_knn(self.embedding_, self.n_neighbors, self.n_trees,
+                                     n_iters=self.n_iters, seed=self.random_state)
+        self.graph_ = knn_graph(indices)
+        self.labels_ = modularity_clustering(self.graph_, self.resolution,
+                                             seed=self.random_state)
+        self.n_clusters_ = int(self.labels_.max()) + 1
+        self.modularity_ = modularity(self.graph_, self.labels_, self.resolution)
+        return self
+
+    def fit_predict(self, X):
+        return self.fit(X).labels_
+
+
+def _simulate_embedding(n_cells, n_dims=50, n_types=20, seed=0):
+    """模拟PCA空间中的细胞：大小不等的细胞类型（高斯团）+ 各向同性噪声，方差随主成分递减"""
+    rng = np.random.default_rng(seed)
+    weights = rng.dirichlet(np.full(n_types, 2.0))
+    types = rng.choice(n_types, n_cells, p=weights)
+    scale = np.geomspace(3, 0.3, n_dims)
+    centers = rng.standard_normal((n_types, n_dims)) * scale * 2
+    X = np.empty((n_cells, n_dims), dtype=np.float32)
+    for start in range(0, n_cells, 100_000):
+        block = types[start:start + 100_000]
+        X[start:start + len(block)] = centers[block] + rng.standard_normal((len(block), n_dims)) * scale
+    return X, types
+
+
+def _knn_quality(X, indices, distances, n_queries=1000, seed=0):
+    """
+    随机抽 n_queries 个细胞，与暴力计算的精确kNN比较，返回 (召回率, 平均邻居距离比)。
+    高维噪声里许多邻居几乎等距，召回率偏悲观；距离比接近1说明找到的邻居同样近
+    """
+    queries = np.random.default_rng(seed).choice(len(X), min(n_queries, len(X)), replace=False)
+    k = indices.shape[1]
+    sq_norms = np.einsum('ij,ij->i', X, X)
+    hits, exact_distance = 0, 0.0
+    for batch in np.array_split(queries, max(1, len(queries) * len(X) // _LEAF_BATCH_ELEMENTS)):
+        d2 = sq_norms[batch, None] + sq_norms - 2 * X[batch] @ X.T
+        d2[np.arange(len(batch)), batch] = np.inf
+        truth = np.argpartition(d2, k - 1, axis=1)[:, :k]
+        hits += sum(len(np.intersect1d(t, a)) for t, a in zip(truth, indices[batch]))
+        exact_distance += np.sqrt(np.maximum(np.take_along_axis(d2, truth, axis=1), 0)).sum()
+    return hits / (len(queries) * k), distances[queries].sum() / exact_distance
+
+
+def benchmark_cell_graph(sizes=(20_000, 100_000, 500_000), n_neighbors=15, seed=0):
+    """
+    性能测试：原来的全量聚类（层次聚类 + 全量轮廓系数）与 kNN图 + 模块度聚类对比，
+    并逐步放大到50万个细胞；最后在模拟的稀疏单细胞矩阵上跑完整流程
+    """
+    from sparse_expression import simulate_counts
+    from sklearn.cluster import AgglomerativeClustering
+
+    print(f"\n⏱️ 细胞聚类性能（PCA空间50维，{n_neighbors} 近邻）")
+    timings = {}
+    X, truth = _simulate_embedding(sizes[0], seed=seed)
+    start_time = time.perf_counter()
+    labels = AgglomerativeClustering(n_clusters=20).fit_predict(X)
+    score = silhouette_score(X, labels)
+    timings['full'] = time.perf_counter() - start_time
+    print(f"   {sizes[0]:>9,} 个细胞 层次聚类 + 全量轮廓系数: {timings['full']:.2f}秒，"
+          f"ARI {adjusted_rand_score(truth, labels):.3f}，轮廓系数 {score:.3f}，"
+          f"距离矩阵 {sizes[0] ** 2 * 8 / 1e9:.1f} GB")
+
+    for n_cells in sizes:
+        X, truth = _simulate_embedding(n_cells, seed=seed)
+        start_time = time.perf_counter()
+        indices, distances = approximate_knn(X, n_neighbors, seed=seed)
+        knn_time = time.perf_counter() - start_time
+        graph = knn_graph(indices)
+        labels = modularity_clustering(graph, seed=seed)
+        cluster_time = time.perf_counter() - start_time - knn_time
+        score = subsampled_silhouette(X, labels, seed=seed)
+        total = time.perf_counter() - start_time
+        timings[n_cells] = total
+        recall, distance_ratio = _knn_quality(X, indices, distances)
+        print(f"   {n_cells:>9,} 个细胞 kNN图 + 模块度聚类: {total:.2f}秒"
+              f"（kNN {knn_time:.1f}秒，召回率 {recall:.3f}，距离比 {distance_ratio:.3f}；"
+              f"聚类 {cluster_time:.1f}秒，{labels.max() + 1} 个聚类；"
+              f"抽样轮廓系数 {score:.3f}），ARI {adjusted_rand_score(truth, labels):.3f}")
+        del X, indices, distances, graph
+
+    # 完整流程：稀疏计数 → 标准化 → PCA → kNN图 → 聚类
+    expression = simulate_counts(50_000, 10_000, 1000, seed=seed).normalize_total().log1p()
+    start_time = time.perf_counter()
+    scores, _ = expression.pca(50)
+    model = GraphClustering(n_neighbors, random_state=seed).fit(scores)
+    timings['pipeline'] = time.perf_counter() - start_time
+    print(f"   稀疏单细胞 {expression.shape[0]:,} × {expression.shape[1]:,} "
+          f"PCA + kNN图 + 聚类: {timings['pipeline']:.2f}秒，{model.n_clusters_} 个聚类，"
+          f"模块度 {model.modularity_:.3f}，"
+          f"ARI {adjusted_rand_score(expression.obs['cell_type'], model.labels_):.3f}")
+    return timings
+
+
+if __name__ == "__main__":
+    benchmark_cell_graph()
@@ -25,7 +25,6 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from sklearn.model_selection import train_test_split, cross_val_score, GridSearchCV
 from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
 
 # 分类算法
@@ -36,15 +35,19 @@ from sklearn.svm import SVC
 from sklearn.naive_bayes import GaussianNB
 
 # 聚类算法
-from sklearn.cluster import KMeans, DBSCAN, AgglomerativeClustering
+from sklearn.cluster import KMeans, DBSCAN
 from sklearn.mixture import GaussianMixture
 
 # 评估指标
 from sklearn.metrics import (accuracy_score, precision_score, recall_score, 
                            f1_score, roc_auc_score, roc_curve, 
-                           confusion_matrix, silhouette_score, 
+                           confusion_matrix, 
                            adjusted_rand_score, classification_report)
 
+from cell_graph import GraphClustering, subsampled_silhouette
+from reduction import AutoPCA
+from sparse_expression import SparseExpression
+
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -423,12 +426,15 @@ def perform_clustering_analysis(df, true_labels):
     🧬 生物学类比：
     聚类分析如同细胞分类学：
     • K-means：找到细胞群的"代表细胞"
-    • 层次聚类：构建细胞进化树
+    • kNN图聚类：细胞与最相似的邻居连成网络，找出联系紧密的细胞群落
     • DBSCAN：识别密集细胞团和异常细胞
     • 高斯混合：细胞群的概率边界
     
+    层次聚类需要 O(n²) 的距离矩阵，10万个细胞就放不下；kNN图聚类在PCA空间建近似kNN图，
+    50万个细胞也只要几分钟（见 cell_graph.py）
+    
     🔬 评估标准：
-    • 轮廓系数：群内紧密，群间分离
+    • 轮廓系数：群内紧密，群间分离（分层抽样计算，避免 O(n²)）
     • 调整兰德指数：与真实分组的一致性
     """
     print_section("聚类分析")
@@ -442,7 +448,7 @@ def perform_clustering_analysis(df, true_labels):
     df_scaled = scaler.fit_transform(df_log)
     
     # 3. PCA降维（可视化用）
-    pca = PCA(n_components=2, random_state=42)
+    pca = AutoPCA(n_components=2, random_state=42)
     df_pca = pca.fit_transform(df_scaled)
     
     print(f"PCA解释方差比: {pca.explained_variance_ratio_}")
@@ -452,7 +458,7 @@ def perform_clustering_analysis(df, true_labels):
     clustering_methods = {
         'K-Means': KMeans(n_clusters=3, random_state=42),
         'DBSCAN': DBSCAN(eps=3, min_samples=5),
-        'Hierarchical': AgglomerativeClustering(n_clusters=3),
+        'kNN Graph': GraphClustering(n_neighbors=15, random_state=42),
         'GMM': GaussianMixture(n_components=3, random_state=42)
     }
     
@@ -473,7 +479,7 @@ def perform_clustering_analysis(df, true_labels):
         
         # 评估
         if len(np.unique(labels)) > 1:
-            silhouette = silhouette_score(df_scaled, labels)
+            silhouette = subsampled_silhouette(df_scaled, labels)
             ari = adjusted_rand_score(true_labels, labels)
         else:
             silhouette = -1
@@ -538,7 +544,7 @@ def determine_optimal_clusters(df_scaled):
         labels = kmeans.fit_predict(df_scaled)
         
         inertias.append(kmeans.inertia_)
-        silhouettes.append(silhouette_score(df_scaled, labels))
+        silhouettes.append(subsampled_silhouette(df_scaled, labels))
     
     # 可视化
     fig, axes = plt.subplots(1, 2, figsize=(12, 5))
@@ -933,18 +939,22 @@ def handle_real_single_cell_data():
     print(f"  - 细胞类型: {df_sc['cell_type'].nunique()} 种")
     print(f"  - 实验批次: {df_sc['batch'].nunique()} 个")
     
+    # 表达矩阵转成稀疏CSR（10x数据用 read_10x_mtx / read_10x_h5 直接读入稀疏格式）
+    expression = SparseExpression.from_dataframe(df_sc, meta_cols)
+    print(f"  - 稀疏存储: {expression}")
+    
     # 数据质量控制
     print(f"\n数据质量控制:")
     
-    # 1. 表达量统计
-    expression_data = df_sc[gene_cols]
-    total_counts = expression_data.sum(axis=1)
-    detected_genes = (expression_data > 0).sum(axis=1)
+    # 1. 表达量统计（直接从CSR的indptr/data计算，不生成稠密矩阵）
+    qc = expression.qc_metrics()
+    total_counts = qc['total_counts']
+    detected_genes = qc['n_genes_detected']
     
     print(f"每细胞统计:")
     print(f"  - 平均总表达量: {total_counts.mean():.1f} ± {total_counts.std():.1f}")
     print(f"  - 平均检测基因数: {detected_genes.mean():.1f} ± {detected_genes.std():.1f}")
-    print(f"  - 数据稀疏度: {(expression_data == 0).sum().sum() / expression_data.size * 100:.1f}%")
+    print(f"  - 数据稀疏度: {expression.sparsity * 100:.1f}%")
     
     # 2. 批次效应检测
     print(f"\n🔬 批次效应检测:")
@@ -957,12 +967,12 @@ def handle_real_single_cell_data():
     
     # 数据标准化（log1p变换 + z-score）
     print(f"\n数据标准化:")
-    # 1. log1p变换处理偏态分布
-    expression_log = np.log1p(expression_data)
+    # 1. log1p变换处理偏态分布：只变换非零值，原地修改，稀疏结构不变
+    expression.log1p()
     
-    # 2. z-score标准化
-    scaler = StandardScaler()
-    expression_scaled = scaler.fit_transform(expression_log)
+    # 2. z-score标准化：中心化会破坏稀疏性，所以只在PCA的矩阵乘法里隐式完成；
+    #    分类器需要逐基因的特征，这个示例数据很小，直接取稠密的标准化矩阵
+    expression_scaled = expression.scaled_array()
     
     print("标准化步骤:")
     print("  1. log1p变换: 处理数据偏态分布")
@@ -972,13 +982,12 @@ def handle_real_single_cell_data():
     # 降维分析（PCA + t-SNE）
     print(f"\n降维分析:")
     
-    # PCA降维
-    pca = PCA(n_components=10)
-    pca_result = pca.fit_transform(expression_scaled)
+    # PCA降维（对隐式标准化的稀疏矩阵做截断SVD）
+    pca_result, explained_ratio = expression.pca(n_components=10)
     
     print(f"PCA分析:")
-    print(f"  - 前3个主成分解释方差: {pca.explained_variance_ratio_[:3].sum():.2f}")
-    print(f"  - 前5个主成分解释方差: {pca.explained_variance_ratio_[:5].sum():.2f}")
+    print(f"  - 前3个主成分解释方差: {explained_ratio[:3].sum():.2f}")
+    print(f"  - 前5个主成分解释方差: {explained_ratio[:5].sum():.2f}")
     
     # t-SNE可视化
     if len(df_sc) > 5:  # 确保有足够样本
@@ -999,8 +1008,8 @@ def handle_real_single_cell_data():
             ax.scatter(pca_result[mask, 0], pca_result[mask, 1], 
                       c=[color], label=cell_type, alpha=0.7, s=50)
         ax.set_title('PCA - 按细胞类型')
-        ax.set_xlabel(f'PC1 ({pca.explained_variance_ratio_[0]:.2f})')
-        ax.set_ylabel(f'PC2 ({pca.explained_variance_ratio_[1]:.2f})')
+        ax.set_xlabel(f'PC1 ({explained_ratio[0]:.2f})')
+        ax.set_ylabel(f'PC2 ({explained_ratio[1]:.2f})')
         ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
         
         # 2. PCA结果（按批次着色）
@@ -1013,8 +1022,8 @@ def handle_real_single_cell_data():
             ax.scatter(pca_result[mask, 0], pca_result[mask, 1], 
                       c=[color], label=batch, alpha=0.7, s=50)
         ax.set_title('PCA - 按实验批次')
-        ax.set_xlabel(f'PC1 ({pca.explained_variance_ratio_[0]:.2f})')
-        ax.set_ylabel(f'PC2 ({pca.explained_variance_ratio_[1]:.2f})')
+        ax.set_xlabel(f'PC1 ({explained_ratio[0]:.2f})')
+        ax.set_ylabel(f'PC2 ({explained_ratio[1]:.2f})')
         ax.legend()
         
         # 3. t-SNE结果（按细胞类型）
@@ -1361,7 +1370,7 @@ def demonstrate_batch_effect_correction():
     print(f"\n批次效应检测:")
     
     # PCA分析检测批次效应
-    pca = PCA(n_components=3)
+    pca = AutoPCA(n_components=3)
     pca_result = pca.fit_transform(df_batch[gene_cols])
     
     print(f"PCA分析:")
@@ -1427,7 +1436,7 @@ def demonstrate_batch_effect_correction():
     print(f"  4. 校正后数据范围: [{corrected_data.min().min():.2f}, {corrected_data.max().max():.2f}]")
     
     # 校正后PCA分析
-    pca_corrected = PCA(n_components=3)
+    pca_corrected = AutoPCA(n_components=3)
     pca_corrected_result = pca_corrected.fit_transform(corrected_data)
     
     # 校正后 - 按批次着色
@@ -36,18 +36,21 @@ from sklearn.naive_bayes import GaussianNB
 from sklearn.neural_network import MLPClassifier
 
 # 聚类算法
-from sklearn.cluster import KMeans, DBSCAN, AgglomerativeClustering
+from sklearn.cluster import KMeans, DBSCAN
 from sklearn.mixture import GaussianMixture
 
 # 评估指标
 from sklearn.metrics import (accuracy_score, precision_score, recall_score, 
                            f1_score, roc_auc_score, roc_curve, 
-                           confusion_matrix, silhouette_score, 
+                           confusion_matrix, 
                            adjusted_rand_score, classification_report)
 
 # 特征选择
 from sklearn.feature_selection import SelectKBest, f_classif, RFE
 
+from cell_graph import GraphClustering, subsampled_silhouette
+from reduction import AutoPCA
+
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -604,7 +607,7 @@ def solution_3_cell_clustering():
     clustering_methods = {
         'K-Means': KMeans(n_clusters=3, random_state=42, n_init=10),
         'DBSCAN': DBSCAN(eps=1.0, min_samples=5),
-        '层次聚类': AgglomerativeClustering(n_clusters=3),
+        'kNN图聚类': GraphClustering(n_neighbors=15, random_state=42),
         '高斯混合': GaussianMixture(n_components=3, random_state=42)
     }
     
@@ -625,7 +628,7 @@ def solution_3_cell_clustering():
         n_clusters = len(unique_labels) - (1 if -1 in labels else 0)
         
         if n_clusters > 1 and n_clusters < len(df):
-            silhouette = silhouette_score(df_scaled, labels)
+            silhouette = subsampled_silhouette(df_scaled, labels)
             ari = adjusted_rand_score(true_labels, labels)
         else:
             silhouette = -1
@@ -1424,9 +1427,10 @@ def solution_5_cancer_subtype_project():
     
     # 3.6 方差分析
     ax = axes[5]
-    pca_full = PCA()
-    pca_full.fit(X_scaled)
-    explained_var = pca_full.explained_variance_ratio_[:20]
+    # 只画前20个主成分，不必做完整分解
+    pca_top = AutoPCA(n_components=20, random_state=42)
+    pca_top.fit(X_scaled)
+    explained_var = pca_top.explained_variance_ratio_
     
     ax.bar(range(1, 21), explained_var)
     ax.set_xlabel('主成分')
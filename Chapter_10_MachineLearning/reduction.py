@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chapter 10 工具模块：按矩阵形状自动选择的PCA
+
+PCA(svd_solver='full') 对整个 n × p 矩阵做完整SVD，O(n·p²)，还要求矩阵完全在内存中。
+AutoPCA 的用法与 sklearn 的 PCA 相同（fit / transform / fit_transform，
+components_、explained_variance_ratio_ 等属性），但按输入自动选择算法：
+
+- 'full'：小矩阵（或要求的主成分接近全部），直接用 sklearn 的完整SVD
+- 'randomized'：随机SVD（Halko等）。只需要 A·V 和 Aᵀ·U 两种乘法，
+  中心化隐式完成：(X - 1μᵀ)V = XV - 1(μᵀV)，稀疏矩阵不会被稠密化；
+  也接受 LinearOperator（例如 SparseExpression.scaled_operator()）
+- 'covariance'：细长矩阵（n ≥ 10p，p不超过4000）逐批累加 XᵀX 和列和，
+  对 p × p 协方差矩阵做特征分解。只需读一遍数据，全是矩阵乘法，
+  磁盘上放不进内存的 .npy 也按批流式读取（sklearn 1.5+ 的 covariance_eigh 同理）
+- 'incremental'：特征太多、协方差矩阵也放不下的磁盘矩阵，
+  按小批量从磁盘读取，用 IncrementalPCA 逐批拟合
+
+给出 cache_dir 时，拟合结果按 输入内容的哈希 + 参数 缓存为 .npz，相同输入再次拟合直接读取。
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator
+from sklearn.decomposition import PCA, IncrementalPCA
+
+
+# 行数或列数不超过这个值时直接用完整SVD
+FULL_SVD_MAX_DIM = 500
+
+# 超过这个字节数的磁盘矩阵按批流式处理
+MEMORY_LIMIT = 2e9
+
+# 协方差法的特征数上限：p × p 的float64协方差矩阵不超过约128 MB
+COVARIANCE_MAX_FEATURES = 4000
+
+CACHE_VERSION = 1
+
+_FITTED_ATTRIBUTES = ('components_', 'mean_', 'explained_variance_',
+                      'explained_variance_ratio_', 'singular_values_')
+
+
+def _prepare_input(X):
+    """统一输入：路径 → 只读内存映射；返回 (X, 类型)"""
+    if isinstance(X, (str, os.PathLike)):
+        X = np.load(X, mmap_mode='r')
+    if isinstance(X, LinearOperator):
+        return X, 'operator'
+    if sparse.issparse(X):
+        return sparse.csr_matrix(X), 'sparse'
+    if isinstance(X, np.memmap):
+        return X, 'memmap'
+    return np.asarray(X), 'dense'
+
+
+def choose_solver(kind, shape, n_components, nbytes=0, memory_limit=MEMORY_LIMIT,
+                  n_oversamples=10, n_power_iter=4):
+    """
+    按输入类型和形状选择算法
+
+    - 超过 memory_limit 的磁盘矩阵 → 特征不多时 'covariance'（一遍流式读取），否则 'incremental'
+    - 稀疏矩阵 → 'randomized'（隐式中心化）；线性算子同样，很小时直接展开成稠密矩阵
+    - 细长的稠密矩阵 → 'covariance'
+    - 其余稠密矩阵：完整SVD约 n·p·min(n,p) 次运算，随机SVD约 n·p·(k+过采样)·(2·幂迭代+2) 次，
+      取较小者；要求的主成分超过 min(n, p) 的80%时只能用完整SVD
+    """
+    n_rows, n_features = shape
+    tall = n_rows >= 10 * n_features and n_features <= COVARIANCE_MAX_FEATURES
+    if kind == 'memmap' and nbytes > memory_limit:
+        return 'covariance' if n_features <= COVARIANCE_MAX_FEATURES else 'incremental'
+    if kind == 'sparse':
+        return 'randomized'
+    if max(shape) <= FULL_SVD_MAX_DIM or n_components >= 0.8 * min(shape):
+        return 'full'
+    if kind == 'operator':
+        return 'randomized'
+    if tall:
+        return 'covariance'
+    randomized_passes = (n_components + n_oversamples) * (2 * n_power_iter + 2)
+    return 'full' if min(shape) <= randomized_passes else 'randomized'
+
+
+def _svd_flip(components, scores=None):
+    """符号约定：每个主成分绝对值最大的载荷为正（与sklearn一致，结果可复现）"""
+    signs = np.sign(components[np.arange(len(components)), np.abs(components).argmax(axis=1)])
+    signs[signs == 0] = 1
+    components *= signs[:, None]
+    if scores is not None:
+        scores *= signs
+    return components, scores
+
+
+def _centered_products(X, kind, mean):
+    """返回中心化矩阵 A = X - 1μᵀ 的 (A·V, Aᵀ·U) 两个乘法函数，A本身从不生成"""
+    if kind == 'operator':
+        return (lambda V: X.matmat(V)), (lambda U: X.rmatmat(U))
+    dtype = np.float32 if X.dtype == np.float32 else np.float64
+
+    def matmat(V):
+        return np.asarray(X @ V.astype(dtype), dtype=np.float64) - mean @ V
+
+    def rmatmat(U):
+        return np.asarray(X.T @ U.astype(dtype), dtype=np.float64) - np.outer(mean, U.sum(axis=0))
+
+    return matmat, rmatmat
+
+
+def randomized_svd(matmat, rmatmat, shape, n_components, n_oversamples=10, n_power_iter=4,
+                   random_state=0):
+    """
+    随机SVD：只通过 A·V 和 Aᵀ·U 访问矩阵
+
+    先用随机投影加幂迭代（每步QR正交化保持数值稳定）找到近似列空间Q，
+    再对小矩阵 QᵀA（(k+过采样) × p）做精确SVD。返回 (U, s, Vt)
+    """
+    n_rows, n_columns = shape
+    rng = np.random.default_rng(random_state)
+    size = min(n_components + n_oversamples, min(shape))
+    Q, _ = np.linalg.qr(matmat(rng.standard_normal((n_columns, size))))
+    for _ in range(n_power_iter):
+        Z, _ = np.linalg.qr(rmatmat(Q))
+        Q, _ = np.linalg.qr(matmat(Z))
+    B = rmatmat(Q).T
+    Ub, s, Vt = np.linalg.svd(B, full_matrices=False)
+    return (Q @ Ub)[:, :n_components], s[:n_components], Vt[:n_components]
+
+
+def _hash_array(digest, array, block_rows=65_536):
+    """按行块更新哈希，内存映射的矩阵也不会整体读入内存"""
+    digest.update(f"{array.shape}{array.dtype}".encode())
+    for start in range(0, max(len(array), 1), block_rows):
+        digest.update(np.ascontiguousarray(array[start:start + block_rows]).data)
+
+
+def input_fingerprint(X, kind):
+    """
+    输入的内容哈希，作为拟合结果缓存的键
+
+    内存映射的文件用 (路径, 大小, 修改时间)；稀疏矩阵哈希三个CSR数组；
+    线性算子无法读出内容，用它乘一个固定随机矩阵的结果代替
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if kind == 'memmap' and getattr(X, 'filename', None):
+        status = os.stat(X.filename)
+        digest.update(f"{os.path.abspath(X.filename)}{status.st_size}{status.st_mtime_ns}"
+                      f"{X.offset}{X.shape}{X.dtype}".encode())
+    elif kind == 'sparse':
+        for array in (X.data, X.indices, X.indptr):
+            _hash_array(digest, array)
+    elif kind == 'operator':
+        probe = np.random.default_rng(12345).standard_normal((X.shape[1], 2))
+        _hash_array(digest, np.round(X.matmat(probe), 8))
+    else:
+        _hash_array(digest, X)
+    return digest.hexdigest()
+
+
+class AutoPCA:
+    """
+    自动选择算法的PCA，接口与 sklearn.decomposition.PCA 相同
+
+    参数：
+        solver: 'auto'、'full'、'randomized'、'covariance' 或 'incremental'
+        batch_size: 增量PCA和逐批转换时每批的行数
+        memory_limit: 超过这个字节数的磁盘矩阵按批流式处理
+        cache_dir: 给出时按输入哈希缓存拟合结果
+
+    拟合后的属性：components_, mean_, explained_variance_, explained_variance_ratio_,
+    singular_values_, solver_（实际使用的算法）, cache_hit_
+    """
+
+    def __init__(self, n_components=50, solver='auto', n_oversamples=10, n_power_iter=4,
+                 batch_size=20_000, memory_limit=MEMORY_LIMIT, cache_dir=None, random_state=0):
+        self.n_components = n_components
+        self.solver = solver
+        self.n_oversamples = n_oversamples
+        self.n_power_iter = n_power_iter
+        self.batch_size = batch_size
+        self.memory_limit = memory_limit
+        self.cache_dir = cache_dir
+        self.random_state = random_state
+
+    def _cache_path(self, X, kind, solver):
+        key = hashlib.blake2b(digest_size=16)
+        key.update(input_fingerprint(X, kind).encode())
+        key.update(f"{CACHE_VERSION}|{self.n_components}|{solver}|{self.n_oversamples}|"
+                   f"{self.n_power_iter}|{self.random_state}".encode())
+        return os.path.join(self.cache_dir, f"pca_{key.hexdigest()}.npz")
+
+    def fit(self, X, total_variance=None):
+        self._fit(X, total_variance)
+        return self
+
+    def fit_transform(self, X, total_variance=None):
+        scores = self._fit(X, total_variance)
+        return scores if scores is not None else self.transform(X)
+
+    def _fit(self, X, total_variance):
+        """拟合；随机SVD和完整SVD顺便返回得分，磁盘上的矩阵不必再读一遍"""
+        X, kind = _prepare_input(X)
+        n_components = min(self.n_components, *X.shape)
+        solver = self.solver if self.solver != 'auto' else choose_solver(
+            kind, X.shape, n_components, getattr(X, 'nbytes', 0), self.memory_limit,
+            self.n_oversamples, self.n_power_iter)
+        self.solver_ = solver
+        self.cache_hit_ = False
+
+        cache_path = None
+        if self.cache_dir is not None:
+            cache_path = self._cache_path(X, kind, solver)
+            if os.path.exists(cache_path):
+                with np.load(cache_path) as cached:
+                    for name in _FITTED_ATTRIBUTES:
+                        setattr(self, name, cached[name])
+                self.cache_hit_ = True
+                return None
+
+        n_rows = X.shape[0]
+        scores = None
+        if solver == 'full':
+            data = X @ np.eye(X.shape[1]) if kind == 'operator' else X
+            data = data.toarray() if sparse.issparse(data) else np.asarray(data)
+            # 线性算子假定已中心化，完整SVD里的再次中心化不改变结果
+            model = PCA(n_components=n_components, svd_solver='full')
+            scores = model.fit_transform(data)
+            for name in _FITTED_ATTRIBUTES:
+                setattr(self, name, getattr(model, name))
+        elif solver == 'covariance':
+            self._fit_covariance(X, n_components)
+        elif solver == 'incremental':
+            model = IncrementalPCA(n_components=n_components)
+            # partial_fit 每批至少要 n_components 行：不足的最后一批并入前一批，不丢行
+            batch_size = max(self.batch_size, n_components)
+            bounds = list(range(0, n_rows, batch_size)) + [n_rows]
+            if len(bounds) > 2 and bounds[-1] - bounds[-2] < n_components:
+                del bounds[-2]
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                model.partial_fit(np.asarray(X[start:end], dtype=np.float64))
+            for name in _FITTED_ATTRIBUTES:
+                setattr(self, name, getattr(model, name))
+        elif solver == 'randomized':
+            if kind == 'operator':
+                mean = np.zeros(X.shape[1])
+            else:
+                mean = np.asarray(X.mean(axis=0), dtype=np.float64).ravel()
+            matmat, rmatmat = _centered_products(X, kind, mean)
+            _, s, Vt = randomized_svd(matmat, rmatmat, X.shape, n_components,
+                                      self.n_oversamples, self.n_power_iter, self.random_state)
+            # 得分取 A·Vᵀ 而不是 U·s：两者只差近似子空间之外的部分，
+            # 多一次乘法保证与 transform() 的结果完全一致
+            components, _ = _svd_flip(Vt.copy())
+            scores = matmat(components.T)
+            self.components_ = components
+            self.mean_ = mean
+            self.singular_values_ = s
+            self.explained_variance_ = s ** 2 / max(n_rows - 1, 1)
+            if total_variance is None and kind != 'operator':
+                total_variance = self._total_variance(X, kind, mean)
+            self.explained_variance_ratio_ = (self.explained_variance_ / total_variance
+                                              if total_variance is not None
+                                              else np.full(len(s), np.nan))
+        else:
+            raise ValueError(f"未知的PCA算法: {solver}（可选: auto, full, randomized, covariance, incremental）")
+
+        if cache_path is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            np.savez(cache_path, **{name: getattr(self, name) for name in _FITTED_ATTRIBUTES})
+        return scores
+
+    def _fit_covariance(self, X, n_components):
+        """逐批累加 XᵀX 与列和，对协方差矩阵做特征分解"""
+        n_rows, n_features = X.shape
+        gram = np.zeros((n_features, n_features))
+        sums = np.zeros(n_features)
+        for start in range(0, n_rows, self.batch_size):
+            batch = np.asarray(X[start:start + self.batch_size], dtype=np.float64)
+            gram += batch.T @ batch
+            sums += batch.sum(axis=0)
+        mean = sums / n_rows
+        covariance = (gram - n_rows * np.outer(mean, mean)) / max(n_rows - 1, 1)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1][:n_components]
+        variance = np.maximum(eigenvalues[order], 0.0)
+        self.components_, _ = _svd_flip(np.ascontiguousarray(eigenvectors[:, order].T))
+        self.mean_ = mean
+        self.explained_variance_ = variance
+        self.explained_variance_ratio_ = variance / np.trace(covariance)
+        self.singular_values_ = np.sqrt(variance * max(n_rows - 1, 1))
+
+    def _total_variance(self, X, kind, mean):
+        """各列样本方差之和（ddof=1，与 explained_variance_ 一致），稠密矩阵按批计算"""
+        n_rows = X.shape[0]
+        if kind == 'sparse':
+            squares = np.asarray(X.multiply(X).sum(axis=0), dtype=np.float64).ravel()
+        else:
+            squares = np.zeros(X.shape[1])
+            for start in range(0, n_rows, self.batch_size):
+                batch = np.asarray(X[start:start + self.batch_size], dtype=np.float64)
+                squares += (batch ** 2).sum(axis=0)
+        return (squares.sum() - n_rows * (mean ** 2).sum()) / max(n_rows - 1, 1)
+
+    def transform(self, X):
+        """投影到主成分上；稀疏矩阵和线性算子不做显式中心化，稠密矩阵按批计算"""
+        X, kind = _prepare_input(X)
+        components = self.components_
+        if kind == 'operator':
+            return X.matmat(components.T)
+        if kind == 'sparse':
+            return np.asarray(X @ components.T) - self.mean_ @ components.T
+        scores = np.empty((X.shape[0], len(components)))
+        for start in range(0, X.shape[0], self.batch_size):
+            batch = np.asarray(X[start:start + self.batch_size], dtype=np.float64)
+            scores[start:start + len(batch)] = (batch - self.mean_) @ components.T
+        return scores
+
+
+def _simulate_low_rank(path_or_none, n_rows, n_features, rank=20, seed=0, block_rows=100_000):
+    """
+    模拟 低秩信号 + 噪声 的矩阵（float32）；给出路径时逐块写入 .npy 内存映射
+    返回 (矩阵, 真实信号子空间的正交基 rank × n_features)
+    """
+    rng = np.random.default_rng(seed)
+    basis = np.linalg.qr(rng.standard_normal((n_features, rank)))[0].T
+    strength = np.geomspace(8, 2, rank)
+    if path_or_none is None:
+        X = np.empty((n_rows, n_features), dtype=np.float32)
+    else:
+        X = np.lib.format.open_memmap(path_or_none, mode='w+', dtype=np.float32,
+                                      shape=(n_rows, n_features))
+    for start in range(0, n_rows, block_rows):
+        n = min(block_rows, n_rows - start)
+        block = (rng.standard_normal((n, rank)) * strength) @ basis \
+            + rng.standard_normal((n, n_features))
+        X[start:start + n] = block + 3.0
+    if path_or_none is not None:
+        X.flush()
+    return X, basis
+
+
+def _subspace_similarity(components, basis):
+    """主成分与真实信号子空间的相似度：投影能量占比（1为完全一致）"""
+    k = min(len(components), len(basis))
+    return np.linalg.norm(components[:k] @ basis.T) ** 2 / k
+
+
+def benchmark_reduction(n_features=500, n_components=20, sizes=(10_000, 100_000, 1_000_000),
+                        seed=0):
+    """
+    性能测试：在1万、10万、100万行的 低秩信号 + 噪声 矩阵上比较
+    PCA(svd_solver='full')、sklearn默认的 PCA() 与 AutoPCA
+
+    100万行的矩阵（2 GB float32）写到磁盘，AutoPCA按批流式读取，并与强制
+    IncrementalPCA 对比；完整SVD需要先转成float64并复制一份（约8 GB），在这里跳过。
+    另外测试宽矩阵（走随机SVD）、缓存命中，以及稀疏单细胞矩阵的隐式中心化随机SVD
+    """
+    from sparse_expression import simulate_counts
+
+    print(f"\n⏱️ PCA性能（{n_features} 个特征，{n_components} 个主成分）")
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n_rows in sizes:
+            on_disk = n_rows * n_features * 4 > MEMORY_LIMIT / 2
+            path = os.path.join(tmpdir, f'matrix_{n_rows}.npy') if on_disk else None
+            X, basis = _simulate_low_rank(path, n_rows, n_features, n_components, seed)
+            print(f"   {n_rows:>9,} 行（{'磁盘 .npy' if on_disk else '内存'}，"
+                  f"{X.nbytes / 1e9:.2f} GB）:")
+
+            candidates = [('AutoPCA', lambda: AutoPCA(n_components, memory_limit=MEMORY_LIMIT / 2))]
+            if on_disk:
+                candidates.append(('incremental', lambda: AutoPCA(n_components, solver='incremental')))
+            else:
+                candidates = [('PCA(full)', lambda: PCA(n_components, svd_solver='full')),
+                              ('PCA()', lambda: PCA(n_components))] + candidates
+            for label, make in candidates:
+                model = make()
+                start_time = time.perf_counter()
+                model.fit_transform(path if on_disk else X)
+                elapsed = time.perf_counter() - start_time
+                timings[(n_rows, label)] = elapsed
+                solver = f"[{model.solver_}]" if label == 'AutoPCA' else ''
+                print(f"     {label:>10}{solver:<14} {elapsed:7.2f}秒，"
+                      f"信号子空间相似度 {_subspace_similarity(model.components_, basis):.4f}，"
+                      f"解释方差 {model.explained_variance_ratio_.sum():.3f}")
+            if on_disk:
+                print(f"     {'PCA(full)':>10}{'':<14} 跳过（需要约 {n_rows * n_features * 16 / 1e9:.0f} GB 内存）")
+            del X
+
+        # 宽矩阵：特征多、行数不够多，协方差法不划算，走随机SVD
+        n_rows, n_wide = sizes[0] * 2, n_features * 10
+        X, basis = _simulate_low_rank(None, n_rows, n_wide, n_components, seed)
+        print(f"   {n_rows:>9,} × {n_wide:,} 宽矩阵（内存，{X.nbytes / 1e9:.2f} GB）:")
+        for label, model in (('PCA(full)', PCA(n_components, svd_solver='full')),
+                             ('PCA()', PCA(n_components)),
+                             ('AutoPCA', AutoPCA(n_components))):
+            start_time = time.perf_counter()
+            model.fit_transform(X)
+            elapsed = time.perf_counter() - start_time
+            timings[('wide', label)] = elapsed
+            solver = f"[{model.solver_}]" if label == 'AutoPCA' else ''
+            print(f"     {label:>10}{solver:<14} {elapsed:7.2f}秒，"
+                  f"信号子空间相似度 {_subspace_similarity(model.components_, basis):.4f}")
+        del X
+
+        # 缓存：相同输入第二次拟合直接读取
+        X, _ = _simulate_low_rank(None, sizes[1], n_features, n_components, seed)
+        cache_dir = os.path.join(tmpdir, 'pca_cache')
+        for label in ('首次拟合', '缓存命中'):
+            model = AutoPCA(n_components, cache_dir=cache_dir)
+            start_time = time.perf_counter()
+            model.fit(X)
+            print(f"   缓存 {label}: {time.perf_counter() - start_time:.2f}秒"
+                  f"（cache_hit_={model.cache_hit_}）")
+        del X
+
+    # 稀疏单细胞矩阵：隐式z-score + 随机SVD，不稠密化
+    expression = simulate_counts(50_000, 10_000, 1000, seed=seed).normalize_total().log1p()
+    start_time = time.perf_counter()
+    scores, ratio = expression.pca(50)
+    timings['sparse'] = time.perf_counter() - start_time
+    print(f"   稀疏单细胞 {expression.shape[0]:,} × {expression.shape[1]:,}（隐式标准化）: "
+          f"{timings['sparse']:.2f}秒，前50个主成分解释方差 {ratio.sum():.3f}，"
+          f"稠密化需要 {expression.shape[0] * expression.shape[1] * 8 / 1e9:.1f} GB")
+    return timings
+
+
+if __name__ == "__main__":
+    benchmark_reduction()
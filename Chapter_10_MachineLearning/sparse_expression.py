@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chapter 10 工具模块：稀疏的单细胞表达矩阵
+
+10x数据约95%是0：3万基因 × 100万细胞的稠密float32矩阵要120 GB，
+而CSR只存非零值（float32）、列号（int32）和每行的起止位置，
+100万细胞、每个细胞约1500个检测到的基因时约12 GB。
+
+- 读取：Matrix Market（cellranger的 matrix.mtx[.gz] + barcodes + features）、
+  10x HDF5（需要h5py）、以及分块读取的CSV
+- 质控指标直接从CSR的 indptr/data 得到：每行非零个数即检测到的基因数，
+  每行 data 之和即总计数，不需要生成 (X == 0) 这样的稠密布尔矩阵
+- 文库大小归一化和 log1p 都只作用在非零值上，原地修改 data
+- 按行、按基因的累加和逐行缩放都按 indptr 切成行块进行，每块最多 BLOCK_VALUES 个非零值，
+  临时数组只有一块大小，峰值内存只比矩阵本身多约100 MB，不随非零值总数增长
+- 标准化（z-score）不真正执行：中心化会把所有的0变成非零，矩阵就不再稀疏了。
+  scaled_operator() 返回一个线性算子，乘法时再扣除均值、除以标准差，
+  交给PCA/SVD使用（中心化推迟到PCA里完成）
+"""
+
+import gzip
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import io, sparse
+from scipy.sparse.linalg import LinearOperator
+
+from reduction import AutoPCA
+
+
+def _open(path):
+    """按扩展名透明地打开 .gz 文件"""
+    return gzip.open(path, 'rb') if str(path).endswith('.gz') else open(path, 'rb')
+
+
+# 行块内非零值个数的上限：块内的float64临时数组为 8 × BLOCK_VALUES 字节
+BLOCK_VALUES = 1 << 22
+
+
+def _row_blocks(indptr):
+    """把行切成连续的块，每块最多 BLOCK_VALUES 个非零值（单行超过时独占一块）"""
+    n_rows = len(indptr) - 1
+    start = 0
+    while start < n_rows:
+        stop = int(np.searchsorted(indptr, indptr[start] + BLOCK_VALUES, side='right')) - 1
+        stop = min(max(stop, start + 1), n_rows)
+        yield start, stop
+        start = stop
+
+
+def _block(X, start, stop):
+    """X[start:stop] 的float64副本：只复制这一块的 data，indices直接共享"""
+    lo, hi = X.indptr[start], X.indptr[stop]
+    return sparse.csr_matrix((X.data[lo:hi].astype(np.float64), X.indices[lo:hi],
+                              X.indptr[start:stop + 1] - lo), shape=(stop - start, X.shape[1]))
+
+
+def _row_sums(X, columns=None):
+    """
+    CSR每行 data 之和（columns 为基因布尔掩码时只累加这些列）
+
+    逐块用累积和相减，空行也正确（reduceat对空段会出错）
+    """
+    sums = np.zeros(X.shape[0])
+    for start, stop in _row_blocks(X.indptr):
+        lo, hi = X.indptr[start], X.indptr[stop]
+        values = X.data[lo:hi]
+        if columns is not None:
+            values = np.where(columns[X.indices[lo:hi]], values, 0)
+        cumulative = np.concatenate([[0.0], np.cumsum(values, dtype=np.float64)])
+        sums[start:stop] = (cumulative[X.indptr[start + 1:stop + 1] - lo]
+                            - cumulative[X.indptr[start:stop] - lo])
+    return sums
+
+
+def _column_sums(X, squares=False):
+    """每列 data 之和（squares=True 时同时返回平方和），逐块用 bincount 累加"""
+    n_genes = X.shape[1]
+    sums = np.zeros(n_genes)
+    square_sums = np.zeros(n_genes)
+    for start, stop in _row_blocks(X.indptr):
+        lo, hi = X.indptr[start], X.indptr[stop]
+        values = X.data[lo:hi].astype(np.float64)
+        sums += np.bincount(X.indices[lo:hi], weights=values, minlength=n_genes)
+        if squares:
+            np.square(values, out=values)
+            square_sums += np.bincount(X.indices[lo:hi], weights=values, minlength=n_genes)
+    return (sums, square_sums) if squares else sums
+
+
+class SparseExpression:
+    """
+    细胞 × 基因 的CSR表达矩阵及其注释
+
+    属性：
+        X: scipy.sparse.csr_matrix（float32），行为细胞，列为基因
+        obs: 细胞注释DataFrame（索引为细胞条形码）
+        var: 基因注释DataFrame（索引为基因名）
+    """
+
+    def __init__(self, X, obs=None, var=None):
+        X = sparse.csr_matrix(X, dtype=np.float32)
+        X.eliminate_zeros()
+        X.sort_indices()
+        self.X = X
+        n_cells, n_genes = X.shape
+        self.obs = obs if obs is not None else pd.DataFrame(index=[f"cell_{i}" for i in range(n_cells)])
+        self.var = var if var is not None else pd.DataFrame(index=[f"gene_{j}" for j in range(n_genes)])
+
+    @property
+    def shape(self):
+        return self.X.shape
+
+    @property
+    def sparsity(self):
+        """零值所占比例"""
+        n_cells, n_genes = self.X.shape
+        return 1.0 - self.X.nnz / (n_cells * n_genes)
+
+    @property
+    def nbytes(self):
+        """CSR三个数组占用的字节数"""
+        return self.X.data.nbytes + self.X.indices.nbytes + self.X.indptr.nbytes
+
+    def __repr__(self):
+        return (f"SparseExpression({self.shape[0]:,} 细胞 × {self.shape[1]:,} 基因，"
+                f"稀疏度 {self.sparsity:.1%}，{self.nbytes / 1e6:.1f} MB)")
+
+    @classmethod
+    def from_dataframe(cls, df, meta_columns=()):
+        """由 细胞 × (注释列 + 基因列) 的DataFrame构建"""
+        meta_columns = [column for column in meta_columns if column in df.columns]
+        gene_columns = [column for column in df.columns if column not in meta_columns]
+        X = sparse.csr_matrix(df[gene_columns].to_numpy(dtype=np.float32))
+        obs = df[meta_columns].reset_index(drop=True)
+        return cls(X, obs, pd.DataFrame(index=pd.Index(gene_columns, name='gene')))
+
+    def qc_metrics(self, mito_prefix='MT-'):
+        """
+        每个细胞的质控指标：total_counts, n_genes_detected, pct_counts_mito
+
+        直接读取CSR数组：检测到的基因数 = indptr的差分，总计数 = 每行data之和
+        """
+        X = self.X
+        total = _row_sums(X)
+        detected = np.diff(X.indptr)
+        mito = np.asarray(self.var.index.str.upper().str.startswith(mito_prefix.upper()))
+        if mito.any():
+            mito_counts = _row_sums(X, columns=mito)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                pct_mito = np.where(total > 0, 100 * mito_counts / total, 0.0)
+        else:
+            pct_mito = np.zeros(len(total))
+        return pd.DataFrame({'total_counts': total, 'n_genes_detected': detected,
+                             'pct_counts_mito': pct_mito}, index=self.obs.index)
+
+    def gene_metrics(self):
+        """每个基因的 n_cells（表达该基因的细胞数）和 total_counts"""
+        X = self.X
+        n_genes = X.shape[1]
+        # bincount会把int32的列号整体转成int64，同样逐块统计
+        n_cells = np.zeros(n_genes, dtype=np.int64)
+        for start, stop in _row_blocks(X.indptr):
+            n_cells += np.bincount(X.indices[X.indptr[start]:X.indptr[stop]], minlength=n_genes)
+        return pd.DataFrame({
+            'n_cells': n_cells,
+            'total_counts': _column_sums(X),
+        }, index=self.var.index)
+
+    def subset(self, cells=None, genes=None):
+        """按布尔掩码或下标取细胞/基因子集，返回新对象"""
+        X, obs, var = self.X, self.obs, self.var
+        if cells is not None:
+            X, obs = X[cells], obs.iloc[np.flatnonzero(cells) if np.asarray(cells).dtype == bool
+                                        else cells]
+        if genes is not None:
+            X, var = X[:, genes], var.iloc[np.flatnonzero(genes) if np.asarray(genes).dtype == bool
+                                           else genes]
+        return SparseExpression(X, obs, var)
+
+    def filter(self, min_genes=0, min_counts=0, min_cells=0):
+        """过滤低质量细胞（检测基因数、总计数太少）和很少细胞表达的基因"""
+        qc = self.qc_metrics()
+        cells = (qc['n_genes_detected'].to_numpy() >= min_genes) & \
+            (qc['total_counts'].to_numpy() >= min_counts)
+        filtered = self.subset(cells=cells)
+        genes = filtered.gene_metrics()['n_cells'].to_numpy() >= min_cells
+        return filtered.subset(genes=genes)
+
+    def normalize_total(self, target_sum=None):
+        """
+        文库大小归一化（原地）：每个细胞的总计数缩放到 target_sum
+
+        target_sum 默认为所有细胞总计数的中位数；每个非零值乘以所在行的系数（逐块原地）
+        """
+        X = self.X
+        totals = _row_sums(X)
+        if target_sum is None:
+            target_sum = np.median(totals[totals > 0]) if (totals > 0).any() else 1.0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            factors = np.where(totals > 0, target_sum / totals, 0.0)
+        factors = factors.astype(np.float32)
+        counts = np.diff(X.indptr)
+        for start, stop in _row_blocks(X.indptr):
+            X.data[X.indptr[start]:X.indptr[stop]] *= np.repeat(factors[start:stop],
+                                                                counts[start:stop])
+        return self
+
+    def log1p(self):
+        """原地 log1p：log1p(0) = 0，所以只需变换非零值，稀疏结构不变"""
+        np.log1p(self.X.data, out=self.X.data)
+        return self
+
+    def gene_moments(self, ddof=0):
+        """
+        每个基因的均值和方差（隐式包含所有的0）
+
+        var = (Σx² - n·mean²) / (n - ddof)，只遍历非零值；ddof=0 与 StandardScaler 一致
+        """
+        n_cells = self.X.shape[0]
+        sums, squares = _column_sums(self.X, squares=True)
+        mean = sums / n_cells
+        var = np.maximum(squares - n_cells * mean ** 2, 0.0) / max(n_cells - ddof, 1)
+        return mean, var
+
+    def scaled_operator(self):
+        """
+        隐式z-score矩阵 Z = (X - 1·μᵀ)·diag(1/σ) 的线性算子（细胞 × 基因）
+
+        Z·v = X·(v/σ) - 1·(μ/σ)ᵀv，Zᵀ·u = (Xᵀu)/σ - (μ/σ)·Σu，
+        每次乘法只做一次稀疏矩阵乘法，Z本身从不生成；σ=0的基因缩放系数取0。
+        稀疏乘法逐行块进行（Xᵀu 用每块的转置视图），float32的 data 每次只升精度一块。
+        不支持 StandardScaler 之后常见的截断（max_value），截断无法隐式表示。
+        """
+        X = self.X
+        mean, var = self.gene_moments()
+        std = np.sqrt(var)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            inv_std = np.where(std > 0, 1.0 / std, 0.0)
+        shift = mean * inv_std
+
+        def matmat(V):
+            V = np.asarray(V, dtype=np.float64)
+            vector = V.ndim == 1
+            V = V.reshape(len(inv_std), -1)
+            scaled = V * inv_std[:, None]
+            result = np.empty((X.shape[0], V.shape[1]))
+            for start, stop in _row_blocks(X.indptr):
+                result[start:stop] = _block(X, start, stop) @ scaled
+            result -= shift @ V
+            return result.ravel() if vector else result
+
+        def rmatmat(U):
+            U = np.asarray(U, dtype=np.float64)
+            vector = U.ndim == 1
+            U = U.reshape(X.shape[0], -1)
+            result = np.zeros((X.shape[1], U.shape[1]))
+            for start, stop in _row_blocks(X.indptr):
+                result += _block(X, start, stop).T @ U[start:stop]
+            result *= inv_std[:, None]
+            result -= np.outer(shift, U.sum(axis=0))
+            return result.ravel() if vector else result
+
+        return LinearOperator(X.shape, matvec=matmat, rmatvec=rmatmat,
+                              matmat=matmat, rmatmat=rmatmat, dtype=np.float64)
+
+    def scaled_array(self):
+        """稠密的z-score矩阵，与 StandardScaler().fit_transform 相同——只适合小数据"""
+        return self.scaled_operator() @ np.eye(self.shape[1])
+
+    def pca(self, n_components=50, **kwargs):
+        """
+        隐式中心化、标准化后的PCA：把 scaled_operator() 交给 AutoPCA（大矩阵为随机SVD）
+
+        返回 (主成分得分 细胞 × n_components, 解释方差比例)。
+        solver='full' 时与 PCA().fit_transform(StandardScaler().fit_transform(X)) 相同
+        （各主成分的符号可能相反）；自动选择的随机SVD是近似解
+        """
+        n_cells = self.shape[0]
+        # z-score后每个非常数基因的样本方差（ddof=1）为 n/(n-1)
+        _, var = self.gene_moments()
+        total_variance = np.count_nonzero(var > 0) * n_cells / max(n_cells - 1, 1)
+        model = AutoPCA(n_components=min(n_components, min(self.shape) - 1), **kwargs)
+        scores = model.fit_transform(self.scaled_operator(), total_variance=total_variance)
+        return scores, model.explained_variance_ratio_
+
+
+def read_csv_sparse(path, meta_columns=(), chunksize=10_000):
+    """分块读取 细胞 × 基因 的CSV，每块转成CSR后拼接，内存中不会出现整个稠密矩阵"""
+    blocks, meta = [], []
+    gene_columns = None
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        present = [column for column in meta_columns if column in chunk.columns]
+        gene_columns = [column for column in chunk.columns if column not in present]
+        blocks.append(sparse.csr_matrix(chunk[gene_columns].to_numpy(dtype=np.float32)))
+        meta.append(chunk[present])
+    obs = pd.concat(meta, ignore_index=True)
+    return SparseExpression(sparse.vstack(blocks, format='csr'), obs,
+                            pd.DataFrame(index=pd.Index(gene_columns, name='gene')))
+
+
+def _read_lines(path):
+    with _open(path) as f:
+        return [line.decode().rstrip('\n').split('\t') for line in f if line.strip()]
+
+
+def _find_file(directory, names):
+    for name in names:
+        for candidate in (name, name + '.gz'):
+            path = os.path.join(directory, candidate)
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def read_mtx(matrix_path, barcodes_path=None, features_path=None, genes_by_cells=True):
+    """
+    读取Matrix Market格式的计数矩阵
+
+    cellranger输出的 matrix.mtx 是 基因 × 细胞（genes_by_cells=True），
+    读入的COO转置后转成 细胞 × 基因 的CSR。
+    features 文件取第二列（基因名）作为基因名，第一列作为 gene_id
+    """
+    with _open(matrix_path) as f:
+        matrix = io.mmread(f)
+    X = sparse.csr_matrix(matrix.T if genes_by_cells else matrix, dtype=np.float32)
+
+    obs = var = None
+    if barcodes_path is not None:
+        barcodes = [row[0] for row in _read_lines(barcodes_path)]
+        obs = pd.DataFrame(index=pd.Index(barcodes, name='barcode'))
+    if features_path is not None:
+        rows = _read_lines(features_path)
+        names = [row[1] if len(row) > 1 else row[0] for row in rows]
+        var = pd.DataFrame({'gene_id': [row[0] for row in rows]},
+                           index=pd.Index(names, name='gene'))
+    return SparseExpression(X, obs, var)
+
+
+def read_10x_mtx(directory):
+    """读取cellranger的输出目录（filtered_feature_bc_matrix/ 或旧版的 genes.tsv 布局）"""
+    matrix_path = _find_file(directory, ['matrix.mtx'])
+    if matrix_path is None:
+        raise FileNotFoundError(f"{directory} 中没有 matrix.mtx[.gz]")
+    return read_mtx(matrix_path,
+                    _find_file(directory, ['barcodes.tsv']),
+                    _find_file(directory, ['features.tsv', 'genes.tsv']))
+
+
+def read_10x_h5(path):
+    """
+    读取cellranger的 filtered_feature_bc_matrix.h5（需要安装h5py）
+
+    HDF5里存的是 基因 × 细胞 的CSC矩阵，其 (data, indices, indptr)
+    原样就是 细胞 × 基因 的CSR，不需要任何转换。支持v3（matrix/features）和v2（按基因组分组）布局
+    """
+    try:
+        import h5py
+    except ImportError as error:
+        raise ImportError("读取10x HDF5需要h5py: pip install h5py") from error
+
+    with h5py.File(path, 'r') as f:
+        group = f['matrix'] if 'matrix' in f else f[next(iter(f.keys()))]
+        n_genes, n_cells = group['shape'][:]
+        X = sparse.csr_matrix((group['data'][:].astype(np.float32), group['indices'][:],
+                               group['indptr'][:]), shape=(n_cells, n_genes))
+        barcodes = [b.decode() for b in group['barcodes'][:]]
+        if 'features' in group:
+            names = [n.decode() for n in group['features/name'][:]]
+            ids = [i.decode() for i in group['features/id'][:]]
+        else:
+            names = [n.decode() for n in group['gene_names'][:]]
+            ids = [i.decode() for i in group['genes'][:]]
+    return SparseExpression(X, pd.DataFrame(index=pd.Index(barcodes, name='barcode')),
+                            pd.DataFrame({'gene_id': ids}, index=pd.Index(names, name='gene')))
+
+
+def simulate_counts(n_cells, n_genes, genes_per_cell=1000, n_types=8, seed=0,
+                    block_size=10_000):
+    """
+    模拟稀疏的UMI计数矩阵：每种细胞类型有各自的高表达基因，
+    每个细胞按表达谱抽取约 genes_per_cell 次基因（重复抽中的计数相加）。
+    按细胞块直接生成CSR，不经过稠密矩阵
+    """
+    rng = np.random.default_rng(seed)
+    cell_types = rng.integers(0, n_types, n_cells)
+    profiles = np.tile(rng.lognormal(0, 1.2, n_genes), (n_types, 1))
+    for t in range(n_types):
+        profiles[t, rng.choice(n_genes, max(n_genes // 50, 1), replace=False)] *= 20
+    cumulative = np.cumsum(profiles, axis=1)
+    cumulative /= cumulative[:, -1:]
+    stacked = (cumulative + np.arange(n_types)[:, None]).ravel()
+
+    blocks = []
+    for start in range(0, n_cells, block_size):
+        types = cell_types[start:start + block_size]
+        draws = rng.poisson(genes_per_cell, len(types)).clip(1)
+        rows = np.repeat(np.arange(len(types)), draws)
+        row_types = types[rows]
+        # 各类型的累积分布依次平移 t，拼接后一次 searchsorted 完成所有抽样
+        position = np.searchsorted(stacked, row_types + rng.random(len(rows)))
+        genes = np.minimum(position - row_types * n_genes, n_genes - 1)
+        # COO转CSR时重复的 (细胞, 基因) 计数自动相加
+        blocks.append(sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, genes)),
+                                        shape=(len(types), n_genes)))
+    obs = pd.DataFrame({'cell_type': cell_types}, index=[f"CELL_{i:07d}" for i in range(n_cells)])
+    var = pd.DataFrame(index=[f"GENE_{j:05d}" for j in range(n_genes)])
+    return SparseExpression(sparse.vstack(blocks, format='csr'), obs, var)
+
+
+def benchmark_sparse_expression(n_cells=100_000, n_genes=20_000, genes_per_cell=1500, seed=0):
+    """
+    性能测试：10万细胞 × 2万基因的模拟UMI矩阵
+
+    - 内存：CSR与稠密float32矩阵对比，并按实测的每细胞非零数推算100万细胞 × 3万基因
+    - 质控指标、归一化 + 原地log1p、基因均值方差、隐式z-score算子乘法的用时
+    - 在子集上与 StandardScaler + PCA 的稠密结果对比，检查隐式标准化的正确性
+    - Matrix Market 写出并读回
+    """
+    from sklearn.decomposition import PCA
+    from sklearn.preprocessing import StandardScaler
+
+    print(f"\n⏱️ 稀疏单细胞矩阵性能（{n_cells:,} 细胞 × {n_genes:,} 基因）")
+    start_time = time.perf_counter()
+    expression = simulate_counts(n_cells, n_genes, genes_per_cell, seed=seed)
+    print(f"   模拟数据: {time.perf_counter() - start_time:.1f}秒，{expression}")
+    nnz_per_cell = expression.X.nnz / n_cells
+    dense_gb = n_cells * n_genes * 4 / 1e9
+    projected_gb = 1_000_000 * nnz_per_cell * 8 / 1e9
+    print(f"   稠密float32需要 {dense_gb:.1f} GB；按每细胞 {nnz_per_cell:.0f} 个非零值推算，"
+          f"100万细胞的CSR约 {projected_gb:.1f} GB（稠密3万基因需 120 GB）")
+
+    timings = {}
+    steps = [
+        ('质控指标', lambda: expression.qc_metrics()),
+        ('归一化 + 原地log1p', lambda: expression.normalize_total().log1p()),
+        ('基因均值/方差', lambda: expression.gene_moments()),
+    ]
+    for label, step in steps:
+        start_time = time.perf_counter()
+        step()
+        timings[label] = time.perf_counter() - start_time
+        print(f"   {label}: {timings[label]:.2f}秒")
+
+    operator = expression.scaled_operator()
+    block = np.random.default_rng(seed).normal(size=(n_genes, 20))
+    start_time = time.perf_counter()
+    operator @ block
+    timings['matmat'] = time.perf_counter() - start_time
+    print(f"   隐式z-score矩阵 × 20列: {timings['matmat']:.2f}秒（不生成 {dense_gb * 2:.0f} GB 的稠密float64矩阵）")
+
+    subset = expression.subset(cells=np.arange(2000), genes=np.arange(2000))
+    dense = subset.X.toarray().astype(np.float64)
+    scaled = StandardScaler().fit_transform(dense)
+    same_scaling = np.allclose(subset.scaled_array(), scaled, atol=1e-6)
+    # 这里检查的是隐式标准化本身，用精确的完整SVD比较
+    scores, ratio = subset.pca(10, solver='full')
+    reference = PCA(n_components=10, svd_solver='full').fit(scaled)
+    same_pca = (np.allclose(ratio, reference.explained_variance_ratio_, rtol=1e-6)
+                and np.allclose(np.abs(scores), np.abs(reference.transform(scaled)), atol=1e-5))
+    print(f"   子集上与 StandardScaler / PCA 一致: "
+          f"{'✓' if same_scaling else '✗'} / {'✓' if same_pca else '✗'}")
+
+    mtx_subset = expression.subset(cells=np.arange(min(n_cells, 20_000)))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with gzip.open(os.path.join(tmpdir, 'matrix.mtx.gz'), 'wb') as f:
+            io.mmwrite(f, mtx_subset.X.T.tocoo())
+        with gzip.open(os.path.join(tmpdir, 'barcodes.tsv.gz'), 'wt') as f:
+            f.writelines(f"{barcode}\n" for barcode in mtx_subset.obs.index)
+        with gzip.open(os.path.join(tmpdir, 'features.tsv.gz'), 'wt') as f:
+            f.writelines(f"ENSG{j:011d}\t{gene}\tGene Expression\n"
+                         for j, gene in enumerate(mtx_subset.var.index))
+        start_time = time.perf_counter()
+        loaded = read_10x_mtx(tmpdir)
+        timings['read_mtx'] = time.perf_counter() - start_time
+    same = (loaded.X != mtx_subset.X).nnz == 0 and loaded.var.index.equals(mtx_subset.var.index)
+    print(f"   读取 matrix.mtx.gz（{mtx_subset.shape[0]:,} 细胞）: {timings['read_mtx']:.2f}秒，"
+          f"与写出的矩阵一致: {'✓' if same else '✗'}")
+    return timings
+
+
+if __name__ == "__main__":
+    benchmark_sparse_expression()
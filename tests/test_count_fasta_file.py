@@ -0,0 +1,36 @@
+"""
+count_fasta_file 的测试（Chapter 05 批量处理）
+
+分块计数要与按记录解析的 iter_fasta_records 一致，第一个'>'之前的内容不计入。
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Chapter_05_FileIO"))
+
+from practice_solution import count_fasta_file, iter_fasta_records  # noqa: E402
+
+
+def record_counts(path):
+    sequences = [sequence for _, sequence in iter_fasta_records(path) if sequence]
+    return {
+        'count': len(sequences),
+        'total_length': sum(len(sequence) for sequence in sequences),
+        'gc_count': sum(sequence.upper().count(b'G') + sequence.upper().count(b'C')
+                        for sequence in sequences),
+    }
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 4096])
+def test_leading_text_is_not_counted(tmp_path, chunk_size):
+    path = tmp_path / "leading.fasta"
+    path.write_bytes(b"GGCC junk before any header\n\n"
+                     b">seq1 first\nACGTgc\nAA\n>empty\n>seq2\nccgg\n")
+
+    counts = count_fasta_file(path, chunk_size)
+
+    assert counts == {'count': 2, 'total_length': 12, 'gc_count': 8}
+    assert counts == record_counts(path)
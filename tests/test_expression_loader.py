@@ -0,0 +1,48 @@
+"""
+expression_loader 列式缓存的回归测试（Chapter 06）
+
+按换行符数预分配的 .npy 要截到实际解析出的行数：
+末尾空行、CRLF换行都不能让缓存行数和 pd.read_csv 不一致。
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Chapter_06_Pandas_Intro"))
+
+from expression_loader import load_expression_matrix  # noqa: E402
+
+ROWS = [
+    "gene_id,gene_type,sample_1,sample_2",
+    "G1,protein_coding,1.5,2.0",
+    "G2,lncRNA,0.0,3.25",
+    "G3,protein_coding,7.0,-1.0",
+]
+
+
+@pytest.mark.parametrize("newline, ending", [
+    ("\n", "\n\n"),        # 末尾多一个空行
+    ("\r\n", "\r\n"),      # CRLF
+    ("\r\n", "\r\n\r\n"),  # CRLF + 末尾空行
+    ("\n", ""),            # 最后一行没有换行符
+])
+def test_cache_matches_read_csv(tmp_path, newline, ending):
+    path = tmp_path / "expression.csv"
+    path.write_bytes((newline.join(ROWS) + ending).encode())
+
+    loaded = load_expression_matrix(str(path), chunksize=2)
+    expected = pd.read_csv(path)
+
+    assert len(loaded) == len(ROWS) - 1
+    assert list(loaded.columns) == list(expected.columns)
+    assert list(loaded["gene_id"]) == list(expected["gene_id"])
+    np.testing.assert_array_equal(loaded[["sample_1", "sample_2"]].to_numpy(),
+                                  expected[["sample_1", "sample_2"]].to_numpy(np.float32))
+
+    # 第二次走缓存（内存映射），形状同样正确
+    _, values, numeric = load_expression_matrix(str(path), mmap=True)
+    assert values.shape == (len(ROWS) - 1, len(numeric))
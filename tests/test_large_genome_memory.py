@@ -0,0 +1,88 @@
+"""
+process_large_genome 的内存回归测试（Chapter 05 练习6）
+
+用小的 chunk_size 处理一个几MB的染色体，检查tracemalloc峰值不随染色体长度增长，
+并且长度、GC数、N数与逐行朴素统计一致。
+"""
+
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Chapter_05_FileIO"))
+
+from practice_solution import measure_peak_memory, process_large_genome  # noqa: E402
+
+CHUNK_SIZE = 64 * 1024
+
+
+def write_genome(path, chromosomes, line_width=60):
+    """写出多行FASTA；chromosomes 为 [(标题, 序列), ...]"""
+    with open(path, "w") as f:
+        for header, sequence in chromosomes:
+            f.write(f">{header}\n")
+            for i in range(0, len(sequence), line_width):
+                f.write(sequence[i:i + line_width] + "\n")
+
+
+def naive_counts(path):
+    """逐行朴素统计：{染色体: (长度, GC数, N数)}"""
+    counts = {}
+    name = None
+    with open(path) as f:
+        for line in f:
+            if line.startswith(">"):
+                name = line[1:].split()[0]
+                counts[name] = [0, 0, 0]
+                continue
+            sequence = line.strip().upper()
+            counts[name][0] += len(sequence)
+            counts[name][1] += sequence.count("G") + sequence.count("C")
+            counts[name][2] += sequence.count("N")
+    return {name: tuple(values) for name, values in counts.items()}
+
+
+@pytest.fixture(scope="module")
+def genome_file(tmp_path_factory):
+    rng = random.Random(5)
+    big = "".join(rng.choices("ACGTacgtN", weights=[8, 8, 8, 8, 2, 2, 2, 2, 1],
+                              k=5_000_000))
+    small = "".join(rng.choices("ACGT", k=1234))
+    path = tmp_path_factory.mktemp("genome") / "big_chromosome.fasta"
+    write_genome(path, [("chr1 big test chromosome", big), ("chrM", small)])
+    return path
+
+
+def test_peak_memory_bounded_by_chunk_size(genome_file):
+    assert genome_file.stat().st_size > 4 * 1024 * 1024
+    peak = measure_peak_memory(process_large_genome, genome_file,
+                               chunk_size=CHUNK_SIZE)
+    assert peak < 4 * CHUNK_SIZE
+
+
+@pytest.mark.parametrize("chunk_size", [7, CHUNK_SIZE])
+def test_counts_match_naive(genome_file, chunk_size):
+    expected = naive_counts(genome_file)
+    records = list(process_large_genome(genome_file, chunk_size=chunk_size))
+
+    assert [record["chromosome"] for record in records] == list(expected)
+    for record in records:
+        length, gc, n_count = expected[record["chromosome"]]
+        assert record["length"] == length
+        assert record["n_count"] == n_count
+        assert record["gc_content"] == pytest.approx(gc / length * 100)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 1024])
+def test_trailing_header_without_newline(tmp_path, chunk_size):
+    path = tmp_path / "trailing_header.fasta"
+    path.write_bytes(b">chr1 first\nACGTN\nGG\n>chr2 empty")
+
+    records = list(process_large_genome(path, chunk_size=chunk_size))
+
+    assert [(record["chromosome"], record["length"]) for record in records] == \
+        [("chr1", 7), ("chr2", 0)]
+    assert records[0]["n_count"] == 1
+    assert records[1]["position"] == path.stat().st_size
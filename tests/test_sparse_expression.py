@@ -0,0 +1,106 @@
+"""
+SparseExpression 的分块计算测试（Chapter 10）
+
+质控、归一化、基因均值方差和隐式z-score算子都按行块处理：
+结果要与稠密计算一致，tracemalloc峰值要远小于矩阵本身。
+"""
+
+import sys
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Chapter_10_MachineLearning"))
+
+import sparse_expression  # noqa: E402
+from sparse_expression import SparseExpression  # noqa: E402
+
+
+def random_counts(n_cells, n_genes, genes_per_cell, seed=0):
+    """随机CSR计数矩阵，含空行和一个特别长的行"""
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(genes_per_cell, n_cells)
+    counts[[1, 5]] = 0
+    counts[3] = 3 * genes_per_cell
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    indices = rng.integers(0, n_genes, indptr[-1]).astype(np.int32)
+    data = (rng.poisson(2, indptr[-1]) + 1).astype(np.float32)
+    X = sparse.csr_matrix((data, indices, indptr), shape=(n_cells, n_genes))
+    X.sum_duplicates()
+    var = pd.DataFrame(index=[f"MT-{j}" if j < 3 else f"GENE_{j}" for j in range(n_genes)])
+    return SparseExpression(X, var=var)
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def test_blocked_results_match_dense(monkeypatch):
+    # 块很小：多数块只有一两行，长行独占一块
+    monkeypatch.setattr(sparse_expression, "BLOCK_VALUES", 50)
+    expression = random_counts(300, 40, 12)
+    dense = expression.X.toarray().astype(np.float64)
+
+    qc = expression.qc_metrics()
+    total = dense.sum(axis=1)
+    np.testing.assert_allclose(qc["total_counts"], total)
+    np.testing.assert_array_equal(qc["n_genes_detected"], (dense > 0).sum(axis=1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pct_mito = np.where(total > 0, 100 * dense[:, :3].sum(axis=1) / total, 0.0)
+    np.testing.assert_allclose(qc["pct_counts_mito"], pct_mito)
+    np.testing.assert_allclose(expression.gene_metrics()["total_counts"], dense.sum(axis=0))
+
+    expression.normalize_total(target_sum=100).log1p()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        factors = np.where(total > 0, 100 / total, 0.0)
+    normalized = np.log1p(dense * factors[:, None])
+    np.testing.assert_allclose(expression.X.toarray(), normalized, rtol=1e-6)
+
+    mean, var = expression.gene_moments()
+    np.testing.assert_allclose(mean, normalized.mean(axis=0), rtol=1e-6)
+    np.testing.assert_allclose(var, normalized.var(axis=0), rtol=1e-5, atol=1e-10)
+
+    std = normalized.std(axis=0)
+    scaled = np.where(std > 0, (normalized - normalized.mean(axis=0)) / np.where(std > 0, std, 1), 0)
+    operator = expression.scaled_operator()
+    rng = np.random.default_rng(1)
+    V, U = rng.normal(size=(40, 3)), rng.normal(size=(300, 3))
+    np.testing.assert_allclose(operator @ V, scaled @ V, atol=1e-5)
+    np.testing.assert_allclose(operator.T @ U, scaled.T @ U, atol=1e-5)
+    np.testing.assert_allclose(operator.rmatvec(U[:, 0]), scaled.T @ U[:, 0], atol=1e-5)
+
+
+@pytest.fixture(scope="module")
+def large_expression():
+    return random_counts(20_000, 5_000, 100)
+
+
+def test_peak_memory_bounded_by_block(monkeypatch, large_expression):
+    monkeypatch.setattr(sparse_expression, "BLOCK_VALUES", 1 << 16)
+    expression = large_expression
+    bound = expression.nbytes / 4
+    rng = np.random.default_rng(2)
+    V = rng.normal(size=(expression.shape[1], 5))
+    U = rng.normal(size=(expression.shape[0], 5))
+
+    assert peak_memory(expression.qc_metrics) < bound
+    assert peak_memory(lambda: expression.normalize_total().log1p()) < bound
+    assert peak_memory(expression.gene_moments) < bound
+    assert peak_memory(expression.gene_metrics) < bound
+
+    def operator_products():
+        operator = expression.scaled_operator()
+        operator @ V
+        operator.T @ U
+
+    assert peak_memory(operator_products) < bound